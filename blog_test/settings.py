@@ -53,11 +53,13 @@ SITE_ID = 1
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'modules.system.middleware.PageCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'modules.system.middleware.ActiveUserMiddleware',
@@ -99,10 +101,12 @@ DATABASES = {
 
 # Redis cache
 
+REDIS_LOCATION = env('REDIS_LOCATION')
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
-        'LOCATION': env('REDIS_LOCATION'),
+        'LOCATION': REDIS_LOCATION,
     }
 }
 # END Redis
@@ -123,10 +127,129 @@ CELERY_BEAT_SCHEDULE = {
     'backup_database': {
         'task': 'modules.services.tasks.dbackup_task',  # Путь к задаче указанной в tasks.py
         'schedule': crontab(hour=0, minute=0),  # Резервная копия будет создаваться каждый день в полночь
-    }
+    },
+    'backup_media': {
+        'task': 'modules.services.tasks.mbackup_task',
+        'schedule': crontab(hour=0, minute=30),  # Снимок медиа (только новые и измененные файлы) каждую ночь
+    },
+    'flush_presence': {
+        'task': 'modules.services.tasks.flush_presence_task',
+        'schedule': crontab(minute='*/5'),  # Время активности пользователей переносится в last_login каждые 5 минут
+    },
+    'refresh_sidebar': {
+        'task': 'modules.services.tasks.refresh_sidebar_task',
+        'schedule': crontab(minute='*/10'),  # Блоки сайдбара с окном времени обновляются каждые 10 минут
+    },
+    'flush_view_buffer': {
+        'task': 'modules.services.tasks.flush_view_buffer_task',
+        'schedule': crontab(minute='*'),  # Буфер просмотров сбрасывается в БД каждую минуту
+    },
+    'generate_sitemaps': {
+        'task': 'modules.services.tasks.generate_sitemaps_task',
+        'schedule': crontab(minute='*/15'),  # Шарды карты сайта с измененными статьями перегенерируются каждые 15 минут
+    },
+    'rollup_views': {
+        'task': 'modules.services.tasks.rollup_views_task',
+        'schedule': crontab(hour=3, minute=30),  # Старые просмотры сворачиваются в дневные агрегаты каждую ночь
+    },
+    'gc_editor_uploads': {
+        'task': 'modules.services.tasks.gc_editor_uploads_task',
+        'schedule': crontab(hour=4, minute=0),  # Файлы редактора без ссылок из статей удаляются каждую ночь
+    },
 }
 # END Celery
 
+# Счетчик просмотров статей
+# 'sync' - запись просмотра в БД во время запроса, 'buffered' - запись в буфер Redis со сбросом задачей Celery,
+# 'hll' - приблизительный подсчет уникальных посетителей в HyperLogLog Redis (по ключу на статью и день)
+# (при переходе в 'hll' просмотры из БД переносятся в HyperLogLog первым запуском sync_hll_view_counts)
+VIEW_COUNT_MODE = env('VIEW_COUNT_MODE', default='sync')
+VIEW_COUNT_FLUSH_BATCH = 5000
+VIEW_HLL_DAY_TTL = 60 * 60 * 24 * 35
+# Популярные статьи: окно в днях, затухание веса за каждый час давности (1.0 - без затухания) и размер топа
+POPULAR_ARTICLES_WINDOW_DAYS = 7
+POPULAR_ARTICLES_DECAY = 1.0
+POPULAR_ARTICLES_LIMIT = 5
+# Хранение сырых просмотров: старше VIEW_RETENTION_DAYS дней они сворачиваются в дневные агрегаты,
+# таблица просмотров (после команды partition_views) разбита на месячные секции, создаваемые заранее
+VIEW_RETENTION_DAYS = 90
+VIEW_ROLLUP_BATCH = 50000
+VIEW_PARTITIONS_AHEAD = 2
+# END Счетчик просмотров
+
+# Пагинация списков статей: 'cursor' - курсорная (keyset), 'page' - стандартная по номерам страниц
+PAGINATION_MODE = env('PAGINATION_MODE', default='cursor')
+
+# Лента подписок: максимум статей в ленте подписчика и порог подписчиков,
+# после которого статьи автора не рассылаются по лентам, а подмешиваются при чтении
+TIMELINE_MAX_LENGTH = 1000
+TIMELINE_FANOUT_LIMIT = 5000
+
+# Кеш страниц для анонимных посетителей (секунды, 0 - отключен).
+# Страницы сбрасываются по ключам статей, категорий и тегов, блоки сайдбара на них обновляются по истечении времени
+PAGE_CACHE_TIMEOUT = int(env('PAGE_CACHE_TIMEOUT', default=60 * 5))
+
+# Карта сайта: статические файлы индекса и шардов (по SITEMAP_SHARD_SIZE статей, лимит протокола - 50000 ссылок)
+SITEMAP_ROOT = BASE_DIR / 'media' / 'sitemaps'
+SITEMAP_SHARD_SIZE = 10000
+
+# RSS-ленты: количество статей в ленте и время хранения готового XML в кеше страниц
+# (ленты сбрасываются при публикации и изменении статей, поэтому время большое)
+FEED_ITEMS_LIMIT = 20
+FEED_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Копии превью статей: ширины (px) для srcset и каталог в MEDIA_ROOT
+THUMBNAIL_WIDTHS = [320, 640, 960]
+THUMBNAIL_RENDITIONS_DIR = 'images/thumbnail/renditions'
+
+# Аватары: размеры квадратных копий (px), каталоги копий и идентиконов в MEDIA_ROOT
+AVATAR_SIZES = [60, 120, 240]
+AVATAR_NORMALIZED_DIR = 'images/avatars/normalized'
+AVATAR_IDENTICONS_DIR = 'images/avatars/identicons'
+
+# Пересжатие загруженных изображений (команда reprocess_media): каталоги в MEDIA_ROOT и файл манифеста
+MEDIA_REPROCESS_DIRS = ['images/thumbnail', 'images/avatars', 'uploads']
+MEDIA_REPROCESS_MANIFEST = '.reprocess-manifest.json'
+
+# Резервные копии БД (команды dbackup / drestore): каталог, строк в одной сжатой части, исключаемые модели.
+# Полная копия создается в день недели BACKUP_FULL_WEEKDAY (0 - понедельник), в остальные дни - инкрементальная,
+# хранятся последние BACKUP_KEEP_FULL полных копий вместе с инкрементальными после них
+BACKUP_ROOT = BASE_DIR / 'backups'
+BACKUP_CHUNK_ROWS = 50000
+BACKUP_EXCLUDE_MODELS = ['admin.logentry', 'sessions.session']
+# неизменяемые таблицы: в инкрементальную копию попадают только новые строки (остальные модели без поля
+# auto_now выгружаются целиком)
+BACKUP_APPEND_ONLY_MODELS = ['blog.viewcount', 'system.feedback']
+# инкрементальная копия захватывает строки, измененные за BACKUP_WATERMARK_OVERLAP секунд до снимка предыдущей
+# копии: время auto_now выставляется до фиксации транзакции (и по часам сервера приложения)
+BACKUP_WATERMARK_OVERLAP = 300
+BACKUP_RESTORE_WORKERS = 4
+BACKUP_FULL_WEEKDAY = 6
+BACKUP_KEEP_FULL = 4
+
+# Снимки медиа (команда mbackup): каталог, каталоги MEDIA_ROOT без копирования, потоки хеширования
+# и количество хранимых снимков (неизмененные файлы в снимках - жесткие ссылки на предыдущий снимок)
+MEDIA_BACKUP_ROOT = BASE_DIR / 'media-backups'
+MEDIA_BACKUP_EXCLUDE = ['sitemaps']
+MEDIA_BACKUP_WORKERS = 8
+MEDIA_BACKUP_KEEP = 14
+
+# Статус "онлайн": пользователь в сети PRESENCE_ONLINE_SECONDS секунд после последней активности,
+# активность записывается в Redis не чаще раза в PRESENCE_WRITE_INTERVAL секунд (в каждом процессе)
+PRESENCE_ONLINE_SECONDS = 300
+PRESENCE_WRITE_INTERVAL = 60
+
+# Кеширование блоков сайдбара (секунды)
+SIDEBAR_CACHE_TIMEOUT = 60 * 60 * 24
+SIDEBAR_WINDOW_CACHE_TIMEOUT = 60 * 15
+
+# Комментарии к статье: количество веток (корневых комментариев) на странице и время жизни HTML ветки в кеше
+COMMENTS_PER_PAGE = 20
+COMMENT_THREAD_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Количество похожих статей, хранимых для каждой статьи (из них случайно выводятся 6)
+SIMILAR_ARTICLES_LIMIT = 20
+
 
 # Обновленное логирование с возможностью заходить по email
 AUTHENTICATION_BACKENDS = [
@@ -284,5 +407,14 @@ CKEDITOR_5_CONFIGS = {
         }
     }
 }
-CKEDITOR_5_FILE_STORAGE = 'modules.services.utils.CkeditorCustomStorage'
+# Хранение файлов редактора: 'dated' - в папках по дате под исходным именем,
+# 'content' - по хешу содержимого (одинаковые файлы хранятся один раз, изображения сжимаются при загрузке,
+# файлы без ссылок из статей удаляет gc_editor_uploads спустя EDITOR_UPLOAD_GC_GRACE_HOURS часов)
+CKEDITOR_UPLOAD_MODE = env('CKEDITOR_UPLOAD_MODE', default='content')
+CKEDITOR_5_FILE_STORAGE = {
+    'dated': 'modules.services.utils.CkeditorCustomStorage',
+    'content': 'modules.services.editor_uploads.ContentAddressedCkeditorStorage',
+}[CKEDITOR_UPLOAD_MODE]
+EDITOR_UPLOAD_MAX_DIMENSION = 2560
+EDITOR_UPLOAD_GC_GRACE_HOURS = 24
 ## END CKEditor-5
@@ -21,7 +21,9 @@ from django.conf.urls.static import static
 from django.contrib.sitemaps.views import sitemap
 
 from modules.blog.sitemaps import ArticleSitemap, StaticSitenap
-from modules.blog.feeds import LatestArticlesFeed
+from modules.blog.feeds import LatestArticlesFeed, CategoryArticlesFeed, TagArticlesFeed, AuthorArticlesFeed
+from modules.services.conditional import conditional_page, articles_feed_validators, category_feed_validators, \
+    tag_feed_validators, author_feed_validators
 
 
 sitemaps = {
@@ -37,8 +39,16 @@ handler500 = 'modules.system.views.tr_handler500'
 urlpatterns = [
     path('ckeditor5/', include('django_ckeditor_5.urls')),
     path('admin/', admin.site.urls),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
-    path('feeds/latest/', LatestArticlesFeed(), name='latest_articles_feed'),
+    path('sitemap.xml', conditional_page(articles_feed_validators)(sitemap), {'sitemaps': sitemaps},
+         name='django.contrib.sitemaps.views.sitemap'),
+    path('feeds/latest/', conditional_page(articles_feed_validators)(LatestArticlesFeed()),
+         name='latest_articles_feed'),
+    path('feeds/category/<str:slug>/', conditional_page(category_feed_validators)(CategoryArticlesFeed()),
+         name='category_articles_feed'),
+    path('feeds/tag/<str:tag>/', conditional_page(tag_feed_validators)(TagArticlesFeed()),
+         name='tag_articles_feed'),
+    path('feeds/author/<str:slug>/', conditional_page(author_feed_validators)(AuthorArticlesFeed()),
+         name='author_articles_feed'),
     path('', include('modules.blog.urls')),
     path('', include('modules.system.urls')),
 
@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from mptt.admin import DraggableMPTTAdmin
-from .models import Article, Category, Comment, ViewCount
+from .models import Article, Category, Comment, DailyViewCount, EditorUpload, ViewCount
 
 
 @admin.register(Category)
@@ -24,16 +24,16 @@ class ArticleAdmin(admin.ModelAdmin):
     """
     Админ-панель модели статей
     """
-    list_display = ('title', 'author', 'time_create',)
+    list_display = ('title', 'author', 'time_create', 'view_count', 'rating_sum')
 
 
 @admin.register(Comment)
-class CommentAdmin(DraggableMPTTAdmin):
+class CommentAdmin(admin.ModelAdmin):
     """
     Админ-панель модели комментариев
     """
-    list_display = ('tree_actions', 'indented_title', 'article', 'author', 'time_create', 'status')
-    mptt_level_indent = 2
+    list_display = ('id', 'article', 'author', 'parent', 'time_create', 'status')
+    raw_id_fields = ('parent',)
     list_display_links = ('article',)
     list_filter = ('time_create', 'time_update', 'author')
     list_editable = ('status',)
@@ -42,3 +42,16 @@ class CommentAdmin(DraggableMPTTAdmin):
 @admin.register(ViewCount)
 class ViewCountAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(DailyViewCount)
+class DailyViewCountAdmin(admin.ModelAdmin):
+    list_display = ('article', 'date', 'views')
+    list_filter = ('date',)
+    raw_id_fields = ('article',)
+
+
+@admin.register(EditorUpload)
+class EditorUploadAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'time_create')
+    raw_id_fields = ('articles',)
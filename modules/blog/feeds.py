@@ -1,16 +1,30 @@
+from django.conf import settings
 from django.contrib.syndication.views import Feed
+from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from taggit.models import Tag
 
-from .models import Article
+from .models import Article, Category
+from ..system.models import Profile
 
 
-class LatestArticlesFeed(Feed):
-    title = "Ваш сайт - последние статьи"
-    link = '/feeds/'
+class ArticlesFeed(Feed):
+    """
+    Базовая RSS-лента опубликованных статей.
+    Готовый XML кешируется PageCacheMiddleware по ключам сброса (surrogate keys) ленты и ее статей,
+    поэтому опрос ленты читателями - одно чтение из кеша
+    """
     description = "Новые статьи на моем сайте."
 
-    def items(self):
-        return Article.objects.order_by('-time_create')[:5]
+    def get_queryset(self, obj):
+        return Article.objects.filter(status='published')
+
+    def get_surrogate_keys(self, obj):
+        return []
+
+    def items(self, obj):
+        return self.get_queryset(obj).only('title', 'slug', 'short_description', 'time_create') \
+            .order_by('-time_create')[:settings.FEED_ITEMS_LIMIT]
 
     def item_title(self, item):
         return item.title
@@ -20,3 +34,94 @@ class LatestArticlesFeed(Feed):
 
     def item_link(self, item):
         return reverse('articles_detail', args=[item.slug])
+
+    def item_pubdate(self, item):
+        return item.time_create
+
+    def item_extra_kwargs(self, item):
+        # id статьи нужен только для ключей сброса, генератор RSS его не выводит
+        return {'article_id': item.pk}
+
+    def get_feed(self, obj, request):
+        feed = super().get_feed(obj, request)
+        request.feed_surrogate_keys = [
+            *self.get_surrogate_keys(obj), *(f'article:{item["article_id"]}' for item in feed.items)
+        ]
+        return feed
+
+    def __call__(self, request, *args, **kwargs):
+        response = super().__call__(request, *args, **kwargs)
+        response.surrogate_keys = getattr(request, 'feed_surrogate_keys', None)
+        response.cache_timeout = settings.FEED_CACHE_TIMEOUT
+        return response
+
+
+class LatestArticlesFeed(ArticlesFeed):
+    title = "Ваш сайт - последние статьи"
+    link = '/feeds/'
+
+    def get_surrogate_keys(self, obj):
+        return ['feed:latest']
+
+
+class CategoryArticlesFeed(ArticlesFeed):
+    """
+    Лента статей категории
+    """
+
+    def get_object(self, request, slug):
+        return get_object_or_404(Category.objects.only('id', 'title', 'slug'), slug=slug)
+
+    def title(self, obj):
+        return f'Ваш сайт - статьи из категории: {obj.title}'
+
+    def link(self, obj):
+        return obj.get_absolute_url()
+
+    def get_queryset(self, obj):
+        return super().get_queryset(obj).filter(category=obj)
+
+    def get_surrogate_keys(self, obj):
+        return [f'feed:category:{obj.pk}']
+
+
+class TagArticlesFeed(ArticlesFeed):
+    """
+    Лента статей по тегу
+    """
+
+    def get_object(self, request, tag):
+        return get_object_or_404(Tag, slug=tag)
+
+    def title(self, obj):
+        return f'Ваш сайт - статьи по тегу: {obj.name}'
+
+    def link(self, obj):
+        return reverse('articles_by_tags', kwargs={'tag': obj.slug})
+
+    def get_queryset(self, obj):
+        return super().get_queryset(obj).filter(tags=obj)
+
+    def get_surrogate_keys(self, obj):
+        return [f'feed:tag:{obj.slug}']
+
+
+class AuthorArticlesFeed(ArticlesFeed):
+    """
+    Лента статей автора (по slug профиля)
+    """
+
+    def get_object(self, request, slug):
+        return get_object_or_404(Profile.objects.select_related('user'), slug=slug)
+
+    def title(self, obj):
+        return f'Ваш сайт - статьи автора: {obj.user.username}'
+
+    def link(self, obj):
+        return obj.get_absolute_url()
+
+    def get_queryset(self, obj):
+        return super().get_queryset(obj).filter(author_id=obj.user_id)
+
+    def get_surrogate_keys(self, obj):
+        return [f'feed:author:{obj.user_id}']
@@ -59,3 +59,16 @@ class CommentCreateForm(forms.ModelForm):
         model = Comment
         fields = ('content',)
 
+    def clean_parent(self):
+        """
+        Ответ возможен только на комментарий той же статьи и не глубже Comment.MAX_DEPTH уровней
+        """
+        parent_id = self.cleaned_data.get('parent')
+        if parent_id is None:
+            return None
+        parent = Comment.objects.filter(pk=parent_id, article_id=self.instance.article_id).only('path').first()
+        if parent is None:
+            raise forms.ValidationError('Комментарий для ответа не найден')
+        if parent.level + 1 >= Comment.MAX_DEPTH:
+            raise forms.ValidationError('Достигнута максимальная глубина ветки комментариев')
+        return parent_id
@@ -1,5 +1,5 @@
-from .models import ViewCount
 from ..services.utils import get_client_ip
+from ..services.view_counter import record_view
 
 
 class ViewCountMixin:
@@ -12,6 +12,6 @@ class ViewCountMixin:
         obj = super().get_object()
         # получаем IP-адрес пользователя
         ip_address = get_client_ip(self.request)
-        # получаем или создаем запись о просмотре статьи для данного пользователя
-        ViewCount.objects.get_or_create(article=obj, ip_address=ip_address)
+        # фиксируем просмотр статьи: сразу в БД или в буфер Redis (см. VIEW_COUNT_MODE)
+        record_view(obj, ip_address)
         return obj
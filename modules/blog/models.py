@@ -1,4 +1,9 @@
-from django.db import models
+from django.conf import settings
+from django.db import connection, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.urls import reverse
 from django.core.validators import FileExtensionValidator
 from django.contrib.auth import get_user_model
@@ -6,7 +11,7 @@ from mptt.models import MPTTModel, TreeForeignKey
 from taggit.managers import TaggableManager
 from django_ckeditor_5.fields import CKEditor5Field
 
-from ..services.utils import unique_slugify, image_compress
+from ..services.utils import save_with_unique_slug
 
 User = get_user_model()
 
@@ -25,17 +30,32 @@ class Article(models.Model):
             """
             Список статей (SQL запрос с фильтрацией для страницы списка статей)
             """
-            return self.get_queryset().select_related('author', 'category').prefetch_related('ratings', 'views').filter(
-                status='published')
+            return self.get_queryset().select_related('author', 'category').filter(status='published')
 
         def detail(self):
             """
-            Детальная статья (SQL запрос с фильтрацией для страницы со статьёй)
+            Детальная статья (SQL запрос с фильтрацией для страницы со статьёй).
+            Комментарии загружаются постранично по веткам (см. services.comments)
             """
-            return self.get_queryset().select_related('author', 'category') \
-                .prefetch_related('comments', 'comments__author', 'comments__author__profile', 'tags', 'ratings') \
+            return self.get_queryset().select_related('author', 'category').prefetch_related('tags') \
                 .filter(status='published')
 
+        def rebuild_counters(self):
+            """
+            Пересчет счетчиков просмотров и рейтинга по исходным таблицам (один UPDATE).
+            Просмотры - это сырые записи плюс уже свернутые в дневные агрегаты
+            """
+            views = ViewCount.objects.filter(article=OuterRef('pk')).order_by().values('article') \
+                .annotate(total=Count('id')).values('total')
+            daily_views = DailyViewCount.objects.filter(article=OuterRef('pk')).order_by().values('article') \
+                .annotate(total=Sum('views')).values('total')
+            ratings = Rating.objects.filter(article=OuterRef('pk')).order_by().values('article') \
+                .annotate(total=Sum('value')).values('total')
+            return self.get_queryset().update(
+                view_count=Coalesce(Subquery(views), Value(0)) + Coalesce(Subquery(daily_views), Value(0)),
+                rating_sum=Coalesce(Subquery(ratings), Value(0)),
+            )
+
     STATUS_OPTOINS = (
         ('published', 'Опубликовано'),
         ('draft', 'Черновик')
@@ -50,6 +70,7 @@ class Article(models.Model):
         upload_to='images/thumbnail/%Y/%m/%d',
         validators=[FileExtensionValidator(allowed_extensions=['png', 'jpg', 'webp', 'jpeg', 'gif'])]
     )
+    thumbnail_renditions = models.JSONField(verbose_name='Копии превью', default=dict, blank=True, editable=False)
     status = models.CharField(verbose_name='Статус поста', choices=STATUS_OPTOINS, default='published', max_length=10)
     time_create = models.DateTimeField(verbose_name='Время добавления', auto_now_add=True)
     time_update = models.DateTimeField(verbose_name='Время обновления', auto_now=True)
@@ -58,6 +79,9 @@ class Article(models.Model):
     updater = models.ForeignKey(verbose_name='Обновил', to=User, on_delete=models.SET_NULL, null=True,
                                 related_name='updater_post', blank=True)
     fixed = models.BooleanField(verbose_name='Зафиксировано', default=False)
+    view_count = models.PositiveIntegerField(verbose_name='Просмотры', default=0, editable=False)
+    rating_sum = models.IntegerField(verbose_name='Рейтинг', default=0, editable=False)
+    search_vector = SearchVectorField(verbose_name='Поисковый вектор', null=True, editable=False)
     category = TreeForeignKey('Category', on_delete=models.PROTECT, related_name='articles', verbose_name='Категория',
                               null=True)
     tags = TaggableManager()
@@ -69,11 +93,18 @@ class Article(models.Model):
         verbose_name_plural = 'Статьи'
         db_table = 'app_articles'
         ordering = ['-fixed', '-time_create']
-        indexes = [models.Index(fields=['-fixed', '-time_create', 'status'])]
+        indexes = [
+            models.Index(fields=['-fixed', '-time_create', 'status']),
+            models.Index(fields=['time_update']),
+            GinIndex(fields=['search_vector']),
+        ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.__thumbnail = self.thumbnail if self.pk else None
+        # поле, отложенное через only()/defer(), не загружается ради отслеживания изменений
+        self.__thumbnail = self.__dict__.get('thumbnail', models.DEFERRED) if self.pk else None
+        self.__status = self.__dict__.get('status', models.DEFERRED) if self.pk else None
+        self.__description = self.get_description_state() if self.pk else None
 
     def __str__(self):
         """
@@ -84,25 +115,52 @@ class Article(models.Model):
     def get_absolute_url(self):
         return reverse('articles_detail', kwargs={'slug': self.slug})
 
+    def get_description_state(self):
+        return tuple(self.__dict__.get(name, models.DEFERRED) for name in ('short_description', 'full_description'))
+
     def save(self, *args, **kwargs):
         """
         Сохранение полей модели при их отсутствии заполнения
         """
-        if not self.slug:
-            self.slug = unique_slugify(self, self.title)
-        super().save(*args, **kwargs)
-
-        if self.__thumbnail != self.thumbnail and self.thumbnail:
-            image_compress(self.thumbnail.path, width=500, height=500)
+        # новое превью обрабатывается в фоне (сигнал process_new_thumbnail), до этого выводится оригинал
+        self.thumbnail_changed = self.__thumbnail is not models.DEFERRED and bool(self.thumbnail) \
+            and self.__thumbnail != self.thumbnail
+        if self.thumbnail_changed:
+            self.thumbnail_renditions = {}
+        # публикация и снятие с публикации меняют индекс похожих статей (сигнал update_similar_articles_on_publish)
+        self.status_changed = self.__status not in (None, models.DEFERRED) and self.__status != self.status
+        # ссылки на файлы редактора пересчитываются только после изменения текста (сигнал update_article_editor_uploads)
+        self.description_changed = self.__description != self.get_description_state()
+        if self.slug:
+            super().save(*args, **kwargs)
+        else:
+            save_with_unique_slug(self, self.title, super().save, *args, **kwargs)
+        self.__class__.objects.filter(pk=self.pk).update(search_vector=self.get_search_vector())
+        self.__thumbnail = self.__dict__.get('thumbnail', models.DEFERRED)
+        self.__status = self.__dict__.get('status', models.DEFERRED)
+        self.__description = self.get_description_state()
+
+    @staticmethod
+    def get_search_vector():
+        """
+        Взвешенный поисковый вектор статьи: заголовок (A) и полное описание (B), русская конфигурация
+        """
+        return SearchVector('title', weight='A', config='russian') + \
+            SearchVector('full_description', weight='B', config='russian')
 
     def get_sum_rating(self):
         return sum([rating.value for rating in self.ratings.all()])
 
     def get_view_count(self):
         """
-        Возвращает количество просмотров для данной статьи
+        Возвращает количество просмотров для данной статьи (сырые просмотры и свернутые дневные агрегаты).
+        В режиме VIEW_COUNT_MODE = 'hll' - оценка уникальных посетителей из HyperLogLog Redis
         """
-        return self.views.count()
+        if settings.VIEW_COUNT_MODE == 'hll':
+            # импорт внутри метода: модуль счетчика сам импортирует модели
+            from ..services.view_counter import get_hll_view_count
+            return get_hll_view_count(self.id)
+        return self.views.count() + (self.daily_views.aggregate(total=Sum('views'))['total'] or 0)
 
 
 class Category(MPTTModel):
@@ -147,14 +205,21 @@ class Category(MPTTModel):
         return self.title
 
 
-class Comment(MPTTModel):
+class Comment(models.Model):
     """
-    Модель древовидных комментариев
+    Модель древовидных комментариев (материализованный путь).
+    Путь - сегменты фиксированной длины от корня до комментария, сортировка по пути дает обход дерева,
+    вставка ответа не меняет другие строки
     """
     STATUS_OPTIONS = (
         ('published', 'Опубликовано'),
         ('draft', 'Черновик')
     )
+    PATH_STEP = 10
+    # сегмент пути - (PATH_BASE - id): новые комментарии одного уровня идут первыми
+    PATH_BASE = 10 ** PATH_STEP
+    # глубина ветки ограничена длиной пути
+    MAX_DEPTH = 50
 
     article = models.ForeignKey(Article, on_delete=models.CASCADE, verbose_name='Статья', related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Автор статьи',
@@ -163,22 +228,50 @@ class Comment(MPTTModel):
     time_create = models.DateTimeField(verbose_name='Время добавления', auto_now_add=True)
     time_update = models.DateTimeField(verbose_name='Время обновления', auto_now=True)
     status = models.CharField(verbose_name='Статус поста', choices=STATUS_OPTIONS, default='published', max_length=10)
-    parent = TreeForeignKey('self', verbose_name='Родительский комментарий', null=True, blank=True,
-                            on_delete=models.CASCADE, related_name='children')
-
-    class MPTTMeta:
-        order_insertion_by = ('-time_create',)
+    parent = models.ForeignKey('self', verbose_name='Родительский комментарий', null=True, blank=True,
+                               on_delete=models.CASCADE, related_name='children')
+    path = models.CharField(verbose_name='Путь в дереве', max_length=PATH_STEP * MAX_DEPTH, default='',
+                            editable=False)
 
     class Meta:
         db_table = 'app_comments'
-        indexes = [models.Index(fields=['-time_create', 'time_update', 'status', 'parent'])]
-        ordering = ['-time_create']
+        indexes = [
+            models.Index(fields=['-time_create', 'time_update', 'status', 'parent']),
+            models.Index(fields=['article', 'parent']),
+            models.Index(fields=['article', 'path'], name='app_comments_article_path_idx',
+                         opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ]
+        ordering = ['path']
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
 
     def __str__(self):
         return f'{self.author}:{self.content}'
 
+    def save(self, *args, **kwargs):
+        """
+        Путь нового комментария считается до вставки: id берется из последовательности таблицы,
+        поэтому комментарий записывается одним INSERT
+        """
+        if self.pk is None:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id'))", [self._meta.db_table])
+                self.pk = cursor.fetchone()[0]
+            parent_path = self.parent.path if self.parent_id else ''
+            self.path = f'{parent_path}{self.PATH_BASE - self.pk:0{self.PATH_STEP}d}'
+            kwargs['force_insert'] = True
+        super().save(*args, **kwargs)
+
+    @property
+    def level(self):
+        return len(self.path) // self.PATH_STEP - 1
+
+    def get_root_id(self):
+        """
+        id корневого комментария ветки (первый сегмент пути)
+        """
+        return self.PATH_BASE - int(self.path[:self.PATH_STEP])
+
 
 class Rating(models.Model):
     """
@@ -212,8 +305,73 @@ class ViewCount(models.Model):
     class Meta:
         ordering = ('-viewed_on',)
         indexes = [models.Index(fields=['-viewed_on'])]
+        # после partition_views уникальность действует в пределах месячной секции (см. partition_view_table)
+        constraints = [models.UniqueConstraint(fields=('article', 'ip_address'), name='unique_article_ip_view')]
         verbose_name = 'Просмотр'
         verbose_name_plural = 'Просмотры'
 
     def __str__(self):
         return self.article.title
+
+
+class DailyViewCount(models.Model):
+    """
+    Модель дневных агрегатов просмотров: сырые просмотры старше VIEW_RETENTION_DAYS сворачиваются сюда
+    """
+    article = models.ForeignKey('Article', verbose_name='Статья', on_delete=models.CASCADE,
+                                related_name='daily_views')
+    date = models.DateField(verbose_name='Дата')
+    views = models.PositiveIntegerField(verbose_name='Просмотров', default=0)
+
+    class Meta:
+        db_table = 'app_daily_views'
+        ordering = ('-date',)
+        constraints = [models.UniqueConstraint(fields=('article', 'date'), name='unique_article_daily_views')]
+        verbose_name = 'Просмотры за день'
+        verbose_name_plural = 'Просмотры по дням'
+
+    def __str__(self):
+        return f'{self.article} ({self.date}): {self.views}'
+
+
+class SimilarArticle(models.Model):
+    """
+    Модель похожих статей: топ-N соседей статьи по количеству общих тегов
+    """
+    article = models.ForeignKey(Article, verbose_name='Статья', on_delete=models.CASCADE,
+                                related_name='similar_articles')
+    similar = models.ForeignKey(Article, verbose_name='Похожая статья', on_delete=models.CASCADE,
+                                related_name='similar_for')
+    score = models.PositiveIntegerField(verbose_name='Общих тегов', default=0)
+
+    class Meta:
+        db_table = 'app_similar_articles'
+        ordering = ('-score',)
+        indexes = [models.Index(fields=['article', '-score'])]
+        constraints = [models.UniqueConstraint(fields=('article', 'similar'), name='unique_similar_article')]
+        verbose_name = 'Похожая статья'
+        verbose_name_plural = 'Похожие статьи'
+
+    def __str__(self):
+        return f'{self.article} -> {self.similar}'
+
+
+class EditorUpload(models.Model):
+    """
+    Модель файлов редактора в режиме хранения по хешу содержимого: одинаковые файлы хранятся один раз.
+    Связи со статьями (индекс ссылок) обновляются при сохранении статьи, файлы без ссылок удаляются командой
+    gc_editor_uploads
+    """
+    name = models.CharField(verbose_name='Файл', max_length=255, unique=True)
+    size = models.PositiveIntegerField(verbose_name='Размер', default=0)
+    time_create = models.DateTimeField(verbose_name='Время загрузки', auto_now_add=True)
+    articles = models.ManyToManyField(Article, verbose_name='Статьи', related_name='editor_uploads', blank=True)
+
+    class Meta:
+        db_table = 'app_editor_uploads'
+        ordering = ('-time_create',)
+        verbose_name = 'Файл редактора'
+        verbose_name_plural = 'Файлы редактора'
+
+    def __str__(self):
+        return self.name
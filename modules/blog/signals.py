@@ -0,0 +1,167 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+from taggit.models import Tag, TaggedItem
+
+from .models import Article, Category, Comment, Rating
+from ..system.models import Profile
+from ..services.tasks import update_similar_articles_task, push_article_to_timelines_task, \
+    update_timeline_following_task, process_article_thumbnail_task, remove_article_from_timelines_task
+from ..services.fragments import bump_fragment_version
+from ..services.comments import invalidate_comment_thread
+from ..services.page_cache import bump_list_version, purge_surrogate_keys
+from ..services.editor_uploads import update_editor_upload_references
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def update_similar_articles_on_tags_change(sender, instance, action, **kwargs):
+    """
+    Пересчет похожих статей после изменения тегов статьи
+    """
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Article):
+        transaction.on_commit(lambda: update_similar_articles_task.delay(instance.pk))
+
+
+@receiver(post_save, sender=Article)
+def update_similar_articles_on_publish(sender, instance, **kwargs):
+    """
+    Пересчет похожих статей после публикации или снятия статьи с публикации
+    """
+    if getattr(instance, 'status_changed', False):
+        transaction.on_commit(lambda: update_similar_articles_task.delay(instance.pk))
+
+
+@receiver(post_save, sender=Article)
+def push_article_to_timelines(sender, instance, **kwargs):
+    """
+    Рассылка опубликованной статьи по лентам подписчиков (повторная рассылка идемпотентна),
+    снятая с публикации статья удаляется из лент
+    """
+    if instance.status == 'published' or getattr(instance, 'status_changed', False):
+        transaction.on_commit(lambda: push_article_to_timelines_task.delay(instance.pk))
+
+
+@receiver(post_delete, sender=Article)
+def remove_article_from_timelines(sender, instance, **kwargs):
+    """
+    Удаление статьи из лент подписчиков автора
+    """
+    transaction.on_commit(lambda: remove_article_from_timelines_task.delay(instance.pk, instance.author_id))
+
+
+@receiver(post_save, sender=Article)
+def process_new_thumbnail(sender, instance, **kwargs):
+    """
+    Создание копий нового превью (размеры, WebP и JPEG, LQIP) в фоне после сохранения статьи
+    """
+    if getattr(instance, 'thumbnail_changed', False):
+        transaction.on_commit(lambda: process_article_thumbnail_task.delay(instance.pk))
+
+
+@receiver(post_save, sender=Article)
+def update_article_editor_uploads(sender, instance, **kwargs):
+    """
+    Обновление индекса ссылок статьи на файлы редактора (для сборки мусора gc_editor_uploads).
+    Индекс используется только для файлов по хешу (CKEDITOR_UPLOAD_MODE = 'content')
+    """
+    if settings.CKEDITOR_UPLOAD_MODE == 'content' and getattr(instance, 'description_changed', False):
+        update_editor_upload_references(instance)
+
+
+@receiver(m2m_changed, sender=Profile.following.through)
+def update_timeline_on_following_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Обновление лент после подписки или отписки.
+    Прямая связь: instance - подписчик, pk_set - авторы; обратная: instance - автор, pk_set - подписчики
+    """
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    followed = action == 'post_add'
+    if reverse:
+        for follower_id in pk_set:
+            transaction.on_commit(
+                lambda follower_id=follower_id: update_timeline_following_task.delay(follower_id, [instance.pk],
+                                                                                     followed))
+    else:
+        author_ids = list(pk_set)
+        transaction.on_commit(lambda: update_timeline_following_task.delay(instance.pk, author_ids, followed))
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_sidebar_categories(sender, **kwargs):
+    bump_fragment_version('sidebar_categories')
+
+
+@receiver([post_save, post_delete], sender=Article)
+def invalidate_sidebar_articles(sender, **kwargs):
+    bump_fragment_version('sidebar_popular_tags', 'sidebar_popular_articles')
+
+
+@receiver([post_save, post_delete], sender=TaggedItem)
+def invalidate_sidebar_tags(sender, **kwargs):
+    bump_fragment_version('sidebar_popular_tags')
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def invalidate_sidebar_comments(sender, **kwargs):
+    bump_fragment_version('sidebar_latest_comments')
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def invalidate_comment_thread_cache(sender, instance, **kwargs):
+    """
+    Сброс кеша ветки, в которую добавлен (изменен, удален) комментарий
+    """
+    if instance.path:
+        invalidate_comment_thread(instance.get_root_id())
+
+
+@receiver(post_delete, sender=Article)
+@receiver([post_save, post_delete], sender=TaggedItem)
+def bump_article_lists_version(sender, **kwargs):
+    """
+    Удаление статьи и изменение тегов не обновляют time_update статей - меняется версия списков (ETag)
+    """
+    bump_list_version()
+
+
+def purge_pages_on_commit(*keys):
+    transaction.on_commit(lambda: purge_surrogate_keys(*keys))
+
+
+@receiver([post_save, post_delete], sender=Article)
+def purge_article_pages(sender, instance, **kwargs):
+    """
+    Сброс кеша страниц статьи, главной и категории (списки со статьей помечены ключом статьи),
+    а также RSS-лент, в которые статья может попасть после публикации
+    """
+    purge_pages_on_commit(f'article:{instance.pk}', 'list:home', f'category:{instance.category_id}',
+                          'feed:latest', f'feed:category:{instance.category_id}', f'feed:author:{instance.author_id}')
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def purge_tag_pages(sender, instance, action, pk_set, **kwargs):
+    """
+    Сброс кеша страниц и RSS-лент тегов, добавленных к статье или удаленных из нее
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear') or not isinstance(instance, Article):
+        return
+    tag_slugs = Tag.objects.filter(pk__in=pk_set).values_list('slug', flat=True) if pk_set else []
+    tag_keys = [key for slug in tag_slugs for key in (f'tag:{slug}', f'feed:tag:{slug}')]
+    purge_pages_on_commit(f'article:{instance.pk}', *tag_keys)
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def purge_commented_article_pages(sender, instance, **kwargs):
+    purge_pages_on_commit(f'comments:{instance.article_id}')
+
+
+@receiver([post_save, post_delete], sender=Rating)
+def purge_rated_article_pages(sender, instance, **kwargs):
+    purge_pages_on_commit(f'article:{instance.article_id}')
+
+
+@receiver([post_save, post_delete], sender=Category)
+def purge_category_pages(sender, instance, **kwargs):
+    purge_pages_on_commit(f'category:{instance.pk}')
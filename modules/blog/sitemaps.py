@@ -6,17 +6,17 @@ from .models import Article
 
 class ArticleSitemap(Sitemap):
     """
-    Карта-сайта для статей
+    Карта-сайта для статей (в продакшене nginx отдает заранее сгенерированные файлы, см. services.sitemap)
     """
     changefreq = 'monthly'
     priority = 0.9
     protocol = 'https'
 
     def items(self):
-        return Article.objects.all()
+        return Article.objects.filter(status='published').only('slug', 'time_update').order_by('id')
 
     def lastmod(self, obj):
-        return obj.time_create
+        return obj.time_update
 
 
 class StaticSitenap(Sitemap):
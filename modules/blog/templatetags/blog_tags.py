@@ -1,14 +1,41 @@
 from django import template
-from django.db.models import Count, Q
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Count
+from django.utils.safestring import mark_safe
 from taggit.models import Tag
 from django.utils import timezone
-from datetime import datetime, date, time, timedelta
 
 from ..models import Comment, Article
+from ...services.fragments import render_fragments
+from ...services.images import RENDITION_FORMATS
+from ...services.view_counter import get_popular_scores, get_popular_scores_for
 
 register = template.Library()
 
 
+def get_sidebar_fragments():
+    """
+    Блоки сайдбара: шаблон и время жизни в кеше.
+    Блоки по событиям инвалидируются сигналами, блоки с окном времени - по расписанию
+    """
+    return {
+        'sidebar_categories': ('includes/sidebar/categories.html', settings.SIDEBAR_CACHE_TIMEOUT),
+        'sidebar_popular_tags': ('includes/sidebar/popular_tags.html', settings.SIDEBAR_CACHE_TIMEOUT),
+        'sidebar_popular_articles': ('includes/sidebar/popular_articles.html', settings.SIDEBAR_WINDOW_CACHE_TIMEOUT,
+                                     {'window_days': settings.POPULAR_ARTICLES_WINDOW_DAYS}),
+        'sidebar_latest_comments': ('includes/sidebar/latest_comments.html', settings.SIDEBAR_CACHE_TIMEOUT),
+    }
+
+
+@register.simple_tag
+def sidebar():
+    """
+    Сайдбар из закешированных HTML-блоков
+    """
+    return mark_safe(''.join(render_fragments(get_sidebar_fragments()).values()))
+
+
 @register.simple_tag
 def popular_tags():
     tags = Tag.objects.annotate(num_times=Count('article')).order_by('-num_times')
@@ -24,17 +51,58 @@ def show_latest_comments(count=5):
 
 @register.simple_tag
 def popular_articles():
-    # получаем текущую дату и время в формате datetime
-    now = timezone.now()
-    # вычисляем дату начала дня (00:00) 7 дней назад
-    stat_date = now - timedelta(days=7)
-    # вычисляем дату начала текущего дня (00:00)
-    today_start = timezone.make_aware(datetime.combine(date.today(), time.min))
-    # получаем все статьи и количество их просмотров за последние 7 дней
-    articles = Article.objects.annotate(
-        total_view_count=Count('views', filter=Q(views__viewed_on__gte=stat_date)),
-        today_view_count=Count('views', filter=Q(views__viewed_on__gte=today_start)),
-    ).prefetch_related('views')
-    # сортируем статьи по количеству просмотров в порядке убывания, сначала по просмотрам за сегодня, затем за все время
-    popular_articles = articles.order_by('-total_view_count', '-today_view_count')[:5]
-    return popular_articles
+    """
+    Популярные статьи за окно POPULAR_ARTICLES_WINDOW_DAYS по счетчикам просмотров в Redis.
+    При равенстве просмотров за окно выше статья с большим числом просмотров за сегодня
+    """
+    window = get_popular_scores(settings.POPULAR_ARTICLES_WINDOW_DAYS * 24, settings.POPULAR_ARTICLES_LIMIT * 2,
+                                settings.POPULAR_ARTICLES_DECAY)
+    if not window:
+        return []
+    # часы, прошедшие с начала текущего дня
+    hours_today = timezone.localtime().hour + 1
+    today = get_popular_scores_for(hours_today, [article_id for article_id, _ in window])
+    articles = Article.objects.filter(status='published').in_bulk([article_id for article_id, _ in window])
+
+    popular = []
+    for article_id, score in sorted(window, key=lambda item: (item[1], today[item[0]]), reverse=True):
+        article = articles.get(article_id)
+        if article is None:
+            continue
+        article.total_view_count = round(score)
+        article.today_view_count = round(today[article_id])
+        popular.append(article)
+    return popular[:settings.POPULAR_ARTICLES_LIMIT]
+
+
+@register.inclusion_tag('includes/thumbnail.html')
+def article_thumbnail(article, sizes='33vw', css_class='card-img-top', lazy=True):
+    """
+    Превью статьи с srcset по копиям (WebP и JPEG) и LQIP-заглушкой в фоне.
+    Пока копии не созданы, выводится оригинал
+    """
+    renditions = article.thumbnail_renditions or {}
+    srcset = {
+        extension: ', '.join(f'{default_storage.url(name)} {width}w' for width, name in renditions[extension])
+        for extension in RENDITION_FORMATS if renditions.get(extension)
+    }
+    fallback = renditions['jpeg'][-1][1] if srcset.get('jpeg') else None
+    return {
+        'article': article,
+        'src': default_storage.url(fallback) if fallback else (article.thumbnail.url if article.thumbnail else ''),
+        'srcset': srcset,
+        'sizes': sizes,
+        'css_class': css_class,
+        'lazy': lazy,
+        'width': renditions.get('width'),
+        'height': renditions.get('height'),
+        'placeholder': renditions.get('placeholder'),
+    }
+
+
+@register.filter
+def avatar(profile, size):
+    """
+    URL аватара профиля нужного размера: {{ profile|avatar:120 }}
+    """
+    return profile.get_avatar_url(size)
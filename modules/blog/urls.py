@@ -1,7 +1,7 @@
 from django.urls import path
 from .views import ArticleListView, ArticleDetailView, ArticleByCategoryListView, ArticleCreateView, ArticleUpdateView, \
     ArticleDeleteView, CommentCreateView, ArticleByTagListView, ArticleSearchResultView, RatingCreateView, \
-    ArticleBySignedUser
+    ArticleBySignedUser, CommentThreadListView
 
 urlpatterns = [
     path('', ArticleListView.as_view(), name='home'),
@@ -11,6 +11,7 @@ urlpatterns = [
     path('articles/<str:slug>/delete/', ArticleDeleteView.as_view(), name='articles_delete'),
     path('articles/<str:slug>/', ArticleDetailView.as_view(), name='articles_detail'),
     path('articles/<int:pk>/comments/create/', CommentCreateView.as_view(), name='comment_create_view'),
+    path('articles/<int:pk>/comments/', CommentThreadListView.as_view(), name='comment_threads'),
     path('article/tags/<str:tag>/', ArticleByTagListView.as_view(), name='articles_by_tags'),
     path('category/<str:slug>/', ArticleByCategoryListView.as_view(), name="articles_by_category"),
     path('search/', ArticleSearchResultView.as_view(), name='search'),
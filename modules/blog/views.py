@@ -1,19 +1,32 @@
-import random
-from django.db.models import Count
-from django.http import JsonResponse
-from django.shortcuts import redirect
+from html import unescape
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, Http404
+from django.shortcuts import get_object_or_404, redirect
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, View
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
 from taggit.models import Tag
-from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
+from django.db.models import DecimalField, F, Func, Value
+from django.db.models.functions import Cast
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchHeadline
 
 from .mixins import ViewCountMixin
 from .models import Article, Category, Comment, Rating
 from .forms import ArticleCreateForm, ArticleUpdateForm, CommentCreateForm
-from ..services.mixins import AuthorRequiredMixin
+from ..services.mixins import AuthorRequiredMixin, CursorPaginationMixin, SurrogateKeyMixin
 from ..services.utils import get_client_ip
+from ..services.comments import get_comment_threads_page
+from ..services.page_cache import purge_surrogate_keys
+from ..services.conditional import conditional_page, article_list_validators, article_detail_validators, \
+    article_detail_not_modified, article_category_validators, article_tag_validators
+from ..services.rating import toggle_rating
+from ..services.pagination import InvalidCursor
+from ..services.timeline import get_timeline_page
+from ..services.view_counter import get_unique_visitors
 
 
 class ArticleCreateView(LoginRequiredMixin, CreateView):
@@ -36,7 +49,8 @@ class ArticleCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class ArticleListView(ListView):
+@method_decorator(conditional_page(article_list_validators), name='dispatch')
+class ArticleListView(SurrogateKeyMixin, CursorPaginationMixin, ListView):
     """
     Представление: показ списка статей
     """
@@ -44,6 +58,7 @@ class ArticleListView(ListView):
     template_name = 'blog/articles/articles_list.html'
     context_object_name = 'articles'
     paginate_by = 3
+    surrogate_keys = ('list:home',)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -51,7 +66,8 @@ class ArticleListView(ListView):
         return context
 
 
-class ArticleDetailView(ViewCountMixin, DetailView):
+@method_decorator(conditional_page(article_detail_validators, article_detail_not_modified), name='dispatch')
+class ArticleDetailView(SurrogateKeyMixin, ViewCountMixin, DetailView):
     """
     Представление: показ одной стати полностью
     """
@@ -61,22 +77,34 @@ class ArticleDetailView(ViewCountMixin, DetailView):
     queryset = model.objects.detail()
 
     def get_similar_articles(self, obj):
-        article_tags_ids = obj.tags.values_list('id', flat=True)
-        similar_articles = Article.objects.filter(tags__in=article_tags_ids).exclude(id=obj.id)
-        similar_articles = similar_articles.annotate(related_tags=Count('tags')).order_by('-related_tags')
-        similar_articles_list = list(similar_articles.all())
-        random.shuffle(similar_articles_list)
-        return similar_articles_list[:6]
+        """
+        Случайные 6 статей из заранее посчитанного топа похожих статей (см. SimilarArticle)
+        """
+        return Article.objects.filter(similar_for__article=obj, status='published').order_by('?')[:6]
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['title'] = self.object.title
         context['form'] = CommentCreateForm
         context['similar_articles'] = self.get_similar_articles(self.object)
+        context['comment_page'], context['comment_threads'] = get_comment_threads_page(self.object.id)
+        if settings.VIEW_COUNT_MODE == 'hll' and self.request.user == self.object.author:
+            context['view_stats'] = get_unique_visitors(self.object.id)
         return context
 
+    def get_surrogate_keys(self, context):
+        # комментарии выводятся только на странице статьи, поэтому сбрасывают ее отдельным ключом
+        return [f'article:{self.object.pk}', f'comments:{self.object.pk}', f'category:{self.object.category_id}']
 
-class ArticleByCategoryListView(ListView):
+    def render_to_response(self, context, **response_kwargs):
+        response = super().render_to_response(context, **response_kwargs)
+        # просмотр засчитывается и при отдаче страницы из кеша
+        response.view_article_id = self.object.pk
+        return response
+
+
+@method_decorator(conditional_page(article_category_validators), name='dispatch')
+class ArticleByCategoryListView(SurrogateKeyMixin, ListView):
     """
     Представление: показ статей по категориям
     """
@@ -95,6 +123,9 @@ class ArticleByCategoryListView(ListView):
         context['title'] = f'Статьи из категории: {self.category.title}'
         return context
 
+    def get_surrogate_keys(self, context):
+        return [f'category:{self.category.pk}', *super().get_surrogate_keys(context)]
+
 
 class ArticleUpdateView(AuthorRequiredMixin, SuccessMessageMixin, UpdateView):
     """
@@ -132,7 +163,8 @@ class ArticleDeleteView(AuthorRequiredMixin, DeleteView):
         return context
 
 
-class ArticleByTagListView(ListView):
+@method_decorator(conditional_page(article_tag_validators), name='dispatch')
+class ArticleByTagListView(SurrogateKeyMixin, CursorPaginationMixin, ListView):
     model = Article
     template_name = 'blog/articles/articles_list.html'
     context_object_name = 'articles'
@@ -149,8 +181,16 @@ class ArticleByTagListView(ListView):
         context['title'] = f'Статьи по тегу: {self.tag.name}'
         return context
 
+    def get_surrogate_keys(self, context):
+        return [f'tag:{self.tag.slug}', *super().get_surrogate_keys(context)]
+
 
-class ArticleSearchResultView(ListView):
+# границы найденных слов в SearchHeadline (управляющие символы не встречаются в тексте статей)
+HEADLINE_START = '\x02'
+HEADLINE_STOP = '\x03'
+
+
+class ArticleSearchResultView(CursorPaginationMixin, ListView):
     """
     Реализация поиска статей на сайте
     """
@@ -158,25 +198,40 @@ class ArticleSearchResultView(ListView):
     context_object_name = 'articles'
     paginate_by = 5
     allow_empty = True
+    cursor_ordering = ('-rank', 'id')
     template_name = 'blog/articles/articles_list.html'
 
     def get_queryset(self):
-        query = self.request.GET.get('do')
-        search_vector = SearchVector('full_description', weight='B') + SearchVector('title', weight='A')
-        search_query = SearchQuery(query)
-        return (
-            self.model.objects.annotate(rank=SearchRank(search_vector, search_query)).filter(rank__gte=0.3).order_by(
-                '-rank'))
+        query = self.request.GET.get('do', '').strip()
+        if not query:
+            return self.model.objects.none()
+        search_query = SearchQuery(query, config='russian', search_type='websearch')
+        # текст статьи без HTML-разметки редактора для подсветки найденных фрагментов
+        plain_text = Func(F('full_description'), Value('<[^>]+>'), Value(' '), Value('g'), function='regexp_replace')
+        return self.model.objects.all().filter(search_vector=search_query).annotate(
+            # точное значение для курсора: float4 из ts_rank после JSON не совпадает с собой при сравнении
+            rank=Cast(SearchRank(F('search_vector'), search_query), DecimalField(max_digits=12, decimal_places=8)),
+            headline=SearchHeadline(plain_text, search_query, config='russian', start_sel=HEADLINE_START,
+                                    stop_sel=HEADLINE_STOP, max_words=35, min_words=15),
+        ).order_by('-rank')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['title'] = f'Результаты поиска: {self.request.GET.get("do")}'
+        context['title'] = f'Результаты поиска: {self.request.GET.get("do", "")}'
+        # фрагмент выводится как HTML: текст экранируется (остатки разметки, сущности редактора),
+        # размечаются только найденные слова
+        for article in context['articles']:
+            article.headline = mark_safe(
+                escape(unescape(article.headline)).replace(HEADLINE_START, '<mark>').replace(HEADLINE_STOP, '</mark>')
+            )
         return context
 
 
-class ArticleBySignedUser(LoginRequiredMixin, ListView):
+class ArticleBySignedUser(LoginRequiredMixin, CursorPaginationMixin, ListView):
     """
-    Представление, выводящее список статей авторов, на которые подписан текущий пользователь
+    Представление, выводящее список статей авторов, на которые подписан текущий пользователь.
+    В режиме курсорной пагинации статьи читаются из ленты подписчика в Redis (см. services.timeline),
+    ссылки вида ?page=N и PAGINATION_MODE = 'page' - стандартная пагинация запроса к БД
     """
     model = Article
     template_name = 'blog/articles/articles_list.html'
@@ -185,9 +240,18 @@ class ArticleBySignedUser(LoginRequiredMixin, ListView):
     paginate_by = 5
 
     def get_queryset(self):
-        authors = self.request.user.profile.following.values_list('id', flat=True)
-        queryset = self.model.objects.all().filter(author__id__in=authors)
-        return queryset
+        authors = self.request.user.profile.following.values_list('user_id', flat=True)
+        return self.model.objects.all().filter(author__id__in=authors)
+
+    def paginate_queryset(self, queryset, page_size):
+        if settings.PAGINATION_MODE != 'cursor' or self.page_kwarg in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+        try:
+            page = get_timeline_page(self.request.user.profile, page_size,
+                                     cursor=self.request.GET.get(self.cursor_query_param), querydict=self.request.GET)
+        except InvalidCursor:
+            raise Http404('Некорректная ссылка на страницу')
+        return page.paginator, page, page.object_list, page.has_other_pages()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -202,26 +266,29 @@ class CommentCreateView(LoginRequiredMixin, CreateView):
     def is_ajax(self):
         return self.request.headers.get('X-Requested-With') == 'XMLHttpRequest'
 
+    def get_form_kwargs(self):
+        # статья нужна форме для проверки родительского комментария
+        kwargs = super().get_form_kwargs()
+        kwargs['instance'] = Comment(article=get_object_or_404(Article, pk=self.kwargs.get('pk'), status='published'))
+        return kwargs
+
     def form_invalid(self, form):
-        if self.is_ajax():
-            return JsonResponse({'error': form.errors}, status=400)
-        return super().form_invalid(form)
+        return JsonResponse({'error': form.errors}, status=400)
 
     def form_valid(self, form):
         comment = form.save(commit=False)
-        comment.article_id = self.kwargs.get('pk')
         comment.author = self.request.user
         comment.parent_id = form.cleaned_data.get('parent')
         comment.save()
 
         if self.is_ajax():
             return JsonResponse({
-                'is_child': comment.is_child_node(),
+                'is_child': comment.parent_id is not None,
                 'id': comment.id,
                 'author': comment.author.username,
                 'parent_id': comment.parent_id,
                 'time_create': comment.time_create.strftime('%Y-%b-%d %H:%M:%S'),
-                'avatar': comment.author.profile.avatar.url,
+                'avatar': comment.author.profile.get_avatar_url(120),
                 'content': comment.content,
                 'get_absolute_url': comment.author.profile.get_absolute_url()
             }, status=200)
@@ -232,6 +299,23 @@ class CommentCreateView(LoginRequiredMixin, CreateView):
         return JsonResponse({'error': 'Необходимо авторизоваться для добавления комментариев'}, status=400)
 
 
+class CommentThreadListView(View):
+    """
+    Представление: следующая страница веток комментариев статьи (HTML-фрагмент или JSON для AJAX)
+    """
+
+    def get(self, request, *args, **kwargs):
+        article = get_object_or_404(Article, pk=self.kwargs.get('pk'), status='published')
+        page, html = get_comment_threads_page(article.pk, request.GET.get('page'))
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return JsonResponse({
+                'html': html,
+                'has_next': page.has_next(),
+                'next_page': page.next_page_number() if page.has_next() else None,
+            })
+        return HttpResponse(html)
+
+
 class RatingCreateView(View):
     """
     Представление для работы с рейтингом
@@ -239,24 +323,21 @@ class RatingCreateView(View):
     model = Rating
 
     def post(self, request, *args, **kwargs):
-        article_id = request.POST.get('article_id')
-        value = int(request.POST.get('value'))
+        try:
+            article_id = int(request.POST.get('article_id'))
+            value = int(request.POST.get('value'))
+        except (TypeError, ValueError):
+            return JsonResponse({'error': 'Некорректные данные оценки'}, status=400)
+        if value not in (1, -1):
+            return JsonResponse({'error': 'Некорректные данные оценки'}, status=400)
         ip_address = get_client_ip(request)
-        user = request.user if request.user.is_authenticated else None
-
-        rating, created = self.model.objects.get_or_create(
-            article_id=article_id,
-            ip_address=ip_address,
-            defaults={'value': value, 'user': user},
-        )
-
-        if not created:
-            if rating.value == value:
-                rating.delete()
-                return JsonResponse({'status': 'deleted', 'rating_sum': rating.article.get_sum_rating()})
-            else:
-                rating.value = value
-                rating.user = user
-                rating.save()
-                return JsonResponse({'status': 'update', 'rating_sum': rating.article.get_sum_rating()})
-        return JsonResponse({'status': 'created', 'rating_sum': rating.article.get_sum_rating()})
+        user_id = request.user.id if request.user.is_authenticated else None
+
+        # переключение оценки и новая сумма рейтинга статьи за один запрос к БД
+        result = toggle_rating(article_id, ip_address, value, user_id=user_id)
+        if result is None:
+            return JsonResponse({'error': 'Статья не найдена'}, status=404)
+        status, rating_sum = result
+        # оценка меняется SQL-запросом без сигналов модели, поэтому кеш страниц статьи сбрасывается здесь
+        purge_surrogate_keys(f'article:{article_id}')
+        return JsonResponse({'status': status, 'rating_sum': rating_sum})
@@ -0,0 +1,95 @@
+import colorsys
+import hashlib
+import os
+from functools import lru_cache
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+IDENTICON_GRID = 5
+
+
+def get_avatar_name(name, size):
+    """
+    Имя копии аватара нужного размера (копии лежат рядом с самой большой: {хеш}-{размер}.jpg)
+    """
+    base, _ = name.rsplit('-', 1)
+    return f'{base}-{size}.jpg'
+
+
+def is_normalized_avatar(name):
+    return name.startswith(settings.AVATAR_NORMALIZED_DIR + '/')
+
+
+def normalize_avatar(file):
+    """
+    Квадратные сжатые копии загруженного аватара для всех AVATAR_SIZES с хешем содержимого в имени.
+    Возвращает имя самой большой копии (сохраняется в поле avatar вместо оригинала)
+    """
+    img = ImageOps.exif_transpose(Image.open(file))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    sizes = sorted(settings.AVATAR_SIZES, reverse=True)
+    img = ImageOps.fit(img, (sizes[0], sizes[0]), Image.LANCZOS)
+
+    renditions = []
+    for size in sizes:
+        buffer = BytesIO()
+        img.resize((size, size), Image.LANCZOS).save(buffer, format='JPEG', quality=85, optimize=True)
+        renditions.append((size, buffer.getvalue()))
+    digest = hashlib.sha256(renditions[0][1]).hexdigest()[:16]
+    for size, content in renditions:
+        name = os.path.join(settings.AVATAR_NORMALIZED_DIR, digest[:2], f'{digest}-{size}.jpg')
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(content))
+    return os.path.join(settings.AVATAR_NORMALIZED_DIR, digest[:2], f'{digest}-{sizes[0]}.jpg')
+
+
+def render_identicon(seed):
+    """
+    Симметричный идентикон 5x5 в SVG: узор и цвет однозначно определяются хешем строки
+    """
+    digest = hashlib.md5(seed.encode()).digest()
+    red, green, blue = colorsys.hls_to_rgb(digest[0] / 255, 0.45, 0.55)
+    color = f'#{int(red * 255):02x}{int(green * 255):02x}{int(blue * 255):02x}'
+    half = (IDENTICON_GRID + 1) // 2
+    cells = []
+    for index in range(IDENTICON_GRID * half):
+        if digest[1 + index] & 1:
+            row, column = divmod(index, half)
+            cells.append((column, row))
+            if column != IDENTICON_GRID - 1 - column:
+                cells.append((IDENTICON_GRID - 1 - column, row))
+    rects = ''.join(f'<rect x="{x + 1}" y="{y + 1}" width="1" height="1"/>' for x, y in cells)
+    size = IDENTICON_GRID + 2
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#f0f0f0"/><g fill="{color}">{rects}</g></svg>'
+    )
+
+
+@lru_cache(maxsize=4096)
+def get_identicon_name(seed):
+    """
+    Файл идентикона в MEDIA_ROOT (создается при первом обращении, дальше берется из памяти процесса)
+    """
+    name = os.path.join(settings.AVATAR_IDENTICONS_DIR, f'{hashlib.md5(seed.encode()).hexdigest()}.svg')
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(render_identicon(seed).encode()))
+    return name
+
+
+def get_avatar_url(profile, size=None):
+    """
+    URL аватара профиля не меньше size пикселей (по умолчанию - самый большой из AVATAR_SIZES).
+    Без загруженного аватара - локальный идентикон по slug профиля
+    """
+    if not profile.avatar:
+        return default_storage.url(get_identicon_name(profile.slug))
+    name = profile.avatar.name
+    if size and is_normalized_avatar(name):
+        size = min((item for item in settings.AVATAR_SIZES if item >= size), default=max(settings.AVATAR_SIZES))
+        name = get_avatar_name(name, size)
+    return default_storage.url(name)
@@ -0,0 +1,480 @@
+import datetime
+import gzip
+import json
+import shutil
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from django.apps import apps
+from django.conf import settings
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+BACKUP_MANIFEST = 'manifest.json'
+BACKUP_CHUNK = '{label}.{number:05d}.jsonl.gz'
+BACKUP_DELETE_BATCH = 10000
+BACKUP_CONFLICT_BATCH = 500
+
+
+def get_backup_models():
+    """
+    Модели для резервного копирования (включая промежуточные таблицы ManyToMany), кроме BACKUP_EXCLUDE_MODELS
+    """
+    return [
+        model for model in apps.get_models(include_auto_created=True)
+        if model._meta.label_lower not in settings.BACKUP_EXCLUDE_MODELS
+        and model._meta.managed and not model._meta.proxy
+    ]
+
+
+def get_incremental_mode(model):
+    """
+    Способ выгрузки модели в инкрементальную копию: (способ, поле времени).
+    'rows' - строки, измененные с начала предыдущей копии (поле auto_now);
+    'append' - добавленные строки (поле auto_now_add) неизменяемых таблиц из BACKUP_APPEND_ONLY_MODELS;
+    'full' - таблица целиком (остальные модели, в том числе промежуточные таблицы ManyToMany).
+    Для 'rows' и 'append' дополнительно выгружаются все первичные ключи - по ним восстанавливаются удаления
+    """
+    fields = model._meta.concrete_fields
+    changed = next((field for field in fields if getattr(field, 'auto_now', False)), None)
+    if changed is not None:
+        return 'rows', changed
+    created = next((field for field in fields if getattr(field, 'auto_now_add', False)), None)
+    if created is not None and model._meta.label_lower in settings.BACKUP_APPEND_ONLY_MODELS:
+        return 'append', created
+    return 'full', None
+
+
+def get_backups(root=None):
+    """
+    Манифесты копий в BACKUP_ROOT, от старых к новым
+    """
+    root = Path(root or settings.BACKUP_ROOT)
+    manifests = [json.loads(path.read_text()) for path in root.glob(f'*/{BACKUP_MANIFEST}')]
+    return sorted(manifests, key=lambda manifest: manifest['created'])
+
+
+class BackupJSONEncoder(DjangoJSONEncoder):
+    """
+    Время с микросекундами (DjangoJSONEncoder округляет до миллисекунд)
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _write_chunk(path, rows):
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) as file:
+        for row in rows:
+            file.write(json.dumps(row, cls=BackupJSONEncoder, ensure_ascii=False))
+            file.write('\n')
+
+
+def _write_chunks(directory, label, rows, chunk_rows):
+    """
+    Потоковая запись строк в сжатые части по chunk_rows строк: (имена частей, количество строк)
+    """
+    chunks, batch, total = [], [], 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) == chunk_rows:
+            chunks.append(BACKUP_CHUNK.format(label=label, number=len(chunks)))
+            _write_chunk(directory / chunks[-1], batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        chunks.append(BACKUP_CHUNK.format(label=label, number=len(chunks)))
+        _write_chunk(directory / chunks[-1], batch)
+        total += len(batch)
+    return chunks, total
+
+
+def _dump_model(directory, model, since, chunk_rows):
+    """
+    Выгрузка таблицы (серверный курсор) в сжатые части по chunk_rows строк
+    """
+    fields = [field.attname for field in model._meta.concrete_fields]
+    queryset = model._base_manager.order_by(model._meta.pk.attname)
+    mode, watermark = get_incremental_mode(model) if since else ('full', None)
+
+    label = model._meta.label_lower
+    rows = queryset.filter(**{f'{watermark.attname}__gte': since}) if watermark else queryset
+    chunks, total = _write_chunks(directory, label, rows.values_list(*fields).iterator(chunk_size=chunk_rows),
+                                  chunk_rows)
+    dump = {'fields': fields, 'chunks': chunks, 'rows': total, 'mode': mode}
+    if mode != 'full':
+        dump['pk_chunks'], _ = _write_chunks(
+            directory, f'{label}.pks', queryset.values_list('pk', flat=True).iterator(chunk_size=chunk_rows),
+            chunk_rows,
+        )
+    return dump
+
+
+def create_backup(incremental=False, root=None, chunk_rows=None):
+    """
+    Резервная копия базы данных: каталог с манифестом и сжатыми частями JSON Lines по каждой модели.
+    Инкрементальная копия содержит изменения с начала снимка предыдущей копии
+    с перекрытием BACKUP_WATERMARK_OVERLAP секунд (см. get_incremental_mode)
+    """
+    root = Path(root or settings.BACKUP_ROOT)
+    chunk_rows = chunk_rows or settings.BACKUP_CHUNK_ROWS
+    backups = get_backups(root) if incremental else []
+    previous = backups[-1] if backups else None
+    started = timezone.now()
+    kind = 'incremental' if previous else 'full'
+    name = f'{started.strftime("%Y-%m-%d-%H-%M-%S")}-{kind}'
+    directory = root / name
+    directory.mkdir(parents=True)
+    since = None
+    if previous:
+        # перекрытие: строки, сохраненные до снимка предыдущей копии, но зафиксированные после него
+        since = parse_datetime(previous.get('watermark', previous['started'])) \
+            - datetime.timedelta(seconds=settings.BACKUP_WATERMARK_OVERLAP)
+
+    manifest = {
+        'name': name,
+        'kind': kind,
+        'base': previous['name'] if previous else None,
+        'started': started.isoformat(),
+        'watermark': started.isoformat(),
+        'models': {},
+    }
+    # согласованный снимок всех таблиц
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+                # время начала транзакции снимка - граница следующей инкрементальной копии
+                cursor.execute('SELECT transaction_timestamp()')
+                manifest['watermark'] = cursor.fetchone()[0].isoformat()
+        for model in get_backup_models():
+            manifest['models'][model._meta.label_lower] = _dump_model(directory, model, since, chunk_rows)
+    manifest['created'] = timezone.now().isoformat()
+    (directory / BACKUP_MANIFEST).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def get_restore_chain(name, root=None):
+    """
+    Цепочка копий для восстановления: полная копия и инкрементальные после нее до name включительно
+    """
+    backups = {manifest['name']: manifest for manifest in get_backups(root)}
+    if name not in backups:
+        raise ValueError(f'Резервная копия {name} не найдена')
+    chain = [backups[name]]
+    while chain[-1]['base']:
+        if chain[-1]['base'] not in backups:
+            raise ValueError(f'Резервная копия {chain[-1]["base"]} (основа {chain[-1]["name"]}) не найдена')
+        chain.append(backups[chain[-1]['base']])
+    return list(reversed(chain))
+
+
+def _check_chunk(path):
+    """
+    Часть читается до конца: gzip проверяет контрольную сумму, каждая строка - корректный JSON
+    """
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                json.loads(line)
+    except (OSError, EOFError, ValueError) as error:
+        return f'{path.name}: {error}'
+    return None
+
+
+def validate_restore_chain(chain, root, models, workers=None):
+    """
+    Проверка всей цепочки до очистки БД: модели и поля копии есть в текущей схеме,
+    все части на месте и читаются. Ошибки - ValueError
+    """
+    root = Path(root)
+    models = {model._meta.label_lower: model for model in models}
+    paths = []
+    for manifest in chain:
+        for label, dump in manifest['models'].items():
+            if label in settings.BACKUP_EXCLUDE_MODELS:
+                continue
+            if label not in models:
+                raise ValueError(f'{manifest["name"]}: модель {label} отсутствует в текущей схеме')
+            unknown = set(dump['fields']) - {field.attname for field in models[label]._meta.concrete_fields}
+            if unknown:
+                raise ValueError(f'{manifest["name"]}: поля {", ".join(sorted(unknown))} модели {label} '
+                                 f'отсутствуют в текущей схеме')
+            paths.extend(root / manifest['name'] / chunk for chunk in [*dump['chunks'], *dump.get('pk_chunks', [])])
+    missing = [path.name for path in paths if not path.exists()]
+    if missing:
+        raise ValueError(f'Отсутствуют части копии: {", ".join(missing)}')
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        errors = [error for error in executor.map(_check_chunk, paths) if error]
+    if errors:
+        raise ValueError(f'Поврежденные части копии: {"; ".join(errors)}')
+
+
+def get_load_levels(models):
+    """
+    Уровни загрузки по внешним ключам: модель загружается после моделей, на которые ссылается.
+    Ссылки на себя не учитываются (такие таблицы загружаются по частям последовательно)
+    """
+    remaining = {model._meta.label_lower: model for model in models}
+    dependencies = {
+        label: {field.related_model._meta.label_lower for field in model._meta.concrete_fields
+                if field.is_relation and field.related_model is not model} & remaining.keys()
+        for label, model in remaining.items()
+    }
+    levels, loaded = [], set()
+    while remaining:
+        level = [label for label in remaining if dependencies[label] <= loaded] or list(remaining)
+        levels.append([remaining.pop(label) for label in level])
+        loaded.update(level)
+    return levels
+
+
+def _read_values(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def _read_chunk(path, model, fields):
+    model_fields = {field.attname: field for field in model._meta.concrete_fields}
+    model_fields = [model_fields[name] for name in fields]
+    for values in _read_values(path):
+        yield model(**{field.attname: None if value is None else field.to_python(value)
+                       for field, value in zip(model_fields, values)})
+
+
+def _conflict_options(model, mode):
+    """
+    Загрузка строк инкрементальной копии: измененные строки обновляются по первичному ключу,
+    строки неизменяемых таблиц, уже загруженные из предыдущей копии, пропускаются
+    """
+    if mode == 'append':
+        return {'ignore_conflicts': True}
+    if mode == 'rows':
+        update_fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+        return {'update_conflicts': True, 'unique_fields': [model._meta.pk.name], 'update_fields': update_fields}
+    return {}
+
+
+def _load_chunk(path, model, fields, batch_size):
+    """
+    Загрузка одной части полной копии в своей транзакции (выполняется в потоке пула)
+    """
+    try:
+        objects = list(_read_chunk(path, model, fields))
+        with transaction.atomic():
+            model._base_manager.bulk_create(objects, batch_size=batch_size)
+        return len(objects)
+    finally:
+        connection.close()
+
+
+def _load_full_backup(manifest, root, levels, workers, batch_size):
+    """
+    Загрузка полной копии: части разных таблиц одного уровня зависимостей загружаются параллельно
+    """
+    directory = root / manifest['name']
+    total = 0
+    for level in levels:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for model in level:
+                dump = manifest['models'].get(model._meta.label_lower)
+                if not dump or not dump['chunks']:
+                    continue
+                chunks = [directory / chunk for chunk in dump['chunks']]
+                self_referencing = any(field.is_relation and field.related_model is model
+                                       for field in model._meta.concrete_fields)
+                if self_referencing:
+                    # части таблицы со ссылками на себя - по порядку первичного ключа
+                    futures.append(executor.submit(
+                        lambda chunks=chunks, model=model, fields=dump['fields']: sum(
+                            _load_chunk(chunk, model, fields, batch_size) for chunk in chunks
+                        )
+                    ))
+                else:
+                    futures.extend(executor.submit(_load_chunk, chunk, model, dump['fields'], batch_size)
+                                   for chunk in chunks)
+            total += sum(future.result() for future in futures)
+    return total
+
+
+def _delete_missing_rows(model, pk_paths):
+    """
+    Удаление строк, первичных ключей которых нет в копии (удалены после предыдущей копии)
+    """
+    pk = model._meta.pk
+    kept = {pk.to_python(value) for path in pk_paths for value in _read_values(path)}
+    missing = [value for value in model._base_manager.values_list('pk', flat=True).iterator() if value not in kept]
+    for start in range(0, len(missing), BACKUP_DELETE_BATCH):
+        model._base_manager.filter(pk__in=missing[start:start + BACKUP_DELETE_BATCH])._raw_delete(connection.alias)
+    return len(missing)
+
+
+def _unique_field_sets(model):
+    """
+    Уникальные поля и наборы полей модели, кроме первичного ключа (имена столбцов)
+    """
+    opts = model._meta
+    field_sets = [(field.attname,) for field in opts.concrete_fields if field.unique and not field.primary_key]
+    field_sets += [tuple(opts.get_field(name).attname for name in fields) for fields in opts.unique_together]
+    field_sets += [tuple(opts.get_field(name).attname for name in constraint.fields)
+                   for constraint in opts.total_unique_constraints]
+    return list(dict.fromkeys(field_sets))
+
+
+def _delete_unique_conflicts(model, objects):
+    """
+    Удаление строк с другим первичным ключом, но теми же значениями уникальных полей, что у загружаемых
+    (например, slug удаленной и созданной заново статьи). Такая строка либо удалена после предыдущей копии,
+    либо изменена и загружается из этой же копии, поэтому вставка по первичному ключу не нарушит ограничений
+    """
+    for fields in _unique_field_sets(model):
+        for start in range(0, len(objects), BACKUP_CONFLICT_BATCH):
+            condition = Q()
+            for obj in objects[start:start + BACKUP_CONFLICT_BATCH]:
+                values = {name: getattr(obj, name) for name in fields}
+                if None not in values.values():
+                    condition |= Q(**values) & ~Q(pk=obj.pk)
+            if condition:
+                model._base_manager.filter(condition)._raw_delete(connection.alias)
+
+
+def _apply_incremental_backup(manifest, root, levels, batch_size):
+    """
+    Применение инкрементальной копии в одной транзакции (внешние ключи проверяются при фиксации):
+    таблицы 'full' заменяются целиком, из остальных удаляются строки, отсутствующие в копии,
+    затем измененные строки загружаются с обновлением по первичному ключу
+    """
+    directory = root / manifest['name']
+    dumps = [(model, manifest['models'][model._meta.label_lower]) for level in levels for model in level
+             if model._meta.label_lower in manifest['models']]
+    total = 0
+    with transaction.atomic():
+        for model, dump in dumps:
+            if dump['mode'] == 'full':
+                model._base_manager.all()._raw_delete(connection.alias)
+            else:
+                _delete_missing_rows(model, [directory / chunk for chunk in dump['pk_chunks']])
+        for model, dump in dumps:
+            for chunk in dump['chunks']:
+                objects = list(_read_chunk(directory / chunk, model, dump['fields']))
+                if dump['mode'] == 'rows':
+                    _delete_unique_conflicts(model, objects)
+                model._base_manager.bulk_create(objects, batch_size=batch_size,
+                                                **_conflict_options(model, dump['mode']))
+                total += len(objects)
+    return total
+
+
+def get_cascaded_models(models):
+    """
+    Исключенные из копии модели со ссылками на восстанавливаемые таблицы (например, admin.logentry):
+    очистка таблиц с CASCADE удалила бы их строки
+    """
+    restored = set(models)
+    return [
+        model for model in apps.get_models(include_auto_created=True)
+        if model not in restored and model._meta.managed and not model._meta.proxy
+        and any(field.is_relation and field.related_model in restored for field in model._meta.concrete_fields)
+    ]
+
+
+def _restore_cascaded_rows(directory, model, dump, batch_size):
+    """
+    Возврат сохраненных строк исключенной модели, ссылки которых есть в восстановленной БД
+    """
+    references = {
+        field: set(field.related_model._base_manager.values_list(field.target_field.attname, flat=True))
+        for field in model._meta.concrete_fields if field.is_relation
+    }
+    objects = [
+        obj for chunk in dump['chunks'] for obj in _read_chunk(directory / chunk, model, dump['fields'])
+        if all(getattr(obj, field.attname) is None or getattr(obj, field.attname) in values
+               for field, values in references.items())
+    ]
+    model._base_manager.bulk_create(objects, batch_size=batch_size)
+    return len(objects)
+
+
+@contextmanager
+def _original_timestamps(models):
+    """
+    На время загрузки отключаются auto_now / auto_now_add: bulk_create иначе заменит время из копии текущим
+    """
+    fields = [(field, field.auto_now, field.auto_now_add) for model in models
+              for field in model._meta.concrete_fields if hasattr(field, 'auto_now')]
+    for field, _, _ in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in fields:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def restore_backup(name, root=None, workers=None, batch_size=2000, log=None):
+    """
+    Восстановление базы данных из цепочки копий. Цепочка целиком проверяется до очистки БД,
+    затем таблицы очищаются, полная копия загружается параллельно, инкрементальные применяются по порядку,
+    сбрасываются последовательности первичных ключей. Строки исключенных моделей, ссылающиеся на
+    восстанавливаемые таблицы, сохраняются и возвращаются, если их ссылки восстановлены
+    """
+    root = Path(root or settings.BACKUP_ROOT)
+    chain = get_restore_chain(name, root)
+    models = get_backup_models()
+    workers = workers or settings.BACKUP_RESTORE_WORKERS
+    validate_restore_chain(chain, root, models, workers)
+    levels = get_load_levels(models)
+    cascaded = get_cascaded_models(models)
+
+    with tempfile.TemporaryDirectory(dir=root) as preserved, _original_timestamps([*models, *cascaded]):
+        preserved = Path(preserved)
+        preserved_dumps = {model: _dump_model(preserved, model, None, settings.BACKUP_CHUNK_ROWS)
+                           for model in cascaded}
+        tables = [model._meta.db_table for model in [*models, *cascaded]]
+        with transaction.atomic():
+            connection.ops.execute_sql_flush(connection.ops.sql_flush(no_style(), tables, allow_cascade=True))
+
+        total = _load_full_backup(chain[0], root, levels, workers, batch_size)
+        if log:
+            log(f'{chain[0]["name"]}: loaded')
+        for manifest in chain[1:]:
+            total += _apply_incremental_backup(manifest, root, levels, batch_size)
+            if log:
+                log(f'{manifest["name"]}: applied')
+
+        for model, dump in preserved_dumps.items():
+            kept = _restore_cascaded_rows(preserved, model, dump, batch_size)
+            if log:
+                log(f'{model._meta.label_lower}: {kept} of {dump["rows"]} rows kept')
+
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [*models, *cascaded]):
+            cursor.execute(sql)
+    return {'backups': len(chain), 'rows': total}
+
+
+def prune_backups(keep_full, root=None):
+    """
+    Удаление старых цепочек копий: остаются последние keep_full полных копий и инкрементальные после них
+    """
+    root = Path(root or settings.BACKUP_ROOT)
+    backups = get_backups(root)
+    full = [manifest['name'] for manifest in backups if manifest['kind'] == 'full']
+    if len(full) <= keep_full:
+        return 0
+    oldest_kept = next(manifest for manifest in backups if manifest['name'] == full[-keep_full])
+    removed = 0
+    for manifest in backups:
+        if manifest['created'] < oldest_kept['created']:
+            shutil.rmtree(root / manifest['name'])
+            removed += 1
+    return removed
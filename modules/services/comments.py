@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .fragments import bump_fragment_version, get_fragment_keys
+from ..blog.models import Comment
+
+COMMENT_THREAD_TEMPLATE = 'blog/comments/comment_thread.html'
+
+
+def _thread_name(root_id):
+    return f'comment_thread_{root_id}'
+
+
+def invalidate_comment_thread(root_id):
+    """
+    Инвалидация закешированного HTML одной ветки комментариев
+    """
+    bump_fragment_version(_thread_name(root_id))
+
+
+def _published_threads(article_id, root_paths):
+    """
+    Опубликованные комментарии веток одним запросом (поиск по префиксу пути в индексе (статья, путь)):
+    {id корня: корень ветки}.
+    Дочерние узлы собираются в thread_children, ответы на неопубликованные комментарии скрываются вместе с ними
+    """
+    condition = Q()
+    for path in root_paths:
+        condition |= Q(path__startswith=path)
+    comments = Comment.objects.filter(condition, article_id=article_id, status='published') \
+        .select_related('author', 'author__profile').order_by('path')
+    roots = {}
+    nodes = {}
+    for comment in comments:
+        comment.thread_children = []
+        if comment.parent_id is None:
+            roots[comment.id] = comment
+        elif comment.parent_id in nodes:
+            nodes[comment.parent_id].thread_children.append(comment)
+        else:
+            continue
+        nodes[comment.id] = comment
+    return roots
+
+
+def render_comment_threads(article_id, roots):
+    """
+    HTML веток комментариев статьи для списка корневых комментариев [(id, путь), ...].
+    Каждая ветка кешируется отдельно, ветки без кеша загружаются одним запросом
+    """
+    keys = get_fragment_keys([_thread_name(root_id) for root_id, _ in roots])
+    cached = cache.get_many(keys.values())
+    missing = [path for root_id, path in roots if keys[_thread_name(root_id)] not in cached]
+    if missing:
+        rendered = {
+            keys[_thread_name(root_id)]: render_to_string(COMMENT_THREAD_TEMPLATE, {'node': root})
+            for root_id, root in _published_threads(article_id, missing).items()
+        }
+        cache.set_many(rendered, timeout=settings.COMMENT_THREAD_CACHE_TIMEOUT)
+        cached.update(rendered)
+    return mark_safe(''.join(cached.get(keys[_thread_name(root_id)], '') for root_id, _ in roots))
+
+
+def get_comment_threads_page(article_id, page_number=1):
+    """
+    Страница веток комментариев статьи (пагинация по корневым комментариям): (страница, HTML веток)
+    """
+    roots = Comment.objects.filter(article_id=article_id, parent__isnull=True, status='published') \
+        .order_by('path').values_list('id', 'path')
+    page = Paginator(roots, settings.COMMENTS_PER_PAGE).get_page(page_number)
+    return page, render_comment_threads(article_id, list(page.object_list))
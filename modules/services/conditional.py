@@ -0,0 +1,119 @@
+import hashlib
+from functools import wraps
+from django.db.models import Count, Max, Q
+from django.views.decorators.http import condition
+
+from .fragments import get_fragment_keys
+from .page_cache import get_list_version
+from .utils import get_client_ip
+from .view_counter import record_view
+from ..blog.models import Article
+from ..blog.templatetags.blog_tags import get_sidebar_fragments
+
+
+def conditional_page(validators, not_modified=None):
+    """
+    Декоратор conditional GET (ETag / Last-Modified, ответ 304 до выполнения представления).
+    validators(request, *args, **kwargs) возвращает (части ETag, Last-Modified) или (None, None),
+    результат считается один раз на запрос и используется для обоих заголовков.
+    not_modified(request, *args, **kwargs) вызывается вместо представления при ответе 304
+    """
+
+    def get_validators(request, *args, **kwargs):
+        if not hasattr(request, '_conditional_validators'):
+            request._conditional_validators = validators(request, *args, **kwargs)
+        return request._conditional_validators
+
+    def etag(request, *args, **kwargs):
+        parts, _ = get_validators(request, *args, **kwargs)
+        return None if parts is None else hashlib.md5(repr(parts).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        return get_validators(request, *args, **kwargs)[1]
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if not_modified is not None and response.status_code == 304:
+                not_modified(request, *args, **kwargs)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _page_parts(request):
+    # страницы зависят от пользователя (кнопки, формы) и от блоков сайдбара
+    return request.user.pk, tuple(get_fragment_keys(get_sidebar_fragments()).values())
+
+
+def _list_validators(request):
+    """
+    Списки статей: последнее изменение любой статьи (индекс по time_update) и версия списков,
+    которая меняется вместе со счетчиками, удалением статей и тегами (см. bump_list_version).
+    Общие для всех списков валидаторы не зависят от размера таблицы
+    """
+    last_update = Article.objects.aggregate(last_update=Max('time_update'))['last_update']
+    return (_page_parts(request), request.get_full_path(), last_update, get_list_version()), last_update
+
+
+def article_detail_validators(request, slug):
+    """
+    Статья: время изменения, рейтинг, просмотры и опубликованные комментарии (один запрос)
+    """
+    row = Article.objects.filter(slug=slug, status='published').annotate(
+        last_comment=Max('comments__time_update', filter=Q(comments__status='published')),
+        comments_total=Count('comments', filter=Q(comments__status='published')),
+    ).values_list('id', 'time_update', 'rating_sum', 'view_count', 'last_comment', 'comments_total').first()
+    if row is None:
+        return None, None
+    request.conditional_article_id = row[0]
+    _, time_update, _, _, last_comment, _ = row
+    return (_page_parts(request), *row), max(filter(None, (time_update, last_comment)))
+
+
+def article_detail_not_modified(request, slug):
+    """
+    Ответ 304 не вызывает представление (и ViewCountMixin): просмотр статьи фиксируется здесь
+    """
+    record_view(Article(pk=request.conditional_article_id), get_client_ip(request))
+
+
+def article_list_validators(request):
+    return _list_validators(request)
+
+
+def article_category_validators(request, slug):
+    return _list_validators(request)
+
+
+def article_tag_validators(request, tag):
+    return _list_validators(request)
+
+
+def _feed_validators(queryset):
+    stats = queryset.aggregate(last_update=Max('time_update'), total=Count('id'))
+    return tuple(stats.values()), stats['last_update']
+
+
+def articles_feed_validators(request, *args, **kwargs):
+    """
+    RSS-лента и карта сайта: последнее изменение и количество опубликованных статей
+    """
+    return _feed_validators(Article.objects.filter(status='published'))
+
+
+def category_feed_validators(request, slug):
+    return _feed_validators(Article.objects.filter(status='published', category__slug=slug))
+
+
+def tag_feed_validators(request, tag):
+    return _feed_validators(Article.objects.filter(status='published', tags__slug=tag))
+
+
+def author_feed_validators(request, slug):
+    return _feed_validators(Article.objects.filter(status='published', author__profile__slug=slug))
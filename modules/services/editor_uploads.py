@@ -0,0 +1,101 @@
+import hashlib
+import os
+import re
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from .media_reprocess import optimize_image
+from .utils import CkeditorCustomStorage
+from ..blog.models import Article, EditorUpload
+
+CONTENT_ADDRESSED_DIR = 'cas'
+EDITOR_UPLOAD_PATTERN = re.compile(
+    rf'{re.escape(CkeditorCustomStorage.base_url)}({CONTENT_ADDRESSED_DIR}/[0-9a-f]{{2}}/[0-9a-f]{{64}}\.\w+)'
+)
+
+
+class ContentAddressedCkeditorStorage(CkeditorCustomStorage):
+    """
+    Хранилище файлов редактора по хешу содержимого: изображение сжимается при загрузке,
+    файл сохраняется как cas/{первые 2 символа хеша}/{sha256}.{расширение}. Повторная загрузка
+    того же содержимого возвращает уже сохраненный файл (тот же URL)
+    """
+
+    def _save(self, name, content):
+        content.seek(0)
+        data = content.read()
+        try:
+            optimized, _ = optimize_image(ContentFile(data), settings.EDITOR_UPLOAD_MAX_DIMENSION)
+        except (OSError, ValueError):
+            optimized = None
+        if optimized is not None and len(optimized) < len(data):
+            data = optimized
+
+        digest = hashlib.sha256(data).hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        name = f'{CONTENT_ADDRESSED_DIR}/{digest[:2]}/{digest}{extension}'
+        if not self.exists(name):
+            # запись без папки даты и исходного имени (FileSystemStorage._save)
+            name = super(CkeditorCustomStorage, self)._save(name, ContentFile(data))
+        # повторная загрузка продлевает защиту файла от сборки мусора до сохранения статьи
+        EditorUpload.objects.update_or_create(name=name, defaults={'size': len(data), 'time_create': timezone.now()})
+        return name
+
+
+def get_editor_upload_names(*html):
+    """
+    Файлы редактора (хранилище по хешу), на которые ссылается HTML
+    """
+    return {name for text in html if text for name in EDITOR_UPLOAD_PATTERN.findall(text)}
+
+
+def update_editor_upload_references(article):
+    """
+    Обновление индекса ссылок статьи на файлы редактора
+    """
+    names = get_editor_upload_names(article.short_description, article.full_description)
+    article.editor_uploads.set(EditorUpload.objects.filter(name__in=names) if names else [])
+
+
+def rebuild_editor_upload_references(batch_size=500):
+    """
+    Полная перестройка индекса ссылок по тексту всех статей
+    """
+    total = 0
+    articles = Article.objects.only('short_description', 'full_description').order_by('id')
+    for article in articles.iterator(chunk_size=batch_size):
+        update_editor_upload_references(article)
+        total += 1
+    return total
+
+
+def collect_orphaned_editor_uploads(grace_hours=24, batch_size=1000, dry_run=False):
+    """
+    Удаление файлов редактора без ссылок из статей, загруженных раньше grace_hours часов назад
+    (свежий файл может принадлежать еще не сохраненной статье). Файлы и строки удаляются пачками:
+    условия проверяются повторно при удалении (под блокировкой строк), файлы удаляются только для удаленных строк
+    """
+    storage = ContentAddressedCkeditorStorage()
+    orphans = EditorUpload.objects.filter(articles__isnull=True,
+                                          time_create__lt=timezone.now() - timedelta(hours=grace_hours))
+    removed = freed = 0
+    last_id = 0
+    while True:
+        batch = list(orphans.filter(id__gt=last_id).order_by('id').values_list('id', 'name', 'size')[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        if not dry_run:
+            # за время обхода файл могли добавить в статью или загрузить повторно
+            with transaction.atomic():
+                batch = list(orphans.filter(id__in=[upload_id for upload_id, _, _ in batch])
+                             .select_for_update(of=('self',)).values_list('id', 'name', 'size'))
+                EditorUpload.objects.filter(id__in=[upload_id for upload_id, _, _ in batch]).delete()
+            for _, name, _ in batch:
+                storage.delete(name)
+        removed += len(batch)
+        freed += sum(size for _, _, size in batch)
+    return {'removed': removed, 'freed': freed}
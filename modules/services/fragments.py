@@ -0,0 +1,45 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+FRAGMENT_VERSION_KEY = 'fragment:version:{name}'
+FRAGMENT_KEY = 'fragment:{name}:v{version}'
+
+
+def bump_fragment_version(*names):
+    """
+    Инвалидация фрагментов: увеличение версии в ключе кеша, старые версии истекают сами
+    """
+    for name in names:
+        key = FRAGMENT_VERSION_KEY.format(name=name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def get_fragment_keys(names):
+    """
+    Ключи кеша текущих версий фрагментов: {имя фрагмента: ключ} (одно обращение к кешу)
+    """
+    version_keys = {name: FRAGMENT_VERSION_KEY.format(name=name) for name in names}
+    versions = cache.get_many(version_keys.values())
+    return {name: FRAGMENT_KEY.format(name=name, version=versions.get(version_keys[name], 0)) for name in names}
+
+
+def render_fragments(fragments, force=False):
+    """
+    Отрисовка фрагментов шаблонов с кешированием готового HTML.
+    fragments - словарь {имя фрагмента: (шаблон, время жизни в кеше[, контекст шаблона])}.
+    На прогретом кеше - два обращения к кешу и ни одного SQL-запроса
+    """
+    fragment_keys = get_fragment_keys(fragments)
+    cached = {} if force else cache.get_many(fragment_keys.values())
+
+    result = {}
+    for name, (template_name, timeout, *context) in fragments.items():
+        html = cached.get(fragment_keys[name])
+        if html is None:
+            html = render_to_string(template_name, *context)
+            cache.set(fragment_keys[name], html, timeout=timeout)
+        result[name] = html
+    return result
@@ -0,0 +1,92 @@
+import base64
+import hashlib
+import os
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .page_cache import purge_surrogate_keys
+from ..blog.models import Article
+
+RENDITION_FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 85, 'progressive': True},
+}
+PLACEHOLDER_WIDTH = 16
+
+
+def _open_image(file):
+    img = Image.open(file)
+    img = ImageOps.exif_transpose(img)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img
+
+
+def _encode(img, extension):
+    buffer = BytesIO()
+    img.save(buffer, **RENDITION_FORMATS[extension])
+    return buffer.getvalue()
+
+
+def _save_rendition(content, width, extension):
+    """
+    Сохранение копии под именем из хеша содержимого: имя меняется вместе с картинкой,
+    поэтому файлы можно кешировать у клиента без ограничения срока
+    """
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    name = os.path.join(settings.THUMBNAIL_RENDITIONS_DIR, digest[:2], f'{digest}-{width}w.{extension}')
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(content))
+    return name
+
+
+def make_placeholder(img):
+    """
+    LQIP: крошечная JPEG-копия в виде data URI, растягивается с размытием до загрузки изображения
+    """
+    height = max(1, round(img.height * PLACEHOLDER_WIDTH / img.width))
+    tiny = img.resize((PLACEHOLDER_WIDTH, height), Image.BILINEAR)
+    buffer = BytesIO()
+    tiny.save(buffer, format='JPEG', quality=40)
+    return f'data:image/jpeg;base64,{base64.b64encode(buffer.getvalue()).decode()}'
+
+
+def generate_renditions(file):
+    """
+    Набор копий изображения по ширинам THUMBNAIL_WIDTHS во всех форматах RENDITION_FORMATS:
+    {'width': ширина оригинала, 'height': высота, 'placeholder': data URI, 'webp': [[ширина, имя], ...], ...}.
+    Копии шире оригинала не создаются
+    """
+    img = _open_image(file)
+    widths = [width for width in settings.THUMBNAIL_WIDTHS if width < img.width] or [img.width]
+    renditions = {'width': img.width, 'height': img.height, 'placeholder': make_placeholder(img)}
+    for extension in RENDITION_FORMATS:
+        renditions[extension] = []
+    for width in widths:
+        resized = img if width == img.width else img.resize((width, round(img.height * width / img.width)),
+                                                              Image.LANCZOS)
+        for extension in RENDITION_FORMATS:
+            renditions[extension].append([width, _save_rendition(_encode(resized, extension), width, extension)])
+    return renditions
+
+
+def process_article_thumbnail(article_id):
+    """
+    Обработка превью статьи вне запроса: оригинал не изменяется, копии записываются в thumbnail_renditions.
+    Если превью заменили во время обработки, результат отбрасывается (его обработает следующая задача)
+    """
+    article = Article.objects.filter(pk=article_id).only('thumbnail').first()
+    if article is None or not article.thumbnail:
+        return False
+    with article.thumbnail.open('rb') as file:
+        renditions = generate_renditions(file)
+    # копии меняют HTML статьи: time_update обновляется для условных GET и инкрементальных копий БД
+    updated = Article.objects.filter(pk=article_id, thumbnail=article.thumbnail.name) \
+        .update(thumbnail_renditions=renditions, time_update=timezone.now())
+    if updated:
+        purge_surrogate_keys(f'article:{article_id}')
+    return bool(updated)
@@ -0,0 +1,107 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from ....blog.models import Article, Comment
+
+NESTED_SET_TABLE = 'benchmark_comments_nested_set'
+
+
+class Command(BaseCommand):
+    """
+    Команда для сравнения скорости параллельной вставки ответов в одну ветку комментариев:
+    материализованный путь (модель Comment) и вложенные множества (вставка первым потомком,
+    как у MPTT с order_insertion_by = ('-time_create',), во вспомогательной таблице).
+    Созданные командой комментарии и таблица удаляются после замера
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--article', type=int, default=None, help='id статьи (по умолчанию - первая статья)')
+        parser.add_argument('--threads', type=int, default=8, help='Количество параллельных потоков')
+        parser.add_argument('--inserts', type=int, default=500, help='Количество вставок на каждый способ')
+
+    def handle(self, *args, **options):
+        article = Article.objects.filter(pk=options['article']).first() if options['article'] \
+            else Article.objects.order_by('id').first()
+        if article is None:
+            raise CommandError('Статья для замера не найдена')
+        threads, inserts = options['threads'], options['inserts']
+
+        path_rate = self.benchmark(article, threads, inserts,
+                                   self.setup_path, self.insert_path_comment, self.teardown_path)
+        nested_set_rate = self.benchmark(article, threads, inserts,
+                                         self.setup_nested_set, self.insert_nested_set_comment,
+                                         self.teardown_nested_set)
+        self.stdout.write(f'Materialized path: {path_rate:.1f} inserts/s')
+        self.stdout.write(f'Nested set (MPTT): {nested_set_rate:.1f} inserts/s')
+        self.stdout.write(self.style.SUCCESS(f'Speedup: x{path_rate / nested_set_rate:.2f}'))
+
+    def benchmark(self, article, threads, inserts, setup, insert, teardown):
+        parent_ids = setup(article)
+
+        def worker(count):
+            try:
+                for _ in range(count):
+                    parent_ids.append(insert(article, random.choice(parent_ids)))
+            finally:
+                connection.close()
+
+        counts = [inserts // threads + (1 if index < inserts % threads else 0) for index in range(threads)]
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(worker, counts))
+        rate = inserts / (time.monotonic() - started)
+        teardown(parent_ids[0])
+        return rate
+
+    def setup_path(self, article):
+        root = Comment.objects.create(article=article, author=article.author, content='benchmark')
+        return [root.id]
+
+    def insert_path_comment(self, article, parent_id):
+        return Comment.objects.create(article=article, author_id=article.author_id, parent_id=parent_id,
+                                      content='benchmark').id
+
+    def setup_nested_set(self, article):
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                CREATE UNLOGGED TABLE {NESTED_SET_TABLE} (
+                    id serial PRIMARY KEY, tree_id integer NOT NULL, lft integer NOT NULL, rght integer NOT NULL,
+                    parent_id integer, content text NOT NULL
+                )
+            """)
+            cursor.execute(f'CREATE INDEX ON {NESTED_SET_TABLE} (tree_id, lft)')
+            cursor.execute(f'CREATE INDEX ON {NESTED_SET_TABLE} (tree_id, rght)')
+            cursor.execute(f"""
+                INSERT INTO {NESTED_SET_TABLE} (tree_id, lft, rght, content) VALUES (1, 1, 2, 'benchmark')
+                RETURNING id
+            """)
+            root_id = cursor.fetchone()[0]
+        return [root_id]
+
+    def insert_nested_set_comment(self, article, parent_id):
+        """
+        Вставка первым потомком: сдвиг lft/rght всех узлов правее родителя под блокировкой ветки
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {NESTED_SET_TABLE} WHERE tree_id = 1 AND lft = 1 FOR UPDATE')
+            cursor.execute(f'SELECT lft FROM {NESTED_SET_TABLE} WHERE id = %s', [parent_id])
+            parent_lft = cursor.fetchone()[0]
+            cursor.execute(f'UPDATE {NESTED_SET_TABLE} SET rght = rght + 2 WHERE tree_id = 1 AND rght > %s',
+                           [parent_lft])
+            cursor.execute(f'UPDATE {NESTED_SET_TABLE} SET lft = lft + 2 WHERE tree_id = 1 AND lft > %s',
+                           [parent_lft])
+            cursor.execute(f"""
+                INSERT INTO {NESTED_SET_TABLE} (tree_id, lft, rght, parent_id, content)
+                VALUES (1, %s, %s, %s, 'benchmark') RETURNING id
+            """, [parent_lft + 1, parent_lft + 2, parent_id])
+            return cursor.fetchone()[0]
+
+    def teardown_path(self, root_id):
+        Comment.objects.filter(pk=root_id).delete()
+
+    def teardown_nested_set(self, root_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {NESTED_SET_TABLE}')
@@ -0,0 +1,41 @@
+from django.core.management import BaseCommand
+
+from ...utils import get_redis_connection
+from ...view_counter import get_hll_view_count
+from ....blog.models import Article, ViewCount
+
+COMPARE_HLL_KEY = 'blog:views:hll:compare'
+
+
+class Command(BaseCommand):
+    """
+    Команда для оценки расхождения HyperLogLog с точным количеством просмотров (ViewCount) на выборке статей.
+    hll - живой счетчик режима 'hll', rebuilt - HyperLogLog, заново построенный по IP-адресам из ViewCount
+    (показывает погрешность самого алгоритма без учета разницы в периодах сбора)
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=100, help='Количество случайных статей в выборке')
+
+    def handle(self, *args, **options):
+        redis = get_redis_connection()
+        article_ids = list(Article.objects.order_by('?').values_list('id', flat=True)[:options['sample']])
+        errors = []
+        self.stdout.write(f'{"article":>10} {"exact":>10} {"hll":>10} {"rebuilt":>10} {"error %":>8}')
+        for article_id in article_ids:
+            ips = list(ViewCount.objects.filter(article_id=article_id).values_list('ip_address', flat=True))
+            redis.delete(COMPARE_HLL_KEY)
+            for start in range(0, len(ips), 10000):
+                redis.pfadd(COMPARE_HLL_KEY, *ips[start:start + 10000])
+            rebuilt = redis.pfcount(COMPARE_HLL_KEY)
+            exact = len(ips)
+            error = abs(rebuilt - exact) / exact * 100 if exact else 0
+            errors.append(error)
+            self.stdout.write(f'{article_id:>10} {exact:>10} {get_hll_view_count(article_id):>10} {rebuilt:>10} '
+                              f'{error:>8.2f}')
+        redis.delete(COMPARE_HLL_KEY)
+
+        if errors:
+            self.stdout.write(self.style.SUCCESS(
+                f'Articles: {len(errors)}, mean error: {sum(errors) / len(errors):.2f}%, max error: {max(errors):.2f}%'
+            ))
@@ -0,0 +1,35 @@
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+
+from ....blog.models import Comment
+
+
+class Command(BaseCommand):
+    """
+    Команда для заполнения материализованных путей комментариев по связям parent_id
+    (перевод дерева комментариев с MPTT, а также починка путей после bulk_create)
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only-empty', action='store_true', help='Обновить только комментарии без пути')
+
+    def handle(self, *args, **options):
+        table = Comment._meta.db_table
+        segment = f"lpad(({Comment.PATH_BASE} - {{alias}}.id)::text, {Comment.PATH_STEP}, '0')"
+        only_empty = f"AND {table}.path = ''" if options['only_empty'] else ''
+        self.stdout.write('Converting comment tree...')
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE')
+            cursor.execute(f"""
+                WITH RECURSIVE tree AS (
+                    SELECT root.id, {segment.format(alias='root')} AS path
+                    FROM {table} root WHERE root.parent_id IS NULL
+                    UNION ALL
+                    SELECT child.id, tree.path || {segment.format(alias='child')}
+                    FROM {table} child JOIN tree ON child.parent_id = tree.id
+                )
+                UPDATE {table} SET path = tree.path
+                FROM tree WHERE {table}.id = tree.id AND {table}.path IS DISTINCT FROM tree.path {only_empty}
+            """)
+            updated = cursor.rowcount
+        self.stdout.write(self.style.SUCCESS(f'Paths successfully updated for {updated} comments'))
@@ -1,21 +1,30 @@
-from django.core.management import BaseCommand, call_command
-from datetime import datetime
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from ...backup import create_backup, prune_backups
 
 
 class Command(BaseCommand):
     """
-    Команда для создания резервной копии базы данных
+    Команда для создания резервной копии базы данных (сжатые части JSON Lines по каждой модели в BACKUP_ROOT)
     """
 
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Только строки, измененные с начала предыдущей копии (без копий - полная)')
+        parser.add_argument('--chunk-rows', type=int, default=settings.BACKUP_CHUNK_ROWS,
+                            help='Количество строк в одной сжатой части')
+        parser.add_argument('--keep-full', type=int,
+                            help='Удалить старые копии, оставив указанное количество полных копий')
+
     def handle(self, *args, **options):
         self.stdout.write('Waiting for database dump...')
-        call_command(
-            'dumpdata',
-            '--natural-foreign',
-            '--natural-primary',
-            '--exclude=contenttypes',
-            '--exclude=admin.logentry',
-            '--indent=4',
-            f'--output=database-{datetime.now().strftime("%Y-%m-%d-%H-%M-%S")}.json'
-        )
-        self.stdout.write(self.style.SUCCESS('Database successfully backed up'))
+        manifest = create_backup(incremental=options['incremental'], chunk_rows=options['chunk_rows'])
+        rows = sum(dump['rows'] for dump in manifest['models'].values())
+        chunks = sum(len(dump['chunks']) for dump in manifest['models'].values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Database successfully backed up: {manifest["name"]} ({rows} rows in {chunks} chunks)'
+        ))
+        if options['keep_full']:
+            removed = prune_backups(options['keep_full'])
+            self.stdout.write(f'Removed {removed} old backups')
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError, call_command
+
+from ...backup import get_backups, restore_backup
+
+
+class Command(BaseCommand):
+    """
+    Команда для восстановления базы данных из резервной копии dbackup (с цепочкой инкрементальных копий).
+    Счетчики просмотров и рейтинга статей обновляются без изменения time_update и не попадают
+    в инкрементальные копии, поэтому после восстановления цепочки они пересчитываются (rebuild_counters).
+    В режиме VIEW_COUNT_MODE = 'hll' просмотры переносятся из Redis периодической задачей
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs='?', help='Имя копии в BACKUP_ROOT (по умолчанию - последняя)')
+        parser.add_argument('--workers', type=int, default=settings.BACKUP_RESTORE_WORKERS,
+                            help='Количество потоков загрузки')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Строк в одном INSERT')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Не запрашивать подтверждение')
+
+    def handle(self, *args, **options):
+        backups = get_backups()
+        if not backups:
+            raise CommandError(f'No backups found in {settings.BACKUP_ROOT}')
+        name = options['name'] or backups[-1]['name']
+
+        if options['interactive']:
+            confirm = input(
+                f'You have requested a restore of the database from {name}.\n'
+                'This will IRREVERSIBLY DESTROY all data currently in the database.\n'
+                "Are you sure you want to do this?\n\n    Type 'yes' to continue, or 'no' to cancel: "
+            )
+            if confirm != 'yes':
+                self.stdout.write('Restore cancelled.')
+                return
+
+        try:
+            result = restore_backup(name, workers=options['workers'], batch_size=options['batch_size'],
+                                    log=self.stdout.write)
+        except ValueError as error:
+            raise CommandError(error)
+        if result['backups'] > 1 and settings.VIEW_COUNT_MODE != 'hll':
+            call_command('rebuild_counters', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Database restored from {name}: {result["rows"]} rows from {result["backups"]} backups'
+        ))
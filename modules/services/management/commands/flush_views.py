@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand
+
+from ...view_counter import flush_view_buffer, get_view_buffer_stats
+
+
+class Command(BaseCommand):
+    """
+    Команда для сброса буфера просмотров статей в базу данных и вывода метрик буфера
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stats', action='store_true', help='Только вывести метрики буфера без сброса')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            stats = get_view_buffer_stats()
+        else:
+            self.stdout.write('Flushing view buffer...')
+            stats = flush_view_buffer()
+        for key, value in stats.items():
+            self.stdout.write(f'{key}: {value}')
+        if not options['stats']:
+            self.stdout.write(self.style.SUCCESS('View buffer successfully flushed'))
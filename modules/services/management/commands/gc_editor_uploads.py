@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from ...editor_uploads import collect_orphaned_editor_uploads, rebuild_editor_upload_references
+
+
+class Command(BaseCommand):
+    """
+    Команда для удаления файлов редактора (хранилище по хешу), на которые не ссылается ни одна статья
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=int, default=settings.EDITOR_UPLOAD_GC_GRACE_HOURS,
+                            help='Не удалять файлы, загруженные позже указанного количества часов назад')
+        parser.add_argument('--rebuild-index', action='store_true',
+                            help='Перед удалением перестроить индекс ссылок по тексту всех статей')
+        parser.add_argument('--dry-run', action='store_true', help='Только подсчитать, файлы не удаляются')
+
+    def handle(self, *args, **options):
+        if options['rebuild_index']:
+            total = rebuild_editor_upload_references()
+            self.stdout.write(f'References rebuilt for {total} articles')
+        result = collect_orphaned_editor_uploads(options['grace_hours'], dry_run=options['dry_run'])
+        label = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{label} {result["removed"]} orphaned uploads ({result["freed"] / 1024 / 1024:.2f} MB)'
+        ))
@@ -0,0 +1,20 @@
+from django.core.management import BaseCommand
+
+from ...sitemap import generate_sitemaps
+
+
+class Command(BaseCommand):
+    """
+    Команда для генерации статических файлов карты сайта (индекс и шарды статей)
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Перегенерировать все шарды')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Generating sitemaps...')
+        result = generate_sitemaps(force=options['force'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Sitemaps successfully generated: {result["regenerated"]} of {result["shards"]} shards updated, '
+            f'{result["removed"]} removed'
+        ))
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from ...media_backup import create_media_snapshot, prune_media_snapshots, verify_media_snapshot
+
+
+class Command(BaseCommand):
+    """
+    Команда для инкрементального резервного копирования медиа в MEDIA_BACKUP_ROOT
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.MEDIA_BACKUP_WORKERS,
+                            help='Количество потоков для подсчета хешей')
+        parser.add_argument('--keep', type=int, help='Удалить старые снимки, оставив указанное количество')
+        parser.add_argument('--verify', nargs='?', const='', metavar='NAME',
+                            help='Не создавать снимок, а сверить файлы снимка (по умолчанию - последнего) с манифестом')
+
+    def handle(self, *args, **options):
+        if options['verify'] is not None:
+            return self.verify(options['verify'] or None, options['workers'])
+
+        self.stdout.write('Waiting for media snapshot...')
+        stats = create_media_snapshot(workers=options['workers'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Media successfully backed up: {stats["name"]} ({stats["files"]} files, {stats["linked"]} linked, '
+            f'{stats["copied"]} copied, {stats["copied_bytes"] / 1024 / 1024:.2f} MB)'
+        ))
+        if options['keep']:
+            removed = prune_media_snapshots(options['keep'])
+            self.stdout.write(f'Removed {removed} old snapshots')
+
+    def verify(self, name, workers):
+        try:
+            result = verify_media_snapshot(name, workers=workers)
+        except ValueError as error:
+            raise CommandError(error)
+        for key in result['missing']:
+            self.stderr.write(f'missing: {key}')
+        for key in result['corrupted']:
+            self.stderr.write(f'corrupted: {key}')
+        if result['missing'] or result['corrupted']:
+            raise CommandError(f'Snapshot {result["name"]}: {len(result["missing"])} missing, '
+                               f'{len(result["corrupted"])} corrupted of {result["files"]} files')
+        self.stdout.write(self.style.SUCCESS(f'Snapshot {result["name"]} verified: {result["files"]} files'))
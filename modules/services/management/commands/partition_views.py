@@ -0,0 +1,20 @@
+from django.core.management import BaseCommand
+
+from ...view_retention import ensure_view_partitions, partition_view_table
+
+
+class Command(BaseCommand):
+    """
+    Команда для перевода таблицы просмотров на месячные секции и создания секций на следующие месяцы
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=None,
+                            help='На сколько месяцев вперед создавать секции (по умолчанию VIEW_PARTITIONS_AHEAD)')
+
+    def handle(self, *args, **options):
+        if partition_view_table(options['months_ahead']):
+            self.stdout.write(self.style.SUCCESS('View table successfully partitioned'))
+        for name in ensure_view_partitions(options['months_ahead']):
+            self.stdout.write(f'Partition {name} created')
+        self.stdout.write(self.style.SUCCESS('View partitions are up to date'))
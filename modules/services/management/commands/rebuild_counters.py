@@ -0,0 +1,16 @@
+from django.core.management import BaseCommand
+
+from ...page_cache import bump_list_version
+from ....blog.models import Article
+
+
+class Command(BaseCommand):
+    """
+    Команда для пересчета хранимых счетчиков статей (просмотры и рейтинг) по исходным таблицам
+    """
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding article counters...')
+        updated = Article.objects.rebuild_counters()
+        bump_list_version()
+        self.stdout.write(self.style.SUCCESS(f'Counters successfully rebuilt for {updated} articles'))
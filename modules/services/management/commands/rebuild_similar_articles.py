@@ -0,0 +1,14 @@
+from django.core.management import BaseCommand
+
+from ...similar import rebuild_all_similar_articles
+
+
+class Command(BaseCommand):
+    """
+    Команда для полного пересчета индекса похожих статей
+    """
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding similar articles...')
+        total = rebuild_all_similar_articles()
+        self.stdout.write(self.style.SUCCESS(f'Similar articles successfully rebuilt for {total} articles'))
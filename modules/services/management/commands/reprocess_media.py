@@ -0,0 +1,41 @@
+from django.core.management import BaseCommand
+
+from ...media_reprocess import reprocess_media, render_missing_renditions
+
+
+class Command(BaseCommand):
+    """
+    Команда для пересжатия уже загруженных изображений (превью, аватары, файлы редактора) в пуле процессов.
+    Обработанные файлы записываются в манифест, повторный запуск продолжает с необработанных
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Количество процессов (по умолчанию - все ядра)')
+        parser.add_argument('--max-dimension', type=int, default=2560,
+                            help='Уменьшать изображения, у которых большая сторона длиннее (px), 0 - не уменьшать')
+        parser.add_argument('--dry-run', action='store_true', help='Только подсчитать экономию, файлы не изменяются')
+        parser.add_argument('--manifest', default=None, help='Путь к манифесту (по умолчанию - в MEDIA_ROOT)')
+        parser.add_argument('--renditions', action='store_true',
+                            help='Создать недостающие копии превью статей и нормализовать старые аватары')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Reprocessing media...')
+        stats = reprocess_media(workers=options['workers'], max_dimension=options['max_dimension'] or None,
+                                dry_run=options['dry_run'], manifest_path=options['manifest'],
+                                log=lambda message: self.stderr.write(message))
+        seconds = max(stats['seconds'], 1e-6)
+        megabytes = stats['bytes_before'] / 1024 / 1024
+        saved = stats['bytes_before'] - stats['bytes_after']
+        self.stdout.write(f'Files: {stats["files"]} processed, {stats["skipped"]} already in manifest, '
+                          f'{stats["errors"]} errors')
+        self.stdout.write(f'Throughput: {stats["files"] / seconds:.1f} files/s, {megabytes / seconds:.2f} MB/s')
+        label = 'Projected savings' if options['dry_run'] else 'Saved'
+        percent = saved / stats['bytes_before'] * 100 if stats['bytes_before'] else 0
+        self.stdout.write(self.style.SUCCESS(f'{label}: {saved / 1024 / 1024:.2f} MB ({percent:.1f}%)'))
+
+        if options['renditions'] and not options['dry_run']:
+            result = render_missing_renditions(workers=options['workers'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Thumbnail renditions: {result["articles"]}, normalized avatars: {result["avatars"]}, '
+                f'failed: {result["failed"]}'
+            ))
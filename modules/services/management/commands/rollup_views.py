@@ -0,0 +1,22 @@
+from django.core.management import BaseCommand
+
+from ...view_retention import ensure_view_partitions, rollup_views
+
+
+class Command(BaseCommand):
+    """
+    Команда для свертки старых просмотров статей в дневные агрегаты
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Сколько дней хранить сырые просмотры (по умолчанию VIEW_RETENTION_DAYS)')
+
+    def handle(self, *args, **options):
+        for name in ensure_view_partitions():
+            self.stdout.write(f'Partition {name} created')
+        self.stdout.write('Rolling up views...')
+        result = rollup_views(options['days'])
+        for name in result['dropped_partitions']:
+            self.stdout.write(f'Partition {name} rolled up and dropped')
+        self.stdout.write(self.style.SUCCESS(f'{result["rolled_up"]} views successfully rolled up'))
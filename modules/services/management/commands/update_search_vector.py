@@ -0,0 +1,28 @@
+from django.core.management import BaseCommand
+
+from ....blog.models import Article
+
+
+class Command(BaseCommand):
+    """
+    Команда для заполнения поискового вектора статей (пакетами по диапазонам id)
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество статей в одном UPDATE')
+        parser.add_argument('--only-empty', action='store_true', help='Обновить только статьи без вектора')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Updating search vectors...')
+        queryset = Article.objects.get_queryset()
+        if options['only_empty']:
+            queryset = queryset.filter(search_vector__isnull=True)
+
+        batch_size = options['batch_size']
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+        updated = 0
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            updated += Article.objects.filter(pk__in=batch).update(search_vector=Article.get_search_vector())
+            self.stdout.write(f'{updated}/{len(ids)}')
+        self.stdout.write(self.style.SUCCESS(f'Search vectors successfully updated for {updated} articles'))
@@ -0,0 +1,170 @@
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from django.conf import settings
+from django.utils import timezone
+
+from .media_reprocess import file_digest
+
+MEDIA_BACKUP_MANIFEST = 'manifest.json'
+MEDIA_BACKUP_PARTIAL = '.partial'
+
+
+def iter_media_backup_files(root, exclude):
+    """
+    Все файлы MEDIA_ROOT, кроме каталогов exclude (восстанавливаемые данные: карта сайта и т.п.)
+    """
+    root = Path(root)
+    excluded = {root / directory for directory in exclude}
+    for current, subdirs, files in os.walk(root):
+        subdirs[:] = [name for name in subdirs if Path(current, name) not in excluded]
+        for name in files:
+            yield Path(current, name)
+
+
+def get_media_snapshots(root=None):
+    """
+    Завершенные снимки медиа в MEDIA_BACKUP_ROOT, от старых к новым
+    """
+    root = Path(root or settings.MEDIA_BACKUP_ROOT)
+    if not root.exists():
+        return []
+    return sorted(path.name for path in root.iterdir()
+                  if path.is_dir() and not path.name.endswith(MEDIA_BACKUP_PARTIAL))
+
+
+def load_media_manifest(snapshot):
+    """
+    Манифест снимка: {относительный путь: [sha256, размер, mtime]}
+    """
+    path = Path(snapshot) / MEDIA_BACKUP_MANIFEST
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def _link_or_copy(source, target):
+    """
+    Жесткая ссылка на файл предыдущего снимка (копия, если ссылку создать нельзя, например на другом разделе)
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(source, target)
+        return True
+    except OSError:
+        shutil.copy2(source, target)
+        return False
+
+
+def _stat_key(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+
+def create_media_snapshot(root=None, workers=None, log=None):
+    """
+    Инкрементальный снимок MEDIA_ROOT в каталоге с датой: новые и измененные файлы копируются,
+    неизмененные - жесткие ссылки на файлы предыдущего снимка (каждый снимок выглядит полным, но места не занимает).
+    Хеши считаются в пуле потоков только для файлов, у которых изменились размер или mtime.
+    Снимок собирается во временном каталоге и переименовывается после записи манифеста
+    """
+    media_root = Path(settings.MEDIA_ROOT)
+    root = Path(root or settings.MEDIA_BACKUP_ROOT)
+    snapshots = get_media_snapshots(root)
+    previous_dir = root / snapshots[-1] if snapshots else None
+    previous = load_media_manifest(previous_dir) if previous_dir else {}
+    # файлы предыдущего снимка по хешу: переименованные и перемещенные файлы не копируются повторно
+    by_digest = {entry[0]: key for key, entry in previous.items()}
+
+    # незавершенные снимки прерванных запусков
+    for path in root.glob(f'*{MEDIA_BACKUP_PARTIAL}'):
+        shutil.rmtree(path)
+    # микросекунды фиксированной ширины: снимки одной секунды не совпадают по имени,
+    # а сортировка имен как строк совпадает с порядком создания
+    name = timezone.localtime().strftime('%Y-%m-%d-%H-%M-%S-%f')
+    directory = root / f'{name}{MEDIA_BACKUP_PARTIAL}'
+    directory.mkdir(parents=True)
+
+    files, unchanged, changed = {}, [], []
+    for path in iter_media_backup_files(media_root, settings.MEDIA_BACKUP_EXCLUDE):
+        key = str(path.relative_to(media_root))
+        try:
+            files[key] = _stat_key(path)
+        except FileNotFoundError:
+            continue
+        entry = previous.get(key)
+        if entry and [entry[1], entry[2]] == list(files[key]):
+            unchanged.append(key)
+        else:
+            changed.append(key)
+
+    with ThreadPoolExecutor(max_workers=workers or settings.MEDIA_BACKUP_WORKERS) as executor:
+        digests = dict(zip(changed, executor.map(lambda key: file_digest(media_root / key), changed)))
+
+    manifest = {}
+    stats = {'files': 0, 'linked': 0, 'copied': 0, 'copied_bytes': 0}
+    for key in unchanged:
+        _link_or_copy(previous_dir / key, directory / key)
+        manifest[key] = previous[key]
+        stats['linked'] += 1
+    for key, digest in digests.items():
+        source = by_digest.get(digest)
+        if source is not None:
+            _link_or_copy(previous_dir / source, directory / key)
+            stats['linked'] += 1
+        else:
+            target = directory / key
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(media_root / key, target)
+            stats['copied'] += 1
+            stats['copied_bytes'] += files[key][0]
+            if log:
+                log(f'copied {key}')
+        manifest[key] = [digest, *files[key]]
+    stats['files'] = len(manifest)
+
+    (directory / MEDIA_BACKUP_MANIFEST).write_text(json.dumps(manifest))
+    directory.rename(root / name)
+    stats['name'] = name
+    return stats
+
+
+def verify_media_snapshot(name=None, root=None, workers=None):
+    """
+    Проверка снимка: хеш каждого файла сверяется с манифестом.
+    Возвращает списки отсутствующих и поврежденных файлов
+    """
+    root = Path(root or settings.MEDIA_BACKUP_ROOT)
+    snapshots = get_media_snapshots(root)
+    name = name or (snapshots[-1] if snapshots else None)
+    if name not in snapshots:
+        raise ValueError(f'Снимок медиа {name} не найден')
+    directory = root / name
+    manifest = load_media_manifest(directory)
+
+    def check(key):
+        path = directory / key
+        if not path.exists():
+            return key, 'missing'
+        if file_digest(path) != manifest[key][0]:
+            return key, 'corrupted'
+        return key, None
+
+    result = {'name': name, 'files': len(manifest), 'missing': [], 'corrupted': []}
+    with ThreadPoolExecutor(max_workers=workers or settings.MEDIA_BACKUP_WORKERS) as executor:
+        for key, error in executor.map(check, manifest):
+            if error:
+                result[error].append(key)
+    return result
+
+
+def prune_media_snapshots(keep, root=None):
+    """
+    Удаление старых снимков (файлы, на которые ссылаются более новые снимки, остаются на диске)
+    """
+    root = Path(root or settings.MEDIA_BACKUP_ROOT)
+    snapshots = get_media_snapshots(root)
+    removed = snapshots[:-keep] if keep else []
+    for name in removed:
+        shutil.rmtree(root / name)
+    return len(removed)
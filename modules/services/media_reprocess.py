@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .avatars import normalize_avatar
+from .images import generate_renditions
+from .page_cache import purge_surrogate_keys
+from ..blog.models import Article
+from ..system.models import Profile
+
+REPROCESS_FORMATS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 80, 'method': 6},
+}
+REPROCESS_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+MANIFEST_SAVE_EVERY = 200
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_media_files(root, directories, exclude):
+    """
+    Изображения из каталогов directories внутри MEDIA_ROOT (каталоги exclude - уже оптимизированные копии)
+    """
+    root = Path(root)
+    excluded = {root / directory for directory in exclude}
+    for directory in directories:
+        for current, subdirs, files in os.walk(root / directory):
+            subdirs[:] = [name for name in subdirs if Path(current, name) not in excluded]
+            for name in files:
+                if name.lower().endswith(REPROCESS_EXTENSIONS):
+                    yield Path(current, name)
+
+
+def optimize_image(file, max_dimension=None):
+    """
+    Пересжатие изображения в том же формате: (содержимое, формат) или (None, формат),
+    если формат не поддерживается (GIF, анимация). EXIF-поворот применяется, ICC-профиль сохраняется
+    """
+    with Image.open(file) as img:
+        image_format = img.format
+        if image_format not in REPROCESS_FORMATS or getattr(img, 'is_animated', False):
+            return None, image_format
+        icc_profile = img.info.get('icc_profile')
+        img = ImageOps.exif_transpose(img)
+        if max_dimension and max(img.size) > max_dimension:
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        if image_format == 'JPEG' and img.mode != 'RGB':
+            img = img.convert('RGB')
+        buffer = BytesIO()
+        img.save(buffer, format=image_format, icc_profile=icc_profile, **REPROCESS_FORMATS[image_format])
+    return buffer.getvalue(), image_format
+
+
+def recompress_image(path, max_dimension=None, dry_run=False):
+    """
+    Пересжатие изображения на месте (выполняется в дочернем процессе).
+    Файл перезаписывается, только если результат меньше исходного.
+    Возвращает (путь, размер до, размер после, sha256 итогового файла, ошибка)
+    """
+    size_before = os.path.getsize(path)
+    try:
+        content, _ = optimize_image(path, max_dimension)
+    except (OSError, ValueError) as error:
+        return str(path), size_before, size_before, None, str(error)
+
+    if content is None or len(content) >= size_before:
+        return str(path), size_before, size_before, file_digest(path), None
+    if not dry_run:
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+    return str(path), size_before, len(content), hashlib.sha256(content).hexdigest(), None
+
+
+class MediaManifest:
+    """
+    Манифест обработанных файлов: {относительный путь: [sha256, размер, mtime]}.
+    Файл пропускается, если не изменился после обработки (размер и mtime совпадают, иначе сверяется хеш)
+    """
+
+    def __init__(self, path, root):
+        self.path = Path(path)
+        self.root = Path(root)
+        self.entries = json.loads(self.path.read_text()) if self.path.exists() else {}
+
+    def key(self, path):
+        return str(Path(path).relative_to(self.root))
+
+    def is_processed(self, path):
+        entry = self.entries.get(self.key(path))
+        if entry is None:
+            return False
+        stat = os.stat(path)
+        if [entry[1], entry[2]] == [stat.st_size, stat.st_mtime]:
+            return True
+        return entry[0] == file_digest(path)
+
+    def add(self, path, digest):
+        stat = os.stat(path)
+        self.entries[self.key(path)] = [digest, stat.st_size, stat.st_mtime]
+
+    def save(self):
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.entries))
+        os.replace(tmp_path, self.path)
+
+
+def reprocess_media(workers=None, max_dimension=None, dry_run=False, manifest_path=None, log=None):
+    """
+    Параллельное пересжатие изображений медиа (ProcessPoolExecutor на все ядра) с продолжением по манифесту.
+    Возвращает статистику: файлы, байты до и после, ошибки, время
+    """
+    root = Path(settings.MEDIA_ROOT)
+    manifest = MediaManifest(manifest_path or root / settings.MEDIA_REPROCESS_MANIFEST, root)
+    # импорт внутри функции: модуль загрузок редактора сам импортирует optimize_image
+    from .editor_uploads import CONTENT_ADDRESSED_DIR
+    # файлы редактора по хешу сжимаются при загрузке, а перезапись изменила бы содержимое под именем-хешем
+    exclude = (settings.THUMBNAIL_RENDITIONS_DIR, settings.AVATAR_NORMALIZED_DIR, settings.AVATAR_IDENTICONS_DIR,
+               f'uploads/{CONTENT_ADDRESSED_DIR}')
+    found = list(iter_media_files(root, settings.MEDIA_REPROCESS_DIRS, exclude))
+    paths = [path for path in found if not manifest.is_processed(path)]
+
+    stats = {'files': 0, 'skipped': len(found) - len(paths), 'bytes_before': 0, 'bytes_after': 0, 'errors': 0}
+    started = time.monotonic()
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(recompress_image, paths, [max_dimension] * len(paths), [dry_run] * len(paths),
+                               chunksize=16)
+        for path, size_before, size_after, digest, error in results:
+            stats['files'] += 1
+            stats['bytes_before'] += size_before
+            stats['bytes_after'] += size_after
+            if error:
+                stats['errors'] += 1
+                if log:
+                    log(f'{path}: {error}')
+            elif not dry_run:
+                manifest.add(path, digest)
+                if stats['files'] % MANIFEST_SAVE_EVERY == 0:
+                    manifest.save()
+    if not dry_run:
+        manifest.save()
+    stats['seconds'] = time.monotonic() - started
+    return stats
+
+
+def _render_thumbnail(path):
+    try:
+        with open(path, 'rb') as file:
+            return generate_renditions(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _normalize_avatar(path):
+    try:
+        with open(path, 'rb') as file:
+            return normalize_avatar(file)
+    except (OSError, ValueError):
+        return None
+
+
+def render_missing_renditions(workers=None):
+    """
+    Копии превью статей без thumbnail_renditions и нормализация аватаров, загруженных до AVATAR_SIZES.
+    Изображения обрабатываются в пуле процессов, запись в БД - в основном процессе.
+    Аватары в комментариях обновятся после сброса кеша веток (COMMENT_THREAD_CACHE_TIMEOUT)
+    """
+    articles = list(Article.objects.exclude(thumbnail='').filter(thumbnail_renditions={})
+                    .values_list('id', 'thumbnail'))
+    profiles = list(Profile.objects.exclude(avatar='').exclude(avatar__startswith=settings.AVATAR_NORMALIZED_DIR)
+                    .values_list('id', 'avatar'))
+    root = Path(settings.MEDIA_ROOT)
+    # соединения с БД не должны наследоваться дочерними процессами (пересоздаются при следующем запросе)
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        renditions = executor.map(_render_thumbnail, [root / name for _, name in articles])
+        avatars = executor.map(_normalize_avatar, [root / name for _, name in profiles])
+        rendered = [article_id for (article_id, name), value in zip(articles, renditions)
+                    if value and Article.objects.filter(pk=article_id, thumbnail=name)
+                    .update(thumbnail_renditions=value, time_update=timezone.now())]
+        normalized = [profile_id for (profile_id, name), value in zip(profiles, avatars)
+                      if value and Profile.objects.filter(pk=profile_id, avatar=name).update(avatar=value)]
+    purge_surrogate_keys(*[f'article:{article_id}' for article_id in rendered])
+    return {'articles': len(rendered), 'avatars': len(normalized),
+            'failed': len(articles) + len(profiles) - len(rendered) - len(normalized)}
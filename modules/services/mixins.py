@@ -1,8 +1,12 @@
+from django.conf import settings
 from django.contrib.auth.mixins import AccessMixin, UserPassesTestMixin
 from django.core.exceptions import PermissionDenied
 from django.contrib import messages
+from django.http import Http404
 from django.shortcuts import redirect
 
+from .pagination import CursorPaginator, InvalidCursor
+
 
 class AuthorRequiredMixin(AccessMixin):
     """
@@ -33,4 +37,46 @@ class UserIsNotAuthenticatedMixin(UserPassesTestMixin):
         return True
 
     def handle_no_permission(self):
-        return redirect('home')
\ No newline at end of file
+        return redirect('home')
+
+
+class CursorPaginationMixin:
+    """
+    Миксин курсорной пагинации для ListView.
+    Старые ссылки вида ?page=N продолжают работать через стандартный Paginator
+    """
+    cursor_ordering = ('-fixed', '-time_create', 'id')
+    cursor_query_param = 'cursor'
+    cursor_approximate_total = False
+
+    def paginate_queryset(self, queryset, page_size):
+        if settings.PAGINATION_MODE != 'cursor' or self.page_kwarg in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = CursorPaginator(queryset, page_size, self.cursor_ordering, query_param=self.cursor_query_param,
+                                    approximate_total=self.cursor_approximate_total)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_query_param), querydict=self.request.GET)
+        except InvalidCursor:
+            raise Http404('Некорректная ссылка на страницу')
+        return paginator, page, page.object_list, page.has_other_pages()
+
+
+class SurrogateKeyMixin:
+    """
+    Миксин кеша страниц: ответ помечается ключами (surrogate keys), по которым страница сбрасывается из кеша.
+    Для списков к ключу списка добавляются ключи всех статей на странице
+    """
+    surrogate_keys = ()
+
+    def get_surrogate_keys(self, context):
+        keys = list(self.surrogate_keys)
+        for obj in context.get('object_list') or ():
+            keys.append(f'article:{obj.pk}')
+        return keys
+
+    def render_to_response(self, context, **response_kwargs):
+        response = super().render_to_response(context, **response_kwargs)
+        response.surrogate_keys = self.get_surrogate_keys(context)
+        response['Surrogate-Key'] = ' '.join(response.surrogate_keys)
+        return response
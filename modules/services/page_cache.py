@@ -0,0 +1,72 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+
+from .utils import get_redis_connection
+
+PAGE_KEY = 'page:{digest}'
+SURROGATE_KEY = 'page:surrogate:{key}'
+# версия списков статей: меняется при изменениях, которые не обновляют time_update
+# (счетчики просмотров и рейтинга, удаление статей, теги)
+LIST_VERSION_KEY = 'page:version:lists'
+
+
+def get_page_cache_key(request):
+    digest = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return PAGE_KEY.format(digest=digest)
+
+
+def get_cached_page(request):
+    """
+    Закешированная страница: {'response': ответ, 'view_article_id': id статьи для счетчика просмотров}
+    """
+    return cache.get(get_page_cache_key(request))
+
+
+def cache_page(request, response, surrogate_keys, view_article_id=None, timeout=None):
+    """
+    Сохранение готового ответа в кеш и привязка его к ключам сброса (surrogate keys)
+    """
+    page_key = get_page_cache_key(request)
+    timeout = timeout or settings.PAGE_CACHE_TIMEOUT
+    cache.set(page_key, {'response': response, 'view_article_id': view_article_id}, timeout=timeout)
+    pipe = get_redis_connection().pipeline(transaction=False)
+    for key in surrogate_keys:
+        index_key = SURROGATE_KEY.format(key=key)
+        pipe.sadd(index_key, page_key)
+        # индекс общий для многих страниц: срок жизни только продлевается (новый ключ без TTL получает его через NX)
+        pipe.expire(index_key, timeout, nx=True)
+        pipe.expire(index_key, timeout, gt=True)
+    pipe.execute()
+
+
+def purge_surrogate_keys(*keys):
+    """
+    Сброс из кеша всех страниц, помеченных хотя бы одним из ключей
+    """
+    if not keys:
+        return 0
+    redis = get_redis_connection()
+    index_keys = [SURROGATE_KEY.format(key=key) for key in keys]
+    pipe = redis.pipeline(transaction=False)
+    for index_key in index_keys:
+        pipe.smembers(index_key)
+    page_keys = set().union(*pipe.execute())
+    if page_keys:
+        cache.delete_many(page_keys)
+    redis.delete(*index_keys)
+    return len(page_keys)
+
+
+def bump_list_version():
+    """
+    Новая версия списков статей (входит в ETag страниц списков, см. services.conditional)
+    """
+    try:
+        cache.incr(LIST_VERSION_KEY)
+    except ValueError:
+        cache.set(LIST_VERSION_KEY, 1, timeout=None)
+
+
+def get_list_version():
+    return cache.get(LIST_VERSION_KEY, 0)
@@ -0,0 +1,154 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from django.core import signing
+from django.db.models import Q
+from django.http import QueryDict
+from django.utils.functional import cached_property
+
+CURSOR_SALT = 'services.pagination.cursor'
+
+
+class InvalidCursor(Exception):
+    """
+    Ошибка: курсор страницы поврежден или подделан
+    """
+
+
+class CursorPage:
+    """
+    Страница курсорной пагинации (совместима по интерфейсу с Page для шаблонов)
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None, querydict=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.querydict = querydict
+
+    def __repr__(self):
+        return f'<CursorPage: {len(self.object_list)} items>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def _querystring(self, cursor):
+        querydict = self.querydict.copy() if self.querydict is not None else QueryDict(mutable=True)
+        querydict.pop('page', None)
+        querydict[self.paginator.query_param] = cursor
+        return querydict.urlencode()
+
+    @property
+    def next_querystring(self):
+        return self._querystring(self.next_cursor) if self.has_next() else ''
+
+    @property
+    def previous_querystring(self):
+        return self._querystring(self.previous_cursor) if self.has_previous() else ''
+
+
+class CursorPaginator:
+    """
+    Курсорная (keyset) пагинация: вместо OFFSET и COUNT(*) следующая страница
+    выбирается условием "после последней записи" по полям сортировки.
+    Сортировка должна однозначно определять порядок (последнее поле - уникальное, например id)
+    """
+
+    def __init__(self, queryset, per_page, ordering, query_param='cursor', approximate_total=False):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.query_param = query_param
+        self.approximate_total = approximate_total
+
+    @cached_property
+    def count(self):
+        """
+        Приблизительное количество записей по оценке планировщика (без COUNT(*))
+        """
+        if not self.approximate_total:
+            return None
+        plan = json.loads(self.queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def _field_names(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def encode_cursor(self, obj, direction):
+        values = []
+        for name in self._field_names():
+            value = getattr(obj, name)
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            elif isinstance(value, Decimal):
+                # десятичные значения передаются строкой без потери точности
+                value = str(value)
+            values.append(value)
+        return signing.dumps({'d': direction, 'v': values}, salt=CURSOR_SALT, compress=True)
+
+    def decode_cursor(self, cursor):
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            raise InvalidCursor(cursor)
+        if not isinstance(data, dict) or data.get('d') not in ('next', 'prev') \
+                or len(data.get('v', ())) != len(self.ordering):
+            raise InvalidCursor(cursor)
+        return data['d'], data['v']
+
+    def _keyset_filter(self, values, reverse):
+        """
+        Условие "строго после записи" для составного ключа сортировки:
+        (a < x) OR (a = x AND b < y) OR (a = x AND b = y AND c > z) ...
+        """
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            step = Q(**{f'{name}__{"lt" if descending else "gt"}': values[index]})
+            for previous_field, previous_value in zip(self.ordering[:index], values[:index]):
+                step &= Q(**{previous_field.lstrip('-'): previous_value})
+            condition |= step
+        return condition
+
+    def _reversed_ordering(self):
+        return [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+
+    def page(self, cursor=None, querydict=None):
+        direction, values = self.decode_cursor(cursor) if cursor else ('next', None)
+        reverse = direction == 'prev'
+        queryset = self.queryset.order_by(*(self._reversed_ordering() if reverse else self.ordering))
+        if values is not None:
+            queryset = queryset.filter(self._keyset_filter(values, reverse))
+
+        # лишняя запись показывает, есть ли еще одна страница в направлении движения
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or reverse:
+                next_cursor = self.encode_cursor(rows[-1], 'next')
+            if (has_more and reverse) or (values is not None and not reverse):
+                previous_cursor = self.encode_cursor(rows[0], 'prev')
+        return CursorPage(rows, self, next_cursor, previous_cursor, querydict)
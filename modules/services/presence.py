@@ -0,0 +1,73 @@
+import time
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from .utils import get_redis_connection
+
+PRESENCE_KEY = 'system:presence'
+PRESENCE_FLUSHED_KEY = 'system:presence:flushed'
+PRESENCE_LOCAL_LIMIT = 10000
+
+# время последней записи по пользователям в памяти процесса (без обращения к Redis на каждый запрос).
+# Ограничение действует в пределах одного процесса: при N процессах запись возможна до N раз за интервал
+_recent_writes = {}
+
+
+def touch_presence(user_id, now=None):
+    """
+    Отметка активности пользователя: ZADD в множество присутствия (оценка - время),
+    не чаще раза в PRESENCE_WRITE_INTERVAL секунд на пользователя в каждом процессе
+    """
+    now = now or time.time()
+    if now - _recent_writes.get(user_id, 0) < settings.PRESENCE_WRITE_INTERVAL:
+        return False
+    if len(_recent_writes) >= PRESENCE_LOCAL_LIMIT:
+        _recent_writes.clear()
+    _recent_writes[user_id] = now
+    get_redis_connection().zadd(PRESENCE_KEY, {user_id: now}, gt=True)
+    return True
+
+
+def get_online_user_ids(user_ids):
+    """
+    Пользователи из user_ids, активные в последние PRESENCE_ONLINE_SECONDS секунд (один ZMSCORE на весь список)
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return set()
+    since = time.time() - settings.PRESENCE_ONLINE_SECONDS
+    scores = get_redis_connection().zmscore(PRESENCE_KEY, user_ids)
+    return {user_id for user_id, score in zip(user_ids, scores) if score is not None and score >= since}
+
+
+def set_online_status(profiles):
+    """
+    Статус "онлайн" для списка профилей одним запросом (используется Profile.is_online без обращения к Redis)
+    """
+    profiles = list(profiles)
+    online = get_online_user_ids(profile.user_id for profile in profiles)
+    for profile in profiles:
+        profile.online = profile.user_id in online
+    return profiles
+
+
+def flush_presence():
+    """
+    Перенос времени активности в auth_user.last_login одним UPDATE для всех пользователей, активных после
+    предыдущего переноса, и удаление из множества записей старше PRESENCE_ONLINE_SECONDS
+    """
+    redis = get_redis_connection()
+    flushed = float(redis.get(PRESENCE_FLUSHED_KEY) or 0)
+    entries = redis.zrangebyscore(PRESENCE_KEY, f'({flushed}', '+inf', withscores=True)
+    if entries:
+        User.objects.bulk_update(
+            [User(id=int(user_id), last_login=datetime.fromtimestamp(score, tz=dt_timezone.utc))
+             for user_id, score in entries],
+            ['last_login'],
+        )
+        flushed = max(score for _, score in entries)
+        redis.set(PRESENCE_FLUSHED_KEY, flushed)
+    # перенесенные в БД записи, по которым пользователь уже не в сети
+    redis.zremrangebyscore(PRESENCE_KEY, '-inf', f'({min(flushed, time.time() - settings.PRESENCE_ONLINE_SECONDS)}')
+    return len(entries)
@@ -0,0 +1,70 @@
+from django.db import connection
+
+from .page_cache import bump_list_version
+from ..blog.models import Article, Rating
+
+RATING_TOGGLE_ATTEMPTS = 3
+
+
+def _toggle_rating_sql():
+    """
+    Один запрос для переключения оценки и обновления суммы рейтинга статьи:
+    - оценка с тем же значением удаляется;
+    - оценка с другим значением меняется;
+    - если оценки нет, она создается.
+    Сумма рейтинга статьи меняется на разницу значений, таблица оценок не пересчитывается
+    """
+    ratings_table = Rating._meta.db_table
+    articles_table = Article._meta.db_table
+    return f"""
+        WITH existing AS (
+            SELECT id, value FROM {ratings_table}
+            WHERE article_id = %(article_id)s AND ip_address = %(ip_address)s::inet
+            FOR UPDATE
+        ), removed AS (
+            DELETE FROM {ratings_table} rating USING existing
+            WHERE rating.id = existing.id AND existing.value = %(value)s
+            RETURNING -existing.value AS delta, 'deleted' AS status
+        ), changed AS (
+            UPDATE {ratings_table} rating SET value = %(value)s, user_id = %(user_id)s
+            FROM existing
+            WHERE rating.id = existing.id AND existing.value <> %(value)s
+            RETURNING %(value)s - existing.value AS delta, 'update' AS status
+        ), created AS (
+            INSERT INTO {ratings_table} (article_id, ip_address, user_id, value, time_create)
+            SELECT article.id, %(ip_address)s::inet, %(user_id)s, %(value)s, now()
+            FROM {articles_table} article
+            WHERE article.id = %(article_id)s AND NOT EXISTS (SELECT 1 FROM existing)
+            ON CONFLICT (article_id, ip_address) DO NOTHING
+            RETURNING value AS delta, 'created' AS status
+        ), result AS (
+            SELECT delta, status FROM removed
+            UNION ALL SELECT delta, status FROM changed
+            UNION ALL SELECT delta, status FROM created
+        )
+        UPDATE {articles_table} article SET rating_sum = article.rating_sum + result.delta
+        FROM result
+        WHERE article.id = %(article_id)s
+        RETURNING result.status, article.rating_sum
+    """
+
+
+def toggle_rating(article_id, ip_address, value, user_id=None):
+    """
+    Переключение оценки статьи за один запрос к БД.
+    Возвращает (статус, новая сумма рейтинга) или None, если статья не найдена.
+    Пустой результат означает, что параллельный запрос с того же IP успел создать оценку
+    между чтением и вставкой - в этом случае запрос повторяется уже с видимой оценкой
+    """
+    params = {'article_id': article_id, 'ip_address': ip_address, 'value': value, 'user_id': user_id}
+    sql = _toggle_rating_sql()
+    for _ in range(RATING_TOGGLE_ATTEMPTS):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is not None:
+            bump_list_version()
+            return row
+        if not Article.objects.filter(pk=article_id).exists():
+            return None
+    return None
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from taggit.models import Tag
+
+from ..blog.models import Article, SimilarArticle
+
+
+def rebuild_similar_articles(article_id):
+    """
+    Пересчет топ-N похожих статей для одной статьи по количеству общих тегов
+    """
+    tag_ids = Tag.objects.filter(article=article_id).values('id')
+    neighbours = Article.objects.filter(tags__in=tag_ids, status='published').exclude(id=article_id) \
+        .order_by().values('id').annotate(score=Count('tags')) \
+        .order_by('-score', '-id')[:settings.SIMILAR_ARTICLES_LIMIT]
+
+    with transaction.atomic():
+        SimilarArticle.objects.filter(article_id=article_id).delete()
+        SimilarArticle.objects.bulk_create([
+            SimilarArticle(article_id=article_id, similar_id=neighbour['id'], score=neighbour['score'])
+            for neighbour in neighbours
+        ])
+
+
+def update_similar_articles(article_id):
+    """
+    Инкрементальное обновление индекса похожих статей после изменения тегов или статуса статьи.
+    Пересчитываются сама статья, статьи, в топе которых она была (могла выпасть),
+    и все опубликованные статьи с общими тегами (могла попасть в их топ - отношение несимметрично)
+    """
+    affected = set(SimilarArticle.objects.filter(similar_id=article_id).values_list('article_id', flat=True))
+    tag_ids = Tag.objects.filter(article=article_id).values('id')
+    affected.update(Article.objects.filter(tags__in=tag_ids, status='published').exclude(id=article_id)
+                    .order_by().values_list('id', flat=True).distinct())
+    rebuild_similar_articles(article_id)
+    for neighbour_id in affected:
+        rebuild_similar_articles(neighbour_id)
+    return len(affected) + 1
+
+
+def rebuild_all_similar_articles():
+    """
+    Полный пересчет индекса похожих статей
+    """
+    article_ids = Article.objects.order_by().values_list('id', flat=True)
+    for article_id in article_ids.iterator():
+        rebuild_similar_articles(article_id)
+    return article_ids.count()
@@ -0,0 +1,102 @@
+import json
+import os
+from pathlib import Path
+from xml.sax.saxutils import escape
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.db.models import Count, F, Max
+from django.urls import reverse
+
+from ..blog.models import Article
+
+SITEMAP_INDEX = 'sitemap.xml'
+SITEMAP_STATIC = 'sitemap-static.xml'
+SITEMAP_SHARD = 'sitemap-articles-{shard}.xml'
+SITEMAP_MANIFEST = 'manifest.json'
+SITEMAP_STATIC_PAGES = ('home', 'feedback')
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def _write_atomic(path, chunks):
+    """
+    Запись файла через временный файл: nginx никогда не отдает недописанную карту сайта
+    """
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        for chunk in chunks:
+            file.write(chunk)
+    os.replace(tmp_path, path)
+
+
+def _urlset(urls):
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_NS}">\n'
+    for location, lastmod in urls:
+        yield f'<url><loc>{escape(location)}</loc>'
+        if lastmod:
+            yield f'<lastmod>{lastmod.date().isoformat()}</lastmod>'
+        yield '</url>\n'
+    yield '</urlset>\n'
+
+
+def _shard_stats(shard_size):
+    """
+    Состояние шардов одним запросом: {номер шарда: (количество статей, последнее изменение)}.
+    Шард - диапазон id статей размером SITEMAP_SHARD_SIZE
+    """
+    rows = Article.objects.filter(status='published').order_by() \
+        .annotate(shard=F('id') / shard_size).values('shard') \
+        .annotate(total=Count('id'), last_update=Max('time_update')).values_list('shard', 'total', 'last_update')
+    return {shard: (total, last_update) for shard, total, last_update in rows}
+
+
+def _write_shard(root, base_url, shard, shard_size):
+    articles = Article.objects.filter(status='published', id__gte=shard * shard_size,
+                                      id__lt=(shard + 1) * shard_size) \
+        .order_by('id').values_list('slug', 'time_update')
+    urls = ((f'{base_url}{reverse("articles_detail", args=[slug])}', time_update)
+            for slug, time_update in articles.iterator(chunk_size=2000))
+    _write_atomic(root / SITEMAP_SHARD.format(shard=shard), _urlset(urls))
+
+
+def _sitemap_index(base_url, stats):
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{SITEMAP_NS}">\n'
+    yield f'<sitemap><loc>{base_url}/sitemaps/{SITEMAP_STATIC}</loc></sitemap>\n'
+    for shard in sorted(stats, key=int):
+        _, last_update = stats[shard]
+        yield f'<sitemap><loc>{base_url}/sitemaps/{SITEMAP_SHARD.format(shard=shard)}</loc>' \
+              f'<lastmod>{last_update[:10]}</lastmod></sitemap>\n'
+    yield '</sitemapindex>\n'
+
+
+def generate_sitemaps(force=False):
+    """
+    Генерация индекса карты сайта и шардов в статические файлы SITEMAP_ROOT (отдаются nginx).
+    Перезаписываются только шарды, у которых изменились количество статей или MAX(time_update)
+    """
+    root = Path(settings.SITEMAP_ROOT)
+    root.mkdir(parents=True, exist_ok=True)
+    shard_size = settings.SITEMAP_SHARD_SIZE
+    base_url = f'https://{Site.objects.get_current().domain}'
+
+    manifest_path = root / SITEMAP_MANIFEST
+    manifest = {} if force or not manifest_path.exists() else json.loads(manifest_path.read_text())
+    stats = {
+        str(shard): [total, last_update.isoformat()] for shard, (total, last_update) in _shard_stats(shard_size).items()
+    }
+    if manifest.get('shard_size') != shard_size:
+        manifest = {}
+    previous = manifest.get('shards', {})
+
+    changed = [shard for shard, state in stats.items() if previous.get(shard) != state]
+    removed = [shard for shard in previous if shard not in stats]
+    for shard in changed:
+        _write_shard(root, base_url, int(shard), shard_size)
+    for shard in removed:
+        (root / SITEMAP_SHARD.format(shard=shard)).unlink(missing_ok=True)
+
+    if changed or removed or not (root / SITEMAP_INDEX).exists():
+        _write_atomic(root / SITEMAP_STATIC, _urlset((f'{base_url}{reverse(name)}', None)
+                                                     for name in SITEMAP_STATIC_PAGES))
+        _write_atomic(root / SITEMAP_INDEX, _sitemap_index(base_url, stats))
+        _write_atomic(manifest_path, [json.dumps({'shard_size': shard_size, 'shards': stats})])
+    return {'shards': len(stats), 'regenerated': len(changed), 'removed': len(removed)}
@@ -1,7 +1,20 @@
 from celery import shared_task
-from django.core.management import call_command
+from django.conf import settings
+from django.utils import timezone
 
+from .backup import create_backup, prune_backups
+from .media_backup import create_media_snapshot, prune_media_snapshots
 from .email import send_contact_email_message, send_activate_email_message
+from .presence import flush_presence
+from .view_counter import flush_view_buffer, sync_hll_view_counts
+from .view_retention import ensure_view_partitions, rollup_views
+from .similar import update_similar_articles
+from .sitemap import generate_sitemaps
+from .images import process_article_thumbnail
+from .editor_uploads import collect_orphaned_editor_uploads
+from .timeline import push_article, remove_article, follow_authors, unfollow_authors
+from .fragments import render_fragments
+from ..blog.templatetags.blog_tags import get_sidebar_fragments
 
 
 @shared_task
@@ -25,6 +38,115 @@ def send_contact_email_message_task(subject, email, content, ip, user_id):
 @shared_task
 def dbackup_task():
     """
-    Выполнение резервного копирования базы данных
+    Выполнение резервного копирования базы данных: полная копия раз в неделю, в остальные дни - инкрементальная.
+    Старые цепочки копий удаляются
     """
-    call_command('dbackup')
+    incremental = timezone.localdate().weekday() != settings.BACKUP_FULL_WEEKDAY
+    manifest = create_backup(incremental=incremental)
+    prune_backups(settings.BACKUP_KEEP_FULL)
+    return manifest['name']
+
+
+@shared_task
+def mbackup_task():
+    """
+    Инкрементальный снимок медиа и удаление старых снимков
+    """
+    stats = create_media_snapshot()
+    prune_media_snapshots(settings.MEDIA_BACKUP_KEEP)
+    return stats
+
+
+@shared_task
+def flush_view_buffer_task():
+    """
+    Сброс буфера просмотров статей из Redis в базу данных (режим VIEW_COUNT_MODE = 'buffered'),
+    в режиме 'hll' - перенос оценок уникальных посетителей в счетчики статей
+    """
+    if settings.VIEW_COUNT_MODE == 'hll':
+        return sync_hll_view_counts()
+    return flush_view_buffer()
+
+
+@shared_task
+def flush_presence_task():
+    """
+    Перенос времени активности пользователей из Redis в last_login одним запросом
+    """
+    return flush_presence()
+
+
+@shared_task
+def rollup_views_task():
+    """
+    Создание секций таблицы просмотров на следующие месяцы и свертка старых просмотров в дневные агрегаты
+    """
+    ensure_view_partitions()
+    return rollup_views()
+
+
+@shared_task
+def generate_sitemaps_task():
+    """
+    Генерация статических файлов карты сайта (только измененные шарды)
+    """
+    return generate_sitemaps()
+
+
+@shared_task
+def gc_editor_uploads_task():
+    """
+    Удаление файлов редактора, на которые не ссылается ни одна статья
+    """
+    return collect_orphaned_editor_uploads(settings.EDITOR_UPLOAD_GC_GRACE_HOURS)
+
+
+@shared_task
+def process_article_thumbnail_task(article_id):
+    """
+    Создание копий превью статьи (задача ставится сигналом после загрузки нового превью)
+    """
+    return process_article_thumbnail(article_id)
+
+
+@shared_task
+def update_similar_articles_task(article_id):
+    """
+    Обновление индекса похожих статей после изменения тегов статьи
+    """
+    return update_similar_articles(article_id)
+
+
+@shared_task
+def push_article_to_timelines_task(article_id):
+    """
+    Рассылка опубликованной статьи по лентам подписчиков автора (снятая с публикации удаляется из лент)
+    """
+    return push_article(article_id)
+
+
+@shared_task
+def remove_article_from_timelines_task(article_id, author_id):
+    """
+    Удаление статьи из лент подписчиков автора
+    """
+    return remove_article(article_id, author_id)
+
+
+@shared_task
+def update_timeline_following_task(profile_id, author_profile_ids, followed):
+    """
+    Обновление ленты подписчика после подписки или отписки от авторов
+    """
+    if followed:
+        return follow_authors(profile_id, author_profile_ids)
+    return unfollow_authors(profile_id, author_profile_ids)
+
+
+@shared_task
+def refresh_sidebar_task():
+    """
+    Перерисовка блоков сайдбара с окном времени (популярные статьи) по расписанию
+    """
+    fragments = get_sidebar_fragments()
+    render_fragments({'sidebar_popular_articles': fragments['sidebar_popular_articles']}, force=True)
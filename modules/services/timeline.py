@@ -0,0 +1,199 @@
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+
+from .pagination import CursorPage, InvalidCursor
+from .utils import get_redis_connection
+from ..blog.models import Article
+from ..system.models import Profile
+
+# v2: оценка - время публикации в микросекундах (целое число точно хранится в score ZSET)
+TIMELINE_KEY = 'blog:timeline:v2:{profile_id}'
+TIMELINE_CELEBRITIES_KEY = 'blog:timeline:celebrities'
+TIMELINE_CURSOR_SALT = 'services.timeline.cursor'
+TIMELINE_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _timeline_key(profile_id):
+    return TIMELINE_KEY.format(profile_id=profile_id)
+
+
+def _score(article):
+    return (article.time_create - TIMELINE_EPOCH) // timedelta(microseconds=1)
+
+
+def _follower_ids(author_id, limit=None):
+    followers = Profile.objects.filter(following__user_id=author_id).order_by().values_list('id', flat=True)
+    return list(followers[:limit] if limit else followers)
+
+
+def push_article(article_id):
+    """
+    Fan-out on write: добавление опубликованной статьи в ленты всех подписчиков автора.
+    Авторы с количеством подписчиков больше TIMELINE_FANOUT_LIMIT помечаются как "популярные",
+    их статьи подмешиваются в ленту при чтении (fan-out on read)
+    """
+    article = Article.objects.filter(pk=article_id).only('id', 'author_id', 'time_create', 'status').first()
+    if article is None:
+        return 0
+    if article.status != 'published':
+        return remove_article(article.id, article.author_id)
+
+    redis = get_redis_connection()
+    # лишний подписчик сверх лимита - признак популярного автора, весь список не загружается
+    follower_ids = _follower_ids(article.author_id, settings.TIMELINE_FANOUT_LIMIT + 1)
+    if len(follower_ids) > settings.TIMELINE_FANOUT_LIMIT:
+        redis.sadd(TIMELINE_CELEBRITIES_KEY, article.author_id)
+        return 0
+    redis.srem(TIMELINE_CELEBRITIES_KEY, article.author_id)
+
+    pipe = redis.pipeline(transaction=False)
+    for follower_id in follower_ids:
+        key = _timeline_key(follower_id)
+        pipe.zadd(key, {article.id: _score(article)})
+        pipe.zremrangebyrank(key, 0, -settings.TIMELINE_MAX_LENGTH - 1)
+    pipe.execute()
+    return len(follower_ids)
+
+
+def remove_article(article_id, author_id):
+    """
+    Удаление статьи (удаленной или снятой с публикации) из лент подписчиков автора.
+    Для популярных авторов ленты не содержат их статей; оставшиеся ссылки удаляются при чтении ленты
+    """
+    redis = get_redis_connection()
+    if redis.sismember(TIMELINE_CELEBRITIES_KEY, author_id):
+        return 0
+    follower_ids = _follower_ids(author_id)
+    pipe = redis.pipeline(transaction=False)
+    for follower_id in follower_ids:
+        pipe.zrem(_timeline_key(follower_id), article_id)
+    pipe.execute()
+    return len(follower_ids)
+
+
+def rebuild_timeline(profile):
+    """
+    Построение ленты подписчика из БД (первое обращение или потеря данных в Redis)
+    """
+    redis = get_redis_connection()
+    celebrity_ids = {int(author_id) for author_id in redis.smembers(TIMELINE_CELEBRITIES_KEY)}
+    author_ids = set(profile.following.values_list('user_id', flat=True)) - celebrity_ids
+    if not author_ids:
+        return 0
+    articles = Article.objects.filter(author_id__in=author_ids, status='published') \
+        .order_by('-time_create').only('id', 'time_create')[:settings.TIMELINE_MAX_LENGTH]
+    scores = {article.id: _score(article) for article in articles}
+    if scores:
+        redis.zadd(_timeline_key(profile.id), scores)
+    return len(scores)
+
+
+def follow_authors(profile_id, author_profile_ids):
+    """
+    Добавление недавних статей новых авторов в ленту подписчика (статьи популярных авторов подмешиваются при чтении)
+    """
+    key = _timeline_key(profile_id)
+    redis = get_redis_connection()
+    celebrity_ids = {int(author_id) for author_id in redis.smembers(TIMELINE_CELEBRITIES_KEY)}
+    articles = Article.objects.filter(author__profile__id__in=author_profile_ids, status='published') \
+        .exclude(author_id__in=celebrity_ids) \
+        .order_by('-time_create').only('id', 'time_create')[:settings.TIMELINE_MAX_LENGTH]
+    scores = {article.id: _score(article) for article in articles}
+    if scores:
+        pipe = redis.pipeline()
+        pipe.zadd(key, scores)
+        pipe.zremrangebyrank(key, 0, -settings.TIMELINE_MAX_LENGTH - 1)
+        pipe.execute()
+
+
+def unfollow_authors(profile_id, author_profile_ids):
+    """
+    Удаление статей авторов из ленты после отписки
+    """
+    article_ids = list(Article.objects.filter(author__profile__id__in=author_profile_ids)
+                       .values_list('id', flat=True))
+    if article_ids:
+        get_redis_connection().zrem(_timeline_key(profile_id), *article_ids)
+
+
+class TimelinePaginator:
+    """
+    Пагинатор ленты подписок: только переход вперед по курсору (оценка и id последней статьи страницы)
+    """
+    query_param = 'cursor'
+    count = None
+
+    def __init__(self, per_page):
+        self.per_page = per_page
+
+    def encode_cursor(self, score, article_id):
+        return signing.dumps([score, article_id], salt=TIMELINE_CURSOR_SALT)
+
+    def decode_cursor(self, cursor):
+        try:
+            score, article_id = signing.loads(cursor, salt=TIMELINE_CURSOR_SALT)
+            return int(score), int(article_id)
+        except (signing.BadSignature, TypeError, ValueError):
+            raise InvalidCursor(cursor)
+
+
+def _timeline_candidates(redis, key, per_page, before):
+    """
+    Статьи ленты из Redis после курсора: {id: оценка}. Статьи с той же оценкой, что у курсора,
+    упорядочиваются по id (ZSET сравнивает их как строки, поэтому они выбираются все и фильтруются здесь)
+    """
+    if before is None:
+        rows = redis.zrevrangebyscore(key, '+inf', '-inf', start=0, num=per_page + 1, withscores=True)
+        return {int(article_id): int(score) for article_id, score in rows}
+    ties = redis.zcount(key, before[0], before[0])
+    rows = redis.zrevrangebyscore(key, before[0], '-inf', start=0, num=per_page + 1 + ties, withscores=True)
+    return {int(article_id): int(score) for article_id, score in rows if (int(score), int(article_id)) < before}
+
+
+def get_timeline_page(profile, per_page, cursor=None, querydict=None):
+    """
+    Страница ленты подписок: идентификаторы читаются из Redis, статьи популярных авторов
+    подмешиваются запросом к БД, затем все статьи загружаются одним запросом.
+    Удаленные, снятые с публикации статьи и статьи авторов без подписки удаляются из ленты,
+    и страница добирается заново
+    """
+    paginator = TimelinePaginator(per_page)
+    before = paginator.decode_cursor(cursor) if cursor else None
+    redis = get_redis_connection()
+    key = _timeline_key(profile.id)
+    if not redis.exists(key):
+        rebuild_timeline(profile)
+
+    followed_ids = set(profile.following.values_list('user_id', flat=True))
+    celebrity_ids = {int(author_id) for author_id in redis.smembers(TIMELINE_CELEBRITIES_KEY)} & followed_ids
+    celebrity_candidates = {}
+    if celebrity_ids:
+        celebrity_articles = Article.objects.filter(author_id__in=celebrity_ids, status='published')
+        if before is not None:
+            created = TIMELINE_EPOCH + timedelta(microseconds=before[0])
+            celebrity_articles = celebrity_articles.filter(
+                Q(time_create__lt=created) | Q(time_create=created, id__lt=before[1]))
+        for article in celebrity_articles.order_by('-time_create', '-id').only('id', 'time_create')[:per_page + 1]:
+            celebrity_candidates[article.id] = _score(article)
+
+    while True:
+        candidates = {**_timeline_candidates(redis, key, per_page, before), **celebrity_candidates}
+        ordered_ids = sorted(candidates, key=lambda article_id: (candidates[article_id], article_id), reverse=True)
+        has_next = len(ordered_ids) > per_page
+        ordered_ids = ordered_ids[:per_page]
+        articles = Article.objects.all().in_bulk(ordered_ids)
+        stale = [article_id for article_id in ordered_ids
+                 if article_id not in articles or articles[article_id].author_id not in followed_ids]
+        if not stale:
+            break
+        redis.zrem(key, *stale)
+        for article_id in stale:
+            celebrity_candidates.pop(article_id, None)
+
+    rows = [articles[article_id] for article_id in ordered_ids]
+    next_cursor = None
+    if has_next and ordered_ids:
+        next_cursor = paginator.encode_cursor(candidates[ordered_ids[-1]], ordered_ids[-1])
+    return CursorPage(rows, paginator, next_cursor=next_cursor, querydict=querydict)
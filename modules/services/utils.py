@@ -1,22 +1,109 @@
 import os
+import re
+import redis
+from functools import lru_cache, reduce
+from operator import or_
 from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from blog_test import settings
 from urllib.parse import urljoin
 from datetime import datetime
-from uuid import uuid4
 from pytils.translit import slugify
-from PIL import Image, ImageOps
+
+SLUG_SUFFIX_PATTERN = re.compile(r'-[0-9]+$')
+# запас длины под суффикс вида -123456
+SLUG_SUFFIX_RESERVE = 8
+SLUG_SAVE_ATTEMPTS = 5
+
+
+def _slug_base(model, value):
+    """
+    Основа slug: транслитерация, обрезка с запасом под числовой суффикс
+    """
+    max_length = model._meta.get_field('slug').max_length
+    return (slugify(value) or model._meta.model_name)[:max_length - SLUG_SUFFIX_RESERVE].strip('-')
+
+
+def _slug_pattern(bases):
+    return rf'^({"|".join(re.escape(base) for base in bases)})(-[0-9]+)?$'
+
+
+def _allocate_slug(base, taken):
+    """
+    Свободный slug среди занятых: основа или основа-N, где N на единицу больше максимального суффикса
+    """
+    if base not in taken:
+        return base
+    suffixes = [int(slug[len(base) + 1:]) for slug in taken if slug.startswith(f'{base}-')]
+    return f'{base}-{max(suffixes, default=1) + 1}'
 
 
 def unique_slugify(instance, slug):
     """
-    Генератор уникальных SLUG для моделей, в случае существования такого SLUG.
+    Генератор уникальных SLUG для моделей: одним запросом выбираются занятые slug вида основа / основа-N,
+    при совпадении добавляется следующий числовой суффикс.
     """
     model = instance.__class__
-    unique_slug = slugify(slug)
-    while model.objects.filter(slug=unique_slug).exists():
-        unique_slug = f'{unique_slug}-{uuid4().hex[:8]}'
-    return unique_slug
+    base = _slug_base(model, slug)
+    taken = set(
+        model.objects.filter(slug__startswith=base, slug__regex=_slug_pattern([base]))
+        .exclude(pk=instance.pk).values_list('slug', flat=True)
+    )
+    return _allocate_slug(base, taken)
+
+
+def save_with_unique_slug(instance, value, save, *args, **kwargs):
+    """
+    Сохранение объекта с подбором slug по value. Если параллельное сохранение заняло тот же slug
+    (IntegrityError уникального индекса), slug подбирается заново
+    """
+    for attempt in range(SLUG_SAVE_ATTEMPTS):
+        instance.slug = unique_slugify(instance, value)
+        try:
+            with transaction.atomic():
+                return save(*args, **kwargs)
+        except IntegrityError as error:
+            if attempt == SLUG_SAVE_ATTEMPTS - 1 or 'slug' not in str(error):
+                raise
+
+
+def bulk_unique_slugify(objects, get_value):
+    """
+    Уникальные slug для пачки новых объектов одной модели (импорт перед bulk_create): один запрос на все основы
+    (условия startswith по каждой основе используют индекс slug, созданный Django для LIKE),
+    подбор суффиксов в памяти с учетом совпадений внутри пачки
+    """
+    objects = [obj for obj in objects if not obj.slug]
+    if not objects:
+        return objects
+    model = objects[0].__class__
+    bases = [_slug_base(model, get_value(obj)) for obj in objects]
+    prefixes = reduce(or_, (Q(slug__startswith=base) for base in set(bases)))
+    used = set(model.objects.filter(prefixes, slug__regex=_slug_pattern(set(bases))).values_list('slug', flat=True))
+    # максимальный занятый суффикс для каждой основы
+    suffixes = {}
+    for slug in used:
+        match = SLUG_SUFFIX_PATTERN.search(slug)
+        if match:
+            base = slug[:match.start()]
+            suffixes[base] = max(suffixes.get(base, 1), int(match.group()[1:]))
+    for obj, base in zip(objects, bases):
+        slug = base
+        while slug in used:
+            suffixes[base] = suffixes.get(base, 1) + 1
+            slug = f'{base}-{suffixes[base]}'
+        obj.slug = slug
+        used.add(slug)
+    return objects
+
+
+@lru_cache(maxsize=None)
+def get_redis_connection():
+    """
+    Подключение к Redis для работы со структурами данных (множества, списки, счетчики)
+    """
+    return redis.Redis.from_url(settings.REDIS_LOCATION, decode_responses=True)
 
 
 def get_client_ip(request):
@@ -45,17 +132,3 @@ class CkeditorCustomStorage(FileSystemStorage):
 
     location = os.path.join(settings.MEDIA_ROOT, 'uploads/')
     base_url = urljoin(settings.MEDIA_URL, 'uploads/')
-
-
-def image_compress(image_path, height, width):
-    """
-    Оптимизация изображений
-    """
-    img = Image.open(image_path)
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
-    if img.height > height or img.width > width:
-        output_size = (height, width)
-        img.thumbnail(output_size)
-    img = ImageOps.exif_transpose(img)
-    img.save(image_path, format='JPEG', quality=90, optimize=True)
\ No newline at end of file
@@ -0,0 +1,300 @@
+import time
+from datetime import timedelta
+from itertools import groupby, islice
+from operator import itemgetter
+from django.conf import settings
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+from redis.exceptions import ResponseError
+
+from .page_cache import bump_list_version
+from .utils import get_redis_connection
+from ..blog.models import Article, DailyViewCount, ViewCount
+
+VIEW_BUFFER_KEY = 'blog:views:buffer'
+VIEW_BUFFER_PROCESSING_KEY = 'blog:views:buffer:processing'
+VIEW_BUFFER_LOCK_KEY = 'blog:views:buffer:lock'
+VIEW_STATS_KEY = 'blog:views:stats'
+VIEW_HLL_DAY_KEY = 'blog:views:hll:{article_id}:{day}'
+VIEW_HLL_TOTAL_KEY = 'blog:views:hll:{article_id}:total'
+VIEW_HLL_DIRTY_KEY = 'blog:views:hll:dirty'
+VIEW_HLL_BASELINE_KEY = 'blog:views:hll:baseline'
+VIEW_HLL_SEEDED_KEY = 'blog:views:hll:seeded'
+POPULAR_HOUR_KEY = 'blog:popular:hour:{hour}'
+POPULAR_WINDOW_KEY = 'blog:popular:window:{hours}:{decay}:{hour}'
+POPULAR_WINDOW_TTL = 60
+
+
+def record_view(article, ip_address):
+    """
+    Фиксация просмотра статьи в зависимости от режима VIEW_COUNT_MODE:
+    sync - запись в БД во время запроса, buffered - запись пары (статья, IP) в буфер Redis,
+    hll - приблизительный подсчет уникальных посетителей в HyperLogLog Redis без записи в БД
+    """
+    if settings.VIEW_COUNT_MODE == 'buffered':
+        get_redis_connection().sadd(VIEW_BUFFER_KEY, f'{article.id}:{ip_address}')
+    elif settings.VIEW_COUNT_MODE == 'hll':
+        day_key = _hll_day_key(article.id, timezone.localdate())
+        pipe = get_redis_connection().pipeline(transaction=False)
+        pipe.pfadd(day_key, ip_address)
+        pipe.expire(day_key, settings.VIEW_HLL_DAY_TTL)
+        pipe.pfadd(VIEW_HLL_TOTAL_KEY.format(article_id=article.id), ip_address)
+        pipe.sadd(VIEW_HLL_DIRTY_KEY, article.id)
+        _, _, is_new_visitor, _ = pipe.execute()
+        # PFADD возвращает 1, если оценка изменилась - это (приблизительно) новый посетитель
+        if is_new_visitor:
+            record_popularity({article.id: 1})
+    else:
+        # тот же INSERT ... ON CONFLICT, что и при сбросе буфера: уникальность (статья, IP) одинакова в обоих
+        # режимах - по всей таблице или, после partition_views, в пределах месячной секции
+        _insert_views([(article.pk, ip_address)])
+
+
+def _insert_views(rows):
+    """
+    Один запрос на пачку просмотров: INSERT ... ON CONFLICT DO NOTHING и увеличение
+    счетчика view_count статей на число реально добавленных строк (они же попадают в счетчики популярности).
+    Просмотры удаленных статей отбрасываются через JOIN
+    """
+    values = ', '.join(['(%s::bigint, %s::inet)'] * len(rows))
+    params = [value for row in rows for value in row]
+    articles_table = Article._meta.db_table
+    sql = f"""
+        WITH inserted AS (
+            INSERT INTO {ViewCount._meta.db_table} (article_id, ip_address, viewed_on)
+            SELECT buffer.article_id, buffer.ip_address, %s
+            FROM (VALUES {values}) AS buffer (article_id, ip_address)
+            JOIN {articles_table} article ON article.id = buffer.article_id
+            ON CONFLICT DO NOTHING
+            RETURNING article_id
+        ), counts AS (
+            SELECT article_id, COUNT(*) AS total FROM inserted GROUP BY article_id
+        )
+        UPDATE {articles_table} article SET view_count = article.view_count + counts.total
+        FROM counts WHERE article.id = counts.article_id
+        RETURNING article.id, counts.total
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [timezone.now(), *params])
+        counts = dict(cursor.fetchall())
+    if counts:
+        bump_list_version()
+    record_popularity(counts)
+    return sum(counts.values())
+
+
+def flush_view_buffer():
+    """
+    Сброс буфера просмотров из Redis в базу данных.
+    Буфер переименовывается в ключ обработки, поэтому новые просмотры продолжают
+    копиться в новом буфере, а необработанные после сбоя записи подхватываются следующим запуском
+    """
+    redis = get_redis_connection()
+    lock = redis.lock(VIEW_BUFFER_LOCK_KEY, timeout=settings.CELERY_TASK_TIME_LIMIT, blocking=False)
+    if not lock.acquire():
+        return get_view_buffer_stats()
+
+    try:
+        started = time.monotonic()
+        if not redis.exists(VIEW_BUFFER_PROCESSING_KEY):
+            try:
+                redis.rename(VIEW_BUFFER_KEY, VIEW_BUFFER_PROCESSING_KEY)
+            except ResponseError:
+                # буфер пуст - сбрасывать нечего
+                return get_view_buffer_stats()
+
+        batch_size = settings.VIEW_COUNT_FLUSH_BATCH
+        rows_total = inserted_total = 0
+        batch = []
+        for member in redis.sscan_iter(VIEW_BUFFER_PROCESSING_KEY, count=batch_size):
+            article_id, ip_address = member.split(':', 1)
+            batch.append((article_id, ip_address))
+            if len(batch) >= batch_size:
+                inserted_total += _insert_views(batch)
+                rows_total += len(batch)
+                batch = []
+        if batch:
+            inserted_total += _insert_views(batch)
+            rows_total += len(batch)
+        redis.delete(VIEW_BUFFER_PROCESSING_KEY)
+
+        duration_ms = round((time.monotonic() - started) * 1000, 2)
+        pipe = redis.pipeline()
+        pipe.hset(VIEW_STATS_KEY, mapping={
+            'last_flush_at': timezone.now().isoformat(),
+            'last_flush_duration_ms': duration_ms,
+            'last_flush_rows': rows_total,
+            'last_flush_inserted': inserted_total,
+        })
+        pipe.hincrby(VIEW_STATS_KEY, 'flushes_total', 1)
+        pipe.hincrby(VIEW_STATS_KEY, 'rows_total', rows_total)
+        pipe.hincrbyfloat(VIEW_STATS_KEY, 'flush_duration_ms_total', duration_ms)
+        pipe.execute()
+    finally:
+        lock.release()
+    return get_view_buffer_stats()
+
+
+def get_view_buffer_stats():
+    """
+    Метрики буфера просмотров: текущая глубина буфера и статистика сбросов
+    """
+    redis = get_redis_connection()
+    pipe = redis.pipeline()
+    pipe.scard(VIEW_BUFFER_KEY)
+    pipe.scard(VIEW_BUFFER_PROCESSING_KEY)
+    pipe.hgetall(VIEW_STATS_KEY)
+    buffer_depth, processing_depth, stats = pipe.execute()
+    return {'buffer_depth': buffer_depth, 'processing_depth': processing_depth, **stats}
+
+
+def _hll_day_key(article_id, day):
+    return VIEW_HLL_DAY_KEY.format(article_id=article_id, day=day.strftime('%Y%m%d'))
+
+
+def get_unique_visitors(article_id):
+    """
+    Приблизительное количество уникальных посетителей статьи (HyperLogLog, погрешность ~0.81%):
+    за сегодня, за 7 и 30 дней (PFCOUNT по нескольким дневным ключам объединяет их на лету) и за все время
+    """
+    today = timezone.localdate()
+    day_keys = [_hll_day_key(article_id, today - timedelta(days=days)) for days in range(30)]
+    pipe = get_redis_connection().pipeline(transaction=False)
+    pipe.pfcount(day_keys[0])
+    pipe.pfcount(*day_keys[:7])
+    pipe.pfcount(*day_keys)
+    pipe.pfcount(VIEW_HLL_TOTAL_KEY.format(article_id=article_id))
+    pipe.hget(VIEW_HLL_BASELINE_KEY, article_id)
+    today_total, week_total, month_total, total, baseline = pipe.execute()
+    return {'today': today_total, 'week': week_total, 'month': month_total, 'total': total + int(baseline or 0)}
+
+
+def _queue_hll_total(pipe, article_id):
+    pipe.pfcount(VIEW_HLL_TOTAL_KEY.format(article_id=article_id))
+    pipe.hget(VIEW_HLL_BASELINE_KEY, article_id)
+
+
+def _hll_totals(results):
+    # пары (PFCOUNT, базовое значение) в порядке _queue_hll_total
+    return [total + int(baseline or 0) for total, baseline in zip(results[::2], results[1::2])]
+
+
+def get_hll_view_count(article_id):
+    """
+    Приблизительное количество уникальных посетителей статьи за все время
+    (вместе с просмотрами, учтенными в БД до перехода в режим 'hll', см. seed_hll_view_counts)
+    """
+    pipe = get_redis_connection().pipeline(transaction=False)
+    _queue_hll_total(pipe, article_id)
+    return _hll_totals(pipe.execute())[0]
+
+
+def seed_hll_view_counts():
+    """
+    Перенос просмотров из БД при переходе в режим 'hll', чтобы счетчики не начинались с нуля:
+    IP-адреса сырых просмотров добавляются в HyperLogLog статьи (повторный визит не засчитывается),
+    свернутые дневные агрегаты (без адресов) - в базовое значение, прибавляемое к PFCOUNT.
+    Выполняется один раз (ключ VIEW_HLL_SEEDED_KEY) при первом запуске sync_hll_view_counts
+    """
+    redis = get_redis_connection()
+    batch_size = settings.VIEW_COUNT_FLUSH_BATCH
+    article_ids = set()
+    views = ViewCount.objects.order_by('article_id').values_list('article_id', 'ip_address') \
+        .iterator(chunk_size=batch_size)
+    for article_id, rows in groupby(views, key=itemgetter(0)):
+        key = VIEW_HLL_TOTAL_KEY.format(article_id=article_id)
+        while True:
+            ip_addresses = [ip_address for _, ip_address in islice(rows, batch_size)]
+            if not ip_addresses:
+                break
+            redis.pfadd(key, *ip_addresses)
+        article_ids.add(article_id)
+
+    baseline = dict(DailyViewCount.objects.order_by().values('article_id').annotate(total=Sum('views'))
+                    .values_list('article_id', 'total'))
+    if baseline:
+        redis.hset(VIEW_HLL_BASELINE_KEY, mapping=baseline)
+    article_ids.update(baseline)
+    if article_ids:
+        redis.sadd(VIEW_HLL_DIRTY_KEY, *article_ids)
+    redis.set(VIEW_HLL_SEEDED_KEY, timezone.now().isoformat())
+    return len(article_ids)
+
+
+def sync_hll_view_counts():
+    """
+    Перенос оценок HyperLogLog в хранимый счетчик view_count статей, просмотренных с прошлого запуска
+    """
+    redis = get_redis_connection()
+    if not redis.exists(VIEW_HLL_SEEDED_KEY):
+        seed_hll_view_counts()
+    batch_size = settings.VIEW_COUNT_FLUSH_BATCH
+    updated = 0
+    while True:
+        article_ids = [int(article_id) for article_id in redis.spop(VIEW_HLL_DIRTY_KEY, batch_size)]
+        if not article_ids:
+            return updated
+        pipe = redis.pipeline(transaction=False)
+        for article_id in article_ids:
+            _queue_hll_total(pipe, article_id)
+        articles = [Article(id=article_id, view_count=total)
+                    for article_id, total in zip(article_ids, _hll_totals(pipe.execute()))]
+        updated += Article.objects.bulk_update(articles, ['view_count'])
+        bump_list_version()
+
+
+def _current_hour():
+    return int(time.time() // 3600)
+
+
+def record_popularity(counts):
+    """
+    Счетчики популярности: новые просмотры статей добавляются в сортированное множество текущего часа
+    """
+    if not counts:
+        return
+    key = POPULAR_HOUR_KEY.format(hour=_current_hour())
+    pipe = get_redis_connection().pipeline(transaction=False)
+    for article_id, total in counts.items():
+        pipe.zincrby(key, total, article_id)
+    pipe.expire(key, (settings.POPULAR_ARTICLES_WINDOW_DAYS + 1) * 24 * 3600)
+    pipe.execute()
+
+
+def _popular_window_key(hours, decay):
+    """
+    Ключ объединения часовых множеств за последние hours часов (ZUNIONSTORE с весами decay ** возраст).
+    Объединение кешируется в Redis на минуту
+    """
+    redis = get_redis_connection()
+    hour = _current_hour()
+    window_key = POPULAR_WINDOW_KEY.format(hours=hours, decay=decay, hour=hour)
+    if not redis.exists(window_key):
+        weights = {POPULAR_HOUR_KEY.format(hour=hour - age): decay ** age for age in range(hours)}
+        pipe = redis.pipeline()
+        pipe.zunionstore(window_key, weights)
+        pipe.expire(window_key, POPULAR_WINDOW_TTL)
+        pipe.execute()
+    return window_key
+
+
+def get_popular_scores(hours, limit, decay=1.0):
+    """
+    Топ статей за последние hours часов: [(id статьи, просмотры), ...].
+    decay - множитель веса за каждый час давности (1.0 - без затухания)
+    """
+    window_key = _popular_window_key(hours, decay)
+    return [(int(article_id), score)
+            for article_id, score in get_redis_connection().zrevrange(window_key, 0, limit - 1, withscores=True)]
+
+
+def get_popular_scores_for(hours, article_ids, decay=1.0):
+    """
+    Просмотры заданных статей за последние hours часов: {id статьи: просмотры}
+    """
+    window_key = _popular_window_key(hours, decay)
+    pipe = get_redis_connection().pipeline(transaction=False)
+    for article_id in article_ids:
+        pipe.zscore(window_key, article_id)
+    return {article_id: score or 0 for article_id, score in zip(article_ids, pipe.execute())}
@@ -0,0 +1,208 @@
+import re
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ..blog.models import Article, DailyViewCount, ViewCount
+
+PARTITION_NAME_RE = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def _view_table():
+    return ViewCount._meta.db_table
+
+
+def _month_start(value, months=0):
+    month_index = value.year * 12 + value.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _partition_name(month):
+    return f'{_view_table()}_p{month.year}{month.month:02d}'
+
+
+def _partition_bound(month):
+    return datetime.combine(month, time.min, tzinfo=dt_timezone.utc)
+
+
+def is_view_table_partitioned():
+    """
+    Проверка: таблица просмотров уже разбита на секции (relkind = 'p')
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE relname = %s', [_view_table()])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def get_view_partitions():
+    """
+    Месячные секции таблицы просмотров: {начало месяца: имя секции}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+        """, [_view_table()])
+        names = [name for name, in cursor.fetchall()]
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME_RE.search(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def _create_partition(cursor, month):
+    """
+    Секция за месяц. Уникальность (статья, IP) обеспечивается индексом внутри секции:
+    уникальный индекс секционированной таблицы обязан включать ключ секционирования
+    """
+    name = _partition_name(month)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {name} PARTITION OF {_view_table()}
+        FOR VALUES FROM ('{_partition_bound(month).isoformat()}')
+        TO ('{_partition_bound(_month_start(month, 1)).isoformat()}')
+    """)
+    cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {name}_article_ip ON {name} (article_id, ip_address)')
+    return name
+
+
+def ensure_view_partitions(months_ahead=None):
+    """
+    Создание секций на текущий и следующие months_ahead месяцев
+    """
+    if not is_view_table_partitioned():
+        return []
+    months_ahead = settings.VIEW_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+    current = _month_start(timezone.now())
+    existing = get_view_partitions()
+    created = []
+    with connection.cursor() as cursor:
+        for offset in range(months_ahead + 1):
+            month = _month_start(current, offset)
+            if month not in existing:
+                created.append(_create_partition(cursor, month))
+    return created
+
+
+def partition_view_table(months_ahead=None):
+    """
+    Перевод таблицы просмотров на секционирование по месяцам (PARTITION BY RANGE (viewed_on)).
+    Старая таблица переименовывается, данные переносятся в новую секционированную таблицу с тем же именем.
+    Уникальность (статья, IP) после перевода проверяется в пределах месячной секции (индексы секций) во всех
+    режимах VIEW_COUNT_MODE: повторный просмотр в следующем месяце записывается и увеличивает счетчик.
+    Ограничение unique_article_ip_view из ViewCount.Meta сохраняет имя (с ключом секционирования viewed_on),
+    чтобы последующие миграции модели находили его в БД
+    """
+    table = _view_table()
+    legacy = f'{table}_legacy'
+    sequence = f'{table}_partitioned_id_seq'
+    months_ahead = settings.VIEW_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # отложенные проверки внешних ключей не дают удалить старую таблицу в той же транзакции:
+        # они выполняются сразу, затем внешние ключи Django снова откладываются до конца транзакции
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+        cursor.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+        if is_view_table_partitioned():
+            return False
+        cursor.execute(f'SELECT MIN(viewed_on) FROM {table}')
+        oldest = cursor.fetchone()[0] or timezone.now()
+
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {legacy}')
+        cursor.execute(f'CREATE SEQUENCE {sequence}')
+        cursor.execute(f"""
+            CREATE TABLE {table} (
+                id bigint NOT NULL DEFAULT nextval('{sequence}'),
+                article_id bigint NOT NULL
+                    REFERENCES {Article._meta.db_table} (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+                ip_address inet NOT NULL,
+                viewed_on timestamp with time zone NOT NULL,
+                PRIMARY KEY (id, viewed_on)
+            ) PARTITION BY RANGE (viewed_on)
+        """)
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+        cursor.execute(f'CREATE INDEX {table}_viewed_on_idx ON {table} (viewed_on DESC)')
+        cursor.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+        cursor.execute(f'CREATE UNIQUE INDEX {table}_default_article_ip ON {table}_default (article_id, ip_address)')
+
+        month = _month_start(oldest)
+        last_month = _month_start(timezone.now(), months_ahead)
+        while month <= last_month:
+            _create_partition(cursor, month)
+            month = _month_start(month, 1)
+
+        cursor.execute(f"""
+            INSERT INTO {table} (id, article_id, ip_address, viewed_on)
+            SELECT id, article_id, ip_address, viewed_on FROM {legacy}
+        """)
+        cursor.execute(f"SELECT setval('{sequence}', COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)")
+        cursor.execute(f'DROP TABLE {legacy}')
+        constraint = ViewCount._meta.constraints[0].name
+        cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {constraint} UNIQUE (article_id, ip_address, viewed_on)')
+    return True
+
+
+def _rollup_sql(source_sql):
+    """
+    Свертка просмотров из source_sql в дневные агрегаты, возвращает количество свернутых просмотров
+    """
+    daily_table = DailyViewCount._meta.db_table
+    return f"""
+        WITH source AS (
+            {source_sql}
+        ), days AS (
+            SELECT article_id, (viewed_on AT TIME ZONE %(tz)s)::date AS date, COUNT(*) AS total
+            FROM source GROUP BY 1, 2
+        ), rolled AS (
+            INSERT INTO {daily_table} (article_id, date, views)
+            SELECT article_id, date, total FROM days
+            ON CONFLICT (article_id, date) DO UPDATE SET views = {daily_table}.views + EXCLUDED.views
+        )
+        SELECT COALESCE(SUM(total), 0) FROM days
+    """
+
+
+def rollup_views(retention_days=None):
+    """
+    Свертка сырых просмотров старше retention_days дней в дневные агрегаты DailyViewCount.
+    Секции, целиком вышедшие за окно хранения, сворачиваются и удаляются через DROP TABLE,
+    остальные записи удаляются пачками по VIEW_ROLLUP_BATCH.
+    Счетчик view_count статей не меняется: просмотры переходят из одной таблицы в другую
+    """
+    retention_days = settings.VIEW_RETENTION_DAYS if retention_days is None else retention_days
+    cutoff = timezone.make_aware(datetime.combine(timezone.localdate() - timedelta(days=retention_days), time.min))
+    params = {'cutoff': cutoff, 'tz': settings.TIME_ZONE, 'batch': settings.VIEW_ROLLUP_BATCH}
+    table = _view_table()
+    rolled_up = 0
+    dropped = []
+
+    if is_view_table_partitioned():
+        for month, name in sorted(get_view_partitions().items()):
+            if _partition_bound(_month_start(month, 1)) > cutoff:
+                continue
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(_rollup_sql(f'SELECT article_id, viewed_on FROM {name}'), params)
+                rolled_up += cursor.fetchone()[0]
+                cursor.execute(f'DROP TABLE {name}')
+            dropped.append(name)
+
+    sql = _rollup_sql(f"""
+        DELETE FROM {table}
+        WHERE viewed_on < %(cutoff)s
+            AND id IN (SELECT id FROM {table} WHERE viewed_on < %(cutoff)s LIMIT %(batch)s)
+        RETURNING article_id, viewed_on
+    """)
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rolled = cursor.fetchone()[0]
+        rolled_up += rolled
+        if rolled < settings.VIEW_ROLLUP_BATCH:
+            break
+    return {'rolled_up': rolled_up, 'dropped_partitions': dropped}
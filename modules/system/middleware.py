@@ -1,20 +1,72 @@
-from django.contrib.auth.models import  User
-from django.core.cache import cache
-from django.utils import timezone
+from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
 
+from ..blog.models import Article
+from ..services.presence import touch_presence
+from ..services.page_cache import cache_page, get_cached_page
+from ..services.utils import get_client_ip
+from ..services.view_counter import record_view
+
 
 class ActiveUserMiddleware(MiddlewareMixin):
     """
-    Middleware слой для обновления статуса "онлайн"
+    Middleware слой для обновления статуса "онлайн": активность записывается в множество присутствия Redis
+    (не чаще раза в минуту), last_login переносится в БД периодической задачей flush_presence_task
     """
 
     def process_request(self, request):
         if request.user.is_authenticated and request.session.session_key:
-            cache_key = f'last-seen-{request.user.id}'
-            last_login = cache.get(cache_key)
+            touch_presence(request.user.id)
+
+
+class PageCacheMiddleware(MiddlewareMixin):
+    """
+    Middleware слой кеша страниц для анонимных посетителей.
+    Кешируются только ответы, помеченные ключами сброса (см. SurrogateKeyMixin);
+    при попадании в кеш представление не вызывается. Заголовок X-Cache: HIT / MISS.
+    Время хранения - PAGE_CACHE_TIMEOUT или response.cache_timeout (RSS-ленты)
+    """
+
+    def is_cacheable_request(self, request):
+        return (
+            settings.PAGE_CACHE_TIMEOUT
+            and request.method in ('GET', 'HEAD')
+            and not request.user.is_authenticated
+            and not len(getattr(request, '_messages', ()))
+        )
+
+    def process_request(self, request):
+        request.page_cacheable = self.is_cacheable_request(request)
+        if not request.page_cacheable:
+            return None
+        cached = get_cached_page(request)
+        if cached is None:
+            return None
+        # process_response вызывается и для ответа из кеша: повторно он не сохраняется
+        request.page_cacheable = False
+        if cached['view_article_id']:
+            record_view(Article(pk=cached['view_article_id']), get_client_ip(request))
+        response = cached['response']
+        response['X-Cache'] = 'HIT'
+        return response
+
+    def is_cacheable_response(self, request, response):
+        # страницы с CSRF-токеном, cookie или сообщениями индивидуальны для посетителя
+        return (
+            getattr(request, 'page_cacheable', False)
+            and request.method == 'GET'
+            and getattr(response, 'surrogate_keys', None)
+            and response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+            and not len(getattr(request, '_messages', ()))
+        )
 
-            if not last_login:
-                User.objects.filter(id=request.user.id).update(last_login=timezone.now())
-                # Устанавливаем кэширование на 300 секунд с текущей датой по ключу last-seen-id-пользователя
-                cache.set(cache_key, timezone.now(), 300)
\ No newline at end of file
+    def process_response(self, request, response):
+        if not self.is_cacheable_response(request, response):
+            return response
+        response['X-Cache'] = 'MISS'
+        cache_page(request, response, response.surrogate_keys, getattr(response, 'view_article_id', None),
+                   timeout=getattr(response, 'cache_timeout', None))
+        return response
@@ -4,10 +4,10 @@ from django.core.validators import FileExtensionValidator
 from django.urls import reverse
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.utils import timezone
-from django.core.cache import cache
 
-from ..services.utils import unique_slugify
+from ..services.avatars import get_avatar_url, normalize_avatar
+from ..services.presence import get_online_user_ids
+from ..services.utils import save_with_unique_slug
 
 
 class Profile(models.Model):
@@ -33,13 +33,22 @@ class Profile(models.Model):
         verbose_name = 'Профиль'
         verbose_name_plural = 'Профили'
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__avatar = self.__dict__.get('avatar', models.DEFERRED) if self.pk else None
+
     def save(self, *args, **kwargs):
         """
-        Сохранение полей модели при их отсутствии заполнения
+        Сохранение полей модели при их отсутствии заполнения.
+        Загруженный аватар заменяется сжатыми квадратными копиями размеров AVATAR_SIZES
         """
-        if not self.slug:
-            self.slug = unique_slugify(self, self.user.username)
-        super().save(*args, **kwargs)
+        if self.__avatar is not models.DEFERRED and self.avatar and self.avatar != self.__avatar:
+            self.avatar = normalize_avatar(self.avatar)
+        if self.slug:
+            super().save(*args, **kwargs)
+        else:
+            save_with_unique_slug(self, self.user.username, super().save, *args, **kwargs)
+        self.__avatar = self.__dict__.get('avatar', models.DEFERRED)
 
     def __str__(self):
         """
@@ -54,16 +63,19 @@ class Profile(models.Model):
         return reverse('profile_detail', kwargs={'slug': self.slug})
 
     def is_online(self):
-        last_seen = cache.get(f'last-seen-{self.user.id}')
-        if last_seen is not None and timezone.now() < last_seen + timezone.timedelta(seconds=300):
-            return True
-        return False
+        """
+        Статус "онлайн" (для списков профилей статус заранее выставляет set_online_status одним запросом)
+        """
+        if 'online' not in self.__dict__:
+            self.online = self.user_id in get_online_user_ids([self.user_id])
+        return self.online
 
     @property
     def get_avatar(self):
-        if self.avatar:
-            return self.avatar.url
-        return f'https://ui-avatars.com/api/?size=190&background=random&name={self.slug}'
+        return get_avatar_url(self)
+
+    def get_avatar_url(self, size=None):
+        return get_avatar_url(self, size)
 
 
 @receiver(post_save, sender=User)
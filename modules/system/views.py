@@ -14,6 +14,7 @@ from django.contrib.auth.views import LoginView, LogoutView, PasswordChangeView,
 from .models import Profile, Feedback
 from ..services.mixins import UserIsNotAuthenticatedMixin
 from ..services.utils import get_client_ip
+from ..services.presence import set_online_status
 from ..services.tasks import send_activate_email_message_task, send_contact_email_message_task
 from .forms import ProfileUpdateForm, UserUpdateForm, UserLoginFrom, UserRegisterForm, UserPasswordChangeForm, \
     UserForgotPasswordForm, UserSetNewPasswordForm, FeedbackCreateForm
@@ -34,6 +35,10 @@ class ProfileDetailView(DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['title'] = f'Страница пользователя: {self.object.user.username}'
+        # статус "онлайн" владельца страницы, подписок и подписчиков одним запросом к Redis
+        context['following'] = list(self.object.following.all())
+        context['followers'] = list(self.object.followers.all())
+        set_online_status([self.object, *context['following'], *context['followers']])
         return context
 
 
@@ -283,7 +288,7 @@ class ProfileFollowingCreateView(LoginRequiredMixin, View):
             'username': profile.user.username,
             'get_absolute_url': profile.get_absolute_url(),
             'slug': profile.slug,
-            'avatar': profile.get_avatar,
+            'avatar': profile.get_avatar_url(60),
             'message': message,
             'status': status
         }
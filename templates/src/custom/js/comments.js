@@ -1,12 +1,14 @@
-const commentForm = document.forms.commentForm;
-const commentFormContent = commentForm.content;
-const commentFormParentInput = commentForm.parent;
-const commentFormSubmit = commentForm.commentSubmit;
-const commentArticleId = commentForm.getAttribute('data-article-id');
-
-commentForm.addEventListener('submit', createComment);
+const commentsMore = document.querySelector('#commentsMore');
+if (commentsMore) {
+  commentsMore.addEventListener('click', loadMoreComments);
+}
 
-replyUser()
+// форма комментария выводится только авторизованным пользователям
+const commentForm = document.forms.commentForm;
+if (commentForm) {
+  commentForm.addEventListener('submit', createComment);
+  replyUser();
+}
 
 function replyUser() {
   document.querySelectorAll('.btn-reply').forEach(e => {
@@ -15,13 +17,42 @@ function replyUser() {
 }
 
 function replyComment() {
+  const commentFormContent = commentForm.content;
+  const commentFormParentInput = commentForm.parent;
   const commentUsername = this.getAttribute('data-comment-username');
   const commentMessageId = this.getAttribute('data-comment-id');
   commentFormContent.value = `${commentUsername}, `;
   commentFormParentInput.value = commentMessageId;
 }
+async function loadMoreComments() {
+    commentsMore.disabled = true;
+    try {
+        const response = await fetch(`${commentsMore.dataset.url}?page=${commentsMore.dataset.page}`, {
+            headers: {'X-Requested-With': 'XMLHttpRequest'},
+        });
+        const page = await response.json();
+        document.querySelector('.nested-comments').insertAdjacentHTML('beforeend', page.html);
+        if (page.has_next) {
+            commentsMore.dataset.page = page.next_page;
+            commentsMore.disabled = false;
+        }
+        else {
+            commentsMore.remove();
+        }
+        if (commentForm) {
+            replyUser();
+        }
+    }
+    catch (error) {
+        console.log(error)
+    }
+}
+
 async function createComment(event) {
     event.preventDefault();
+    const commentFormSubmit = commentForm.commentSubmit;
+    const commentFormParentInput = commentForm.parent;
+    const commentArticleId = commentForm.getAttribute('data-article-id');
     commentFormSubmit.disabled = true;
     commentFormSubmit.innerText = "Ожидаем ответа сервера";
     try {
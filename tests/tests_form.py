@@ -1,4 +1,6 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from django.test import TestCase, override_settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth.models import User
 
@@ -103,6 +105,12 @@ class BlogFormsTestCase(TestCase):
     """
 
     def setUp(self):
+        # файлы (превью, аватары) сохраняются во временный MEDIA_ROOT, а не в media проекта
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
         # Создаем пользователя для тестов
         self.user = User.objects.create_user(username='testuser', password='testpassword')
 
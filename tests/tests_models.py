@@ -1,13 +1,38 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.admin.models import ADDITION, LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Sum
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from PIL import Image
+import shutil
 import tempfile
+import time
 
-from modules.blog.models import Article, Category, Comment, Rating, ViewCount
+from modules.blog.models import Article, Category, Comment, DailyViewCount, EditorUpload, Rating, ViewCount
 from modules.system.models import Profile, Feedback
+from modules.services.backup import create_backup
+from modules.services.editor_uploads import collect_orphaned_editor_uploads
+from modules.services.images import process_article_thumbnail
+from modules.services.media_backup import create_media_snapshot, get_media_snapshots, verify_media_snapshot
+from modules.services.media_reprocess import file_digest, recompress_image, reprocess_media
+from modules.services.presence import PRESENCE_KEY, flush_presence, set_online_status, touch_presence
+from modules.services.rating import toggle_rating
+from modules.services.similar import rebuild_all_similar_articles, rebuild_similar_articles, update_similar_articles
+from modules.services.sitemap import SITEMAP_INDEX, SITEMAP_SHARD, SITEMAP_STATIC, generate_sitemaps
+from modules.services.utils import bulk_unique_slugify, get_redis_connection
+from modules.services.view_counter import record_view
+from modules.services.view_retention import partition_view_table, rollup_views
 
 User = get_user_model()
 
@@ -55,6 +80,19 @@ class BlogModelTest(TestCase):
         # Тест для метода save
         self.assertEqual(self.article.slug, 'test-article')  # Проверяем, что slug установлен корректно
 
+    def test_unique_slugify(self):
+        # Тест подбора slug: следующий числовой суффикс, в пачке - без повторного обращения к БД
+        second = Article.objects.create(title='Test Article', short_description='Short', full_description='Full',
+                                        author=self.user)
+        self.assertEqual(second.slug, 'test-article-2')
+
+        articles = [Article(title=title, short_description='Short', full_description='Full', author=self.user)
+                    for title in ('Test Article', 'Test Article', 'Новая статья')]
+        with self.assertNumQueries(1):
+            bulk_unique_slugify(articles, lambda article: article.title)
+        self.assertEqual([article.slug for article in articles], ['test-article-3', 'test-article-4', 'novaya-statya'])
+        second.delete()
+
     def test_article_str_method(self):
         # Тест для метода __str__
         expected_str = 'Test Article'
@@ -74,6 +112,16 @@ class BlogModelTest(TestCase):
         expected_str = 'testuser:Test Comment'
         self.assertEqual(str(self.comment), expected_str)
 
+    def test_comment_tree_path(self):
+        # Тест материализованного пути: новые ветки первыми, ответы внутри своей ветки
+        newer_root = Comment.objects.create(article=self.article, author=self.user, content='Newer root')
+        reply = Comment.objects.create(article=self.article, author=self.user, content='Reply', parent=self.comment)
+        nested_reply = Comment.objects.create(article=self.article, author=self.user, content='Nested reply',
+                                              parent=reply)
+        self.assertEqual(list(self.article.comments.all()), [newer_root, self.comment, reply, nested_reply])
+        self.assertEqual(nested_reply.level, 2)
+        self.assertEqual(nested_reply.get_root_id(), self.comment.id)
+
     def test_get_sum_rating(self):
         # Тест для метода get_sum_rating
         Rating.objects.create(article=self.article, user=self.user, value=1, ip_address='127.0.0.1')
@@ -86,6 +134,310 @@ class BlogModelTest(TestCase):
         ViewCount.objects.create(article=self.article, ip_address='127.0.0.2')
         self.assertEqual(self.article.get_view_count(), 2)
 
+    def test_rebuild_counters(self):
+        # Тест пересчета хранимых счетчиков просмотров и рейтинга
+        ViewCount.objects.create(article=self.article, ip_address='127.0.0.1')
+        ViewCount.objects.create(article=self.article, ip_address='127.0.0.2')
+        Rating.objects.create(article=self.article, user=self.user, value=1, ip_address='127.0.0.1')
+        Rating.objects.create(article=self.article, user=self.user, value=1, ip_address='127.0.0.2')
+        Article.objects.rebuild_counters()
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.view_count, 2)
+        self.assertEqual(self.article.rating_sum, 2)
+
+    def test_rollup_views(self):
+        # Тест свертки старых просмотров в дневные агрегаты
+        ViewCount.objects.create(article=self.article, ip_address='127.0.0.1')
+        ViewCount.objects.create(article=self.article, ip_address='127.0.0.2')
+        ViewCount.objects.create(article=self.article, ip_address='127.0.0.3')
+        old_date = timezone.now() - timedelta(days=100)
+        ViewCount.objects.exclude(ip_address='127.0.0.3').update(viewed_on=old_date)
+
+        result = rollup_views(retention_days=90)
+        self.assertEqual(result['rolled_up'], 2)
+        self.assertEqual(self.article.views.count(), 1)
+        daily = DailyViewCount.objects.get(article=self.article)
+        self.assertEqual((daily.date, daily.views), (timezone.localdate(old_date), 2))
+        self.assertEqual(self.article.get_view_count(), 3)
+
+        Article.objects.rebuild_counters()
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.view_count, 3)
+
+    def test_partitioned_view_uniqueness(self):
+        # Тест секционирования просмотров: имя ограничения сохраняется, уникальность (статья, IP) - в пределах месяца
+        record_view(self.article, '127.0.0.1')
+        self.assertTrue(partition_view_table())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM pg_constraint WHERE conname = %s', ['unique_article_ip_view'])
+            self.assertIsNotNone(cursor.fetchone())
+
+        record_view(self.article, '127.0.0.1')
+        self.assertEqual(self.article.views.count(), 1)
+        self.article.views.update(viewed_on=timezone.now() - timedelta(days=40))
+        record_view(self.article, '127.0.0.1')
+        record_view(self.article, '127.0.0.1')
+        self.assertEqual(self.article.views.count(), 2)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.view_count, 2)
+
+    def test_generate_sitemaps(self):
+        # Тест карты сайта: индекс, количество ссылок и lastmod шардов, перезапись только измененных шардов
+        articles = [self.article] + [
+            Article.objects.create(title=f'Sitemap Article {number}', short_description='Short',
+                                   full_description='Full', author=self.user)
+            for number in range(4)
+        ]
+        Article.objects.create(title='Draft Article', short_description='Short', full_description='Full',
+                               author=self.user, status='draft')
+        shards = {}
+        for article in Article.objects.filter(pk__in=[article.pk for article in articles]):
+            shards.setdefault(article.id // 2, []).append(article)
+
+        with tempfile.TemporaryDirectory() as sitemap_root, \
+                override_settings(SITEMAP_ROOT=sitemap_root, SITEMAP_SHARD_SIZE=2):
+            result = generate_sitemaps()
+            self.assertEqual(result, {'shards': len(shards), 'regenerated': len(shards), 'removed': 0})
+            index = Path(sitemap_root, SITEMAP_INDEX).read_text()
+            self.assertIn(SITEMAP_STATIC, index)
+            for shard, shard_articles in shards.items():
+                name = SITEMAP_SHARD.format(shard=shard)
+                lastmod = max(article.time_update for article in shard_articles).date().isoformat()
+                self.assertIn(f'{name}</loc><lastmod>{lastmod}</lastmod>', index)
+                content = Path(sitemap_root, name).read_text()
+                self.assertEqual(content.count('<url>'), len(shard_articles))
+                for article in shard_articles:
+                    self.assertIn(f'{article.get_absolute_url()}</loc>', content)
+            self.assertNotIn('draft-article', index + ''.join(path.read_text() for path in
+                                                              Path(sitemap_root).glob('sitemap-articles-*')))
+
+            # Без изменений шарды не перезаписываются, измененная статья обновляет только свой шард
+            self.assertEqual(generate_sitemaps()['regenerated'], 0)
+            articles[-1].title = 'Changed title'
+            articles[-1].save()
+            self.assertEqual(generate_sitemaps(), {'shards': len(shards), 'regenerated': 1, 'removed': 0})
+
+            # Шард без опубликованных статей удаляется
+            last_shard = max(shards)
+            Article.objects.filter(pk__in=[article.pk for article in shards[last_shard]]).update(status='draft')
+            self.assertEqual(generate_sitemaps()['removed'], 1)
+            self.assertFalse(Path(sitemap_root, SITEMAP_SHARD.format(shard=last_shard)).exists())
+        Article.objects.exclude(pk=self.article.pk).delete()
+
+    def test_rebuild_similar_articles(self):
+        # Тест индекса похожих статей: сортировка по количеству общих тегов
+        close_article = Article.objects.create(title='Close Article', short_description='Short',
+                                               full_description='Full', author=self.user)
+        far_article = Article.objects.create(title='Far Article', short_description='Short',
+                                             full_description='Full', author=self.user)
+        self.article.tags.add('python', 'django')
+        close_article.tags.add('python', 'django')
+        far_article.tags.add('python')
+
+        rebuild_similar_articles(self.article.id)
+        similar = list(self.article.similar_articles.values_list('similar_id', 'score'))
+        self.assertEqual(similar, [(close_article.id, 2), (far_article.id, 1)])
+        Article.objects.filter(id__in=[close_article.id, far_article.id]).delete()
+
+    @override_settings(SIMILAR_ARTICLES_LIMIT=1)
+    def test_update_similar_articles(self):
+        # Тест инкрементального обновления: пересчитываются все статьи с общими тегами, а не только соседи
+        other = Article.objects.create(title='Other Article', short_description='Short', full_description='Full',
+                                       author=self.user)
+        changed = Article.objects.create(title='Changed Article', short_description='Short',
+                                         full_description='Full', author=self.user)
+        self.article.tags.add('python', 'django')
+        changed.tags.add('python', 'django')
+        other.tags.add('rust')
+        rebuild_all_similar_articles()
+        self.assertFalse(other.similar_articles.exists())
+
+        # статья попадает в топ other, хотя other не входит в её собственный топ
+        changed.tags.add('rust')
+        update_similar_articles(changed.id)
+        self.assertEqual(list(changed.similar_articles.values_list('similar_id', flat=True)), [self.article.id])
+        self.assertEqual(list(other.similar_articles.values_list('similar_id', flat=True)), [changed.id])
+
+        # снятие с публикации убирает статью из топов
+        changed.status = 'draft'
+        changed.save()
+        self.assertTrue(changed.status_changed)
+        update_similar_articles(changed.id)
+        self.assertFalse(other.similar_articles.exists())
+        self.assertFalse(self.article.similar_articles.filter(similar=changed).exists())
+        Article.objects.filter(id__in=[other.id, changed.id]).delete()
+
+    def test_editor_upload_references(self):
+        # Тест индекса ссылок статей на файлы редактора и поиска файлов без ссылок
+        used = EditorUpload.objects.create(name=f'cas/ab/{"ab" * 32}.png', size=10)
+        orphan = EditorUpload.objects.create(name=f'cas/cd/{"cd" * 32}.png', size=20)
+        article = Article.objects.create(title='Upload Article', short_description='Short', author=self.user,
+                                         full_description=f'<img src="/media/uploads/{used.name}">')
+        self.assertEqual(list(article.editor_uploads.all()), [used])
+
+        # Сохранение без изменения текста и режим загрузок по датам индекс не пересчитывают
+        article.title = 'Upload Article Renamed'
+        # только UPDATE статьи и поискового вектора
+        with self.assertNumQueries(2):
+            article.save()
+        article.full_description = f'<img src="/media/uploads/{orphan.name}">'
+        with override_settings(CKEDITOR_UPLOAD_MODE='dated'):
+            article.save()
+        self.assertEqual(list(article.editor_uploads.all()), [used])
+        article.full_description = f'<img src="/media/uploads/{used.name}">'
+        article.save()
+        self.assertEqual(list(article.editor_uploads.all()), [used])
+
+        EditorUpload.objects.update(time_create=timezone.now() - timedelta(days=2))
+        result = collect_orphaned_editor_uploads(grace_hours=24, dry_run=True)
+        self.assertEqual(result, {'removed': 1, 'freed': orphan.size})
+        result = collect_orphaned_editor_uploads(grace_hours=24)
+        self.assertEqual(result, {'removed': 1, 'freed': orphan.size})
+        self.assertEqual(list(EditorUpload.objects.all()), [used])
+        article.delete()
+
+    def test_process_article_thumbnail(self):
+        # Перед проверкой убедится что сервер Redis включен
+        image = BytesIO()
+        Image.new('RGB', (800, 400), 'red').save(image, format='PNG')
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            self.article.thumbnail = SimpleUploadedFile('thumb.png', image.getvalue(), content_type='image/png')
+            self.article.save()
+            original = self.article.thumbnail.read()
+            self.assertEqual(self.article.thumbnail_renditions, {})
+
+            self.assertTrue(process_article_thumbnail(self.article.id))
+            self.article.refresh_from_db()
+            renditions = self.article.thumbnail_renditions
+            # копии не шире оригинала, оригинал не изменен
+            self.assertEqual([width for width, _ in renditions['webp']], [320, 640])
+            self.assertEqual([width for width, _ in renditions['jpeg']], [320, 640])
+            self.assertTrue(renditions['placeholder'].startswith('data:image/jpeg;base64,'))
+            self.assertEqual(self.article.thumbnail.read(), original)
+
+
+class RatingConcurrencyTest(TransactionTestCase):
+    """
+    Тестирование параллельных оценок одной статьи
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.category = Category.objects.create(title='TestCategory', description='Test Description',
+                                                slug='test-category')
+        self.article = Article.objects.create(
+            title='Test Article',
+            short_description='Short description',
+            full_description='Full description',
+            status='published',
+            author=self.user,
+            category=self.category
+        )
+
+    def vote(self, ip_address, value):
+        try:
+            return toggle_rating(self.article.id, ip_address, value)
+        finally:
+            connection.close()
+
+    def test_parallel_votes(self):
+        # 50 лайков и 20 дизлайков с разных IP одновременно
+        votes = [(f'10.0.0.{i}', 1) for i in range(50)] + [(f'10.0.1.{i}', -1) for i in range(20)]
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(lambda vote: self.vote(*vote), votes))
+
+        self.assertTrue(all(status == 'created' for status, _ in results))
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.rating_sum, 30)
+        self.assertEqual(self.article.ratings.count(), 70)
+
+    def test_parallel_toggles_from_same_ip(self):
+        # Повторные оценки с одного IP переключают оценку, сумма должна совпадать с таблицей оценок
+        votes = [(f'10.0.2.{i % 5}', 1 if i % 3 else -1) for i in range(60)]
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(lambda vote: self.vote(*vote), votes))
+
+        self.article.refresh_from_db()
+        expected = self.article.ratings.aggregate(total=Sum('value'))['total'] or 0
+        self.assertEqual(self.article.rating_sum, expected)
+        self.assertLessEqual(self.article.ratings.count(), 5)
+
+
+class BackupRestoreTest(TransactionTestCase):
+    """
+    Тестирование резервного копирования и восстановления БД (полная и инкрементальная копии)
+    """
+
+    def setUp(self):
+        self.backup_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.backup_root, ignore_errors=True)
+        self.author = User.objects.create_user(username='author', password='testpassword')
+        self.reader = User.objects.create_user(username='reader', password='testpassword')
+        self.category = Category.objects.create(title='TestCategory', description='Test Description',
+                                                slug='test-category')
+        self.article = self.create_article('Backup Article')
+        self.reader.profile.following.add(self.author.profile)
+
+    def create_article(self, title):
+        return Article.objects.create(title=title, short_description='Short description',
+                                      full_description='Full description', status='published',
+                                      author=self.author, category=self.category)
+
+    def get_state(self):
+        return {
+            'users': list(User.objects.order_by('id').values_list('id', 'username')),
+            'articles': list(Article.objects.order_by('id').values_list('id', 'slug', 'title', 'time_update')),
+            'comments': list(Comment.objects.order_by('id').values_list('id', 'article_id', 'content', 'path')),
+            'following': list(Profile.following.through.objects.order_by('id')
+                              .values_list('id', 'from_profile_id', 'to_profile_id')),
+        }
+
+    def test_incremental_restore(self):
+        with override_settings(BACKUP_ROOT=self.backup_root):
+            create_backup()
+
+            # Повторная подписка (новая строка с той же парой) и статья, удаленная и созданная заново с тем же slug
+            self.reader.profile.following.remove(self.author.profile)
+            self.reader.profile.following.add(self.author.profile)
+            slug = self.article.slug
+            self.article.delete()
+            article = self.create_article('Backup Article')
+            self.assertEqual(article.slug, slug)
+            Comment.objects.create(article=article, author=self.reader, content='Restored comment')
+            LogEntry.objects.create(user=self.author, content_type=ContentType.objects.get_for_model(Article),
+                                    object_id=str(article.pk), object_repr=str(article), action_flag=ADDITION)
+            expected = self.get_state()
+            manifest = create_backup(incremental=True)
+            self.assertEqual(manifest['kind'], 'incremental')
+            self.assertEqual(manifest['models']['blog.article']['rows'], 1)
+
+            # Изменения после последней копии при восстановлении теряются
+            self.create_article('Lost Article')
+            call_command('drestore', manifest['name'], '--noinput', stdout=StringIO())
+            self.assertEqual(self.get_state(), expected)
+            # журнал админки не входит в копию, но его записи с восстановленными ссылками сохраняются
+            self.assertEqual(LogEntry.objects.count(), 1)
+
+            # Поврежденная часть обнаруживается до очистки БД
+            self.create_article('Kept Article')
+            chunk = Path(self.backup_root, manifest['name'], manifest['models']['blog.article']['chunks'][0])
+            chunk.write_bytes(chunk.read_bytes()[:-8])
+            with self.assertRaises(CommandError):
+                call_command('drestore', manifest['name'], '--noinput', stdout=StringIO())
+            self.assertTrue(Article.objects.filter(title='Kept Article').exists())
+
+    def test_incremental_backup_watermark(self):
+        with override_settings(BACKUP_ROOT=self.backup_root):
+            full = create_backup()
+            self.assertIn('watermark', full)
+            Article.objects.filter(pk=self.article.pk).update(time_update=timezone.now() - timedelta(hours=1))
+            # строка сохранена до снимка полной копии, а зафиксирована после него: попадает в инкрементальную
+            late = self.create_article('Late Article')
+            Article.objects.filter(pk=late.pk).update(
+                time_update=parse_datetime(full['watermark']) - timedelta(seconds=1))
+            manifest = create_backup(incremental=True)
+            self.assertEqual(manifest['models']['blog.article']['rows'], 1)
+
 
 class SystemModelTest(TestCase):
     """
@@ -110,32 +462,180 @@ class SystemModelTest(TestCase):
 
     def test_profile_online_status(self):
         # Перед проверкой убедится что сервер Redis включен
+        redis = get_redis_connection()
+        redis.zrem(PRESENCE_KEY, self.user.id)
         # Проверяем, что изначально пользователь не онлайн
-        self.assertFalse(self.profile.is_online())
+        self.assertFalse(Profile.objects.get(pk=self.profile.pk).is_online())
+
+        # Отмечаем активность пользователя в множестве присутствия, повторная отметка в течение минуты не пишется
+        self.assertTrue(touch_presence(self.user.id))
+        self.assertFalse(touch_presence(self.user.id))
 
-        # Сохраняем время последней активности в кеш
-        cache.set(f'last-seen-{self.user.id}', timezone.now())
+        # Проверяем, что теперь пользователь онлайн (в том числе для списка профилей одним запросом)
+        self.assertTrue(Profile.objects.get(pk=self.profile.pk).is_online())
+        self.assertTrue(set_online_status([Profile.objects.get(pk=self.profile.pk)])[0].is_online())
 
-        # Проверяем, что теперь пользователь онлайн
-        self.assertTrue(self.profile.is_online())
+        # Время активности переносится в last_login периодической задачей
+        flush_presence()
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
 
         # Проверяем, что если время последней активности старше 300 секунд, пользователь не онлайн
-        cache.set(f'last-seen-{self.user.id}', timezone.now() - timezone.timedelta(seconds=301))
-        self.assertFalse(self.profile.is_online())
+        redis.zadd(PRESENCE_KEY, {self.user.id: time.time() - 301})
+        self.assertFalse(Profile.objects.get(pk=self.profile.pk).is_online())
+        redis.zrem(PRESENCE_KEY, self.user.id)
 
     def test_profile_avatar_url(self):
-        # Проверяем, что если у пользователя есть аватар, используется его URL
-        with tempfile.NamedTemporaryFile(suffix='.jpg') as temp_file:
-            avatar = SimpleUploadedFile('test_avatar.jpg', temp_file.read(), content_type='image/jpg')
+        # Проверяем, что загруженный аватар заменяется квадратными копиями размеров AVATAR_SIZES
+        image = BytesIO()
+        Image.new('RGB', (600, 400), 'blue').save(image, format='JPEG')
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            avatar = SimpleUploadedFile('test_avatar.jpg', image.getvalue(), content_type='image/jpg')
             self.profile.avatar = avatar
             self.profile.save()
 
-        expected_url = f'/media/{self.profile.avatar.name}'
-        self.assertEqual(self.profile.get_avatar, expected_url)
+            expected_url = f'/media/{self.profile.avatar.name}'
+            self.assertEqual(self.profile.get_avatar, expected_url)
+            self.assertTrue(self.profile.get_avatar_url(100).endswith('-120.jpg'))
+            with Image.open(self.profile.avatar.path) as saved:
+                self.assertEqual(saved.size, (240, 240))
+
+            # Проверяем, что если у пользователя нет аватара, используется локальный идентикон
+            self.profile.avatar = None
+            self.profile.save()
+            self.assertTrue(self.profile.get_avatar.startswith('/media/images/avatars/identicons/'))
+            self.assertEqual(self.profile.get_avatar, self.profile.get_avatar_url(60))
+
+
+
+class MediaReprocessTest(SimpleTestCase):
+    """
+    Тестирование пересжатия медиа (reprocess_media) во временном MEDIA_ROOT
+    """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def create_image(self, name, size=(300, 200)):
+        # PNG без сжатия: пересжатие заметно уменьшает файл
+        path = Path(self.media_root, name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Image.new('RGB', size, 'green').save(path, format='PNG', compress_level=0)
+        return path
+
+    def test_recompress_image(self):
+        path = self.create_image('images/thumbnail/large.png')
+        size = path.stat().st_size
+        _, size_before, size_after, digest, error = recompress_image(path)
+        self.assertIsNone(error)
+        self.assertEqual(size_before, size)
+        self.assertLess(size_after, size_before)
+        self.assertEqual(path.stat().st_size, size_after)
+        self.assertEqual(digest, file_digest(path))
+
+        # Повторное пересжатие не уменьшает файл: он не перезаписывается
+        content = path.read_bytes()
+        _, size_before, size_after, _, error = recompress_image(path)
+        self.assertEqual((size_after, error), (size_before, None))
+        self.assertEqual(path.read_bytes(), content)
+
+        # Поврежденный файл возвращает ошибку и остается на месте
+        broken = Path(self.media_root, 'images/thumbnail/broken.jpg')
+        broken.write_bytes(b'not an image')
+        _, _, _, digest, error = recompress_image(broken)
+        self.assertIsNone(digest)
+        self.assertTrue(error)
+        self.assertEqual(broken.read_bytes(), b'not an image')
+
+    def test_reprocess_media(self):
+        first = self.create_image('images/thumbnail/first.png')
+        self.create_image('uploads/2024/01/01/second.png')
+        stored = self.create_image('uploads/cas/ab/stored.png')
+        stored_content = stored.read_bytes()
+        Path(self.media_root, 'uploads/broken.jpg').write_bytes(b'not an image')
+        manifest = Path(self.media_root, settings.MEDIA_REPROCESS_MANIFEST)
+
+        # Пробный запуск ничего не записывает
+        content = first.read_bytes()
+        stats = reprocess_media(workers=1, dry_run=True)
+        self.assertEqual((stats['files'], stats['errors']), (3, 1))
+        self.assertLess(stats['bytes_after'], stats['bytes_before'])
+        self.assertEqual(first.read_bytes(), content)
+        self.assertFalse(manifest.exists())
+
+        errors = []
+        stats = reprocess_media(workers=1, log=errors.append)
+        self.assertEqual((stats['files'], stats['skipped'], stats['errors']), (3, 0, 1))
+        self.assertEqual(len(errors), 1)
+        self.assertLess(first.stat().st_size, len(content))
+        # файлы редактора по хешу не пересжимаются
+        self.assertEqual(stored.read_bytes(), stored_content)
+
+        # Повторный запуск продолжает по манифесту: неизмененные файлы пропускаются, измененный обрабатывается
+        self.create_image('images/thumbnail/first.png', size=(310, 200))
+        stats = reprocess_media(workers=1)
+        self.assertEqual((stats['files'], stats['skipped']), (2, 1))
+
+
+class MediaBackupTest(SimpleTestCase):
+    """
+    Тестирование инкрементальных снимков медиа во временных каталогах
+    """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.backup_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root, MEDIA_BACKUP_ROOT=self.backup_root)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+        shutil.rmtree(self.backup_root)
+
+    def write(self, name, content):
+        path = Path(self.media_root, name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        return path
+
+    def test_media_snapshots(self):
+        self.write('images/thumbnail/first.jpg', b'first image')
+        self.write('uploads/second.png', b'second image')
+        self.write('sitemaps/sitemap.xml', b'<sitemapindex/>')
+
+        # Первый снимок копирует все файлы, кроме исключенных каталогов
+        first = create_media_snapshot(workers=1)
+        self.assertEqual((first['files'], first['copied'], first['linked']), (2, 2, 0))
+        self.assertFalse(Path(self.backup_root, first['name'], 'sitemaps').exists())
+
+        # Второй снимок: неизмененный файл - жесткая ссылка, переименованный - ссылка по хешу, новый - копия
+        Path(self.media_root, 'uploads/second.png').rename(Path(self.media_root, 'uploads/renamed.png'))
+        self.write('uploads/third.png', b'third image')
+        second = create_media_snapshot(workers=1)
+        self.assertNotEqual(first['name'], second['name'])
+        self.assertEqual((second['files'], second['copied'], second['linked']), (3, 1, 2))
+        first_dir, second_dir = Path(self.backup_root, first['name']), Path(self.backup_root, second['name'])
+        self.assertEqual((second_dir / 'images/thumbnail/first.jpg').stat().st_ino,
+                         (first_dir / 'images/thumbnail/first.jpg').stat().st_ino)
+        self.assertEqual((second_dir / 'uploads/renamed.png').stat().st_ino,
+                         (first_dir / 'uploads/second.png').stat().st_ino)
+        self.assertFalse((second_dir / 'uploads/second.png').exists())
 
-        # Проверяем, что если у пользователя нет аватара, используется URL с ui-avatars.com
-        self.profile.avatar = None
-        self.profile.save()
-        expected_url = f'https://ui-avatars.com/api/?size=190&background=random&name={self.profile.slug}'
-        self.assertEqual(self.profile.get_avatar, expected_url)
+        # Снимки, созданные подряд, упорядочены по времени создания
+        names = [first['name'], second['name']] + [create_media_snapshot(workers=1)['name'] for _ in range(10)]
+        self.assertEqual(get_media_snapshots(), names)
 
+        # Проверка снимка находит поврежденные и отсутствующие файлы
+        self.assertEqual(verify_media_snapshot(second['name'], workers=1)['corrupted'], [])
+        (second_dir / 'uploads/third.png').write_bytes(b'corrupted')
+        (second_dir / 'images/thumbnail/first.jpg').unlink()
+        result = verify_media_snapshot(second['name'], workers=1)
+        self.assertEqual(result['corrupted'], ['uploads/third.png'])
+        self.assertEqual(result['missing'], ['images/thumbnail/first.jpg'])
@@ -1,11 +1,27 @@
+import shutil
+import tempfile
+import time
 from django.core import mail
-from django.test import TestCase
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.template import Template, Context
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
 from django.core.files.uploadedfile import SimpleUploadedFile
 
-from modules.blog.models import Article, Category, Comment, Rating, ViewCount
+from modules.blog.models import Article, Category, Comment, DailyViewCount, Rating, ViewCount
 from modules.blog.forms import ArticleCreateForm, ArticleUpdateForm, CommentCreateForm
+from modules.blog.templatetags.blog_tags import get_sidebar_fragments, popular_articles
+from modules.services.fragments import bump_fragment_version, render_fragments
+from modules.services.page_cache import SURROGATE_KEY, cache_page
+from modules.services.presence import PRESENCE_KEY
+from modules.services.timeline import TIMELINE_CELEBRITIES_KEY, TIMELINE_KEY, follow_authors, push_article, \
+    remove_article, unfollow_authors
+from modules.services.utils import get_redis_connection
+from modules.services.view_counter import flush_view_buffer, get_unique_visitors, sync_hll_view_counts, \
+    VIEW_BUFFER_KEY, VIEW_BUFFER_PROCESSING_KEY
 
 
 class BlogViewTestCase(TestCase):
@@ -14,6 +30,14 @@ class BlogViewTestCase(TestCase):
     """
 
     def setUp(self):
+        # кеш страниц и фрагментов не должен переживать пересоздание тестовой БД
+        cache.clear()
+        # файлы (превью, аватары) сохраняются во временный MEDIA_ROOT, а не в media проекта
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
         self.user = User.objects.create_user(username='testuser', password='testpassword')
 
         # Создаем категорию
@@ -70,6 +94,143 @@ class BlogViewTestCase(TestCase):
         self.assertEqual(response.context['title'], 'Главная страница')
         self.assertEqual(len(response.context['articles']), 2)
 
+    @override_settings(PAGINATION_MODE='cursor')
+    def test_article_list_view_cursor_pagination(self):
+        for number in range(5):
+            Article.objects.create(
+                title=f'Test Article {number}',
+                short_description='Short description',
+                full_description='Full description',
+                author=self.user,
+                thumbnail=self.image,
+                category=self.category,
+            )
+        response = self.client.get(reverse('home'))
+        first_page = response.context['page_obj']
+        self.assertEqual(len(response.context['articles']), 3)
+        self.assertTrue(first_page.has_next())
+        self.assertFalse(first_page.has_previous())
+
+        response = self.client.get(f'{reverse("home")}?{first_page.next_querystring}')
+        second_page = response.context['page_obj']
+        self.assertEqual(len(response.context['articles']), 2)
+        self.assertFalse(second_page.has_next())
+        self.assertTrue(second_page.has_previous())
+
+        # Старые ссылки с номером страницы продолжают работать
+        response = self.client.get(f'{reverse("home")}?page=2')
+        self.assertEqual(response.context['page_obj'].number, 2)
+
+    @override_settings(PAGINATION_MODE='cursor')
+    def test_search_cursor_pagination(self):
+        # Статьи с одинаковым рангом не повторяются и не теряются на границе страниц
+        articles = [
+            Article.objects.create(title=f'Ranked {number}', short_description='Short',
+                                   full_description='<p>Identical ranked text</p>', author=self.user,
+                                   thumbnail=self.image, category=self.category)
+            for number in range(7)
+        ]
+        response = self.client.get(reverse('search'), {'do': 'identical'})
+        found = [article.id for article in response.context['articles']]
+        self.assertEqual(len(found), 5)
+        response = self.client.get(f'{reverse("search")}?{response.context["page_obj"].next_querystring}')
+        found += [article.id for article in response.context['articles']]
+        self.assertEqual(found, sorted(article.id for article in articles))
+        self.assertFalse(response.context['page_obj'].has_next())
+
+    @override_settings(PAGINATION_MODE='cursor')
+    def test_articles_by_signed_user_timeline(self):
+        redis = get_redis_connection()
+        reader = User.objects.create_user(username='reader', password='testpassword')
+        celebrity = User.objects.create_user(username='celebrity', password='testpassword')
+        timeline_key = TIMELINE_KEY.format(profile_id=reader.profile.id)
+        redis.delete(timeline_key, TIMELINE_CELEBRITIES_KEY)
+        reader.profile.following.add(self.user.profile)
+
+        def create_articles(author, count):
+            return [Article.objects.create(title=f'{author.username} {number}', short_description='Short',
+                                           full_description='Full', author=author, thumbnail=self.image,
+                                           category=self.category) for number in range(count)]
+
+        # fan-out при публикации: статья попадает в ленту подписчика
+        articles = create_articles(self.user, 3)
+        for article in articles:
+            self.assertEqual(push_article(article.id), 1)
+        self.assertEqual(redis.zcard(timeline_key), 3)
+
+        # отписка убирает статьи автора из ленты, повторная подписка возвращает их
+        unfollow_authors(reader.profile.id, [self.user.profile.id])
+        self.assertEqual(redis.zcard(timeline_key), 0)
+        follow_authors(reader.profile.id, [self.user.profile.id])
+        self.assertEqual(redis.zcard(timeline_key), 3)
+
+        # статьи популярного автора не рассылаются и не добавляются при подписке, а подмешиваются при чтении
+        reader.profile.following.add(celebrity.profile)
+        with override_settings(TIMELINE_FANOUT_LIMIT=0):
+            celebrity_articles = create_articles(celebrity, 3)
+            for article in celebrity_articles:
+                self.assertEqual(push_article(article.id), 0)
+        follow_authors(reader.profile.id, [celebrity.profile.id])
+        self.assertEqual(redis.zcard(timeline_key), 3)
+
+        self.client.force_login(reader)
+        response = self.client.get(reverse('articles_by_signed_user'))
+        expected = [article.id for article in reversed(articles + celebrity_articles)]
+        first_page = response.context['page_obj']
+        self.assertEqual([article.id for article in response.context['articles']], expected[:5])
+        self.assertTrue(first_page.has_next())
+
+        response = self.client.get(f'{reverse("articles_by_signed_user")}?{first_page.next_querystring}')
+        self.assertEqual([article.id for article in response.context['articles']], expected[5:])
+        self.assertFalse(response.context['page_obj'].has_next())
+
+        response = self.client.get(f'{reverse("articles_by_signed_user")}?cursor=broken')
+        self.assertEqual(response.status_code, 404)
+
+        # Старые ссылки с номером страницы продолжают работать
+        response = self.client.get(f'{reverse("articles_by_signed_user")}?page=2')
+        self.assertEqual(response.context['page_obj'].number, 2)
+        self.assertEqual(len(response.context['articles']), 1)
+        redis.delete(timeline_key, TIMELINE_CELEBRITIES_KEY)
+
+    @override_settings(PAGINATION_MODE='cursor')
+    def test_timeline_same_time_and_stale_articles(self):
+        redis = get_redis_connection()
+        reader = User.objects.create_user(username='reader', password='testpassword')
+        timeline_key = TIMELINE_KEY.format(profile_id=reader.profile.id)
+        redis.delete(timeline_key, TIMELINE_CELEBRITIES_KEY)
+        reader.profile.following.add(self.user.profile)
+        articles = [Article.objects.create(title=f'Same time {number}', short_description='Short',
+                                           full_description='Full', author=self.user, thumbnail=self.image,
+                                           category=self.category) for number in range(9)]
+        Article.objects.filter(pk__in=[article.pk for article in articles]).update(time_create=timezone.now())
+        for article in articles:
+            push_article(article.id)
+
+        # удаленная и снятая с публикации статьи убираются из ленты при чтении, страница остается полной
+        Article.objects.filter(pk=articles[-1].pk).delete()
+        Article.objects.filter(pk=articles[-2].pk).update(status='draft')
+        # снятие с публикации через рассылку удаляет статью из лент сразу
+        Article.objects.filter(pk=articles[0].pk).update(status='draft')
+        self.assertEqual(push_article(articles[0].id), 1)
+        self.assertEqual(redis.zcard(timeline_key), 8)
+
+        self.client.force_login(reader)
+        found = []
+        url = reverse('articles_by_signed_user')
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(len(response.context['articles']), 5 if not found else 1)
+            found += [article.id for article in response.context['articles']]
+            page = response.context['page_obj']
+            url = f'{reverse("articles_by_signed_user")}?{page.next_querystring}' if page.has_next() else None
+        self.assertEqual(found, [article.id for article in reversed(articles[1:-2])])
+        self.assertEqual(redis.zcard(timeline_key), 6)
+
+        self.assertEqual(remove_article(articles[1].id, self.user.id), 1)
+        self.assertEqual(redis.zcard(timeline_key), 5)
+        redis.delete(timeline_key, TIMELINE_CELEBRITIES_KEY)
+
     def test_article_detail_view(self):
         # Создаем статью
         article = Article.objects.create(
@@ -87,6 +248,344 @@ class BlogViewTestCase(TestCase):
         self.assertEqual(response.context['form'].__name__, CommentCreateForm.__name__)
         self.assertQuerysetEqual(response.context['similar_articles'], Article.objects.none())
 
+    @override_settings(VIEW_COUNT_MODE='buffered')
+    def test_article_detail_view_buffered_views(self):
+        # Перед проверкой убедится что сервер Redis включен
+        get_redis_connection().delete(VIEW_BUFFER_KEY, VIEW_BUFFER_PROCESSING_KEY)
+        article = Article.objects.create(
+            title='Test Article',
+            short_description='Test short_description',
+            full_description='Test full_description',
+            author=self.user,
+            thumbnail=self.image,
+            category=self.category,
+            status='published',
+        )
+        url = reverse('articles_detail', args=[article.slug])
+        self.client.get(url)
+        self.client.get(url)
+        self.client.get(url, REMOTE_ADDR='127.0.0.2')
+
+        # Просмотры копятся в буфере и не пишутся в БД во время запроса
+        self.assertEqual(ViewCount.objects.filter(article=article).count(), 0)
+
+        flush_view_buffer()
+        self.assertEqual(ViewCount.objects.filter(article=article).count(), 2)
+
+    @override_settings(VIEW_COUNT_MODE='hll')
+    def test_article_detail_view_hll_views(self):
+        # Перед проверкой убедится что сервер Redis включен
+        redis = get_redis_connection()
+        for key in redis.scan_iter('blog:views:hll:*'):
+            redis.delete(key)
+        article = Article.objects.create(
+            title='Test Article',
+            short_description='Test short_description',
+            full_description='Test full_description',
+            author=self.user,
+            thumbnail=self.image,
+            category=self.category,
+            status='published',
+        )
+        url = reverse('articles_detail', args=[article.slug])
+        self.client.get(url)
+        self.client.get(url)
+        self.client.get(url, REMOTE_ADDR='127.0.0.2')
+
+        # Уникальные посетители считаются в HyperLogLog без записей в БД
+        self.assertEqual(ViewCount.objects.filter(article=article).count(), 0)
+        self.assertEqual(article.get_view_count(), 2)
+        self.assertEqual(get_unique_visitors(article.id), {'today': 2, 'week': 2, 'month': 2, 'total': 2})
+
+        sync_hll_view_counts()
+        article.refresh_from_db()
+        self.assertEqual(article.view_count, 2)
+
+    def test_hll_views_keep_database_counts(self):
+        # Переход в режим 'hll': просмотры из БД не теряются, известные IP-адреса не засчитываются повторно
+        redis = get_redis_connection()
+        for key in redis.scan_iter('blog:views:hll:*'):
+            redis.delete(key)
+        article = Article.objects.create(title='Test Article', short_description='Short', full_description='Full',
+                                         author=self.user, thumbnail=self.image, category=self.category)
+        ViewCount.objects.create(article=article, ip_address='127.0.0.1')
+        ViewCount.objects.create(article=article, ip_address='127.0.0.2')
+        DailyViewCount.objects.create(article=article, date=timezone.localdate(), views=5)
+
+        with override_settings(VIEW_COUNT_MODE='hll'):
+            sync_hll_view_counts()
+            article.refresh_from_db()
+            self.assertEqual(article.view_count, 7)
+            self.client.get(reverse('articles_detail', args=[article.slug]))
+            self.client.get(reverse('articles_detail', args=[article.slug]), REMOTE_ADDR='127.0.0.3')
+            self.assertEqual(article.get_view_count(), 8)
+            self.assertEqual(get_unique_visitors(article.id)['total'], 8)
+            sync_hll_view_counts()
+            article.refresh_from_db()
+            self.assertEqual(article.view_count, 8)
+
+    def test_popular_articles(self):
+        # Перед проверкой убедится что сервер Redis включен
+        redis = get_redis_connection()
+        for key in redis.scan_iter('blog:popular:*'):
+            redis.delete(key)
+        first, second = [Article.objects.create(
+            title=f'Test Article {number}',
+            short_description='Test short_description',
+            full_description='Test full_description',
+            author=self.user,
+            thumbnail=self.image,
+            category=self.category,
+            status='published',
+        ) for number in range(2)]
+        self.client.get(reverse('articles_detail', args=[first.slug]))
+        self.client.get(reverse('articles_detail', args=[second.slug]))
+        self.client.get(reverse('articles_detail', args=[second.slug]), REMOTE_ADDR='127.0.0.2')
+        # Повторный просмотр с того же IP не увеличивает популярность
+        self.client.get(reverse('articles_detail', args=[first.slug]))
+
+        # Объединение часовых счетчиков кешируется на минуту (его уже построил сайдбар первой страницы)
+        for key in redis.scan_iter('blog:popular:window:*'):
+            redis.delete(key)
+        articles = popular_articles()
+        self.assertEqual(articles, [second, first])
+        self.assertEqual(articles[0].total_view_count, 2)
+
+        # Заголовок блока выводит окно популярности из настроек
+        with override_settings(POPULAR_ARTICLES_WINDOW_DAYS=3):
+            html = render_fragments(get_sidebar_fragments(), force=True)['sidebar_popular_articles']
+        self.assertIn('Популярные статьи за 3 дн.', html)
+        bump_fragment_version('sidebar_popular_articles')
+
+    def test_article_comment_threads(self):
+        article = Article.objects.create(
+            title='Test Article',
+            short_description='Test short_description',
+            full_description='Test full_description',
+            author=self.user,
+            thumbnail=self.image,
+            category=self.category,
+            status='published',
+        )
+        root = Comment.objects.create(article=article, author=self.user, content='Root comment')
+        draft = Comment.objects.create(article=article, author=self.user, content='Draft comment', parent=root,
+                                       status='draft')
+        Comment.objects.create(article=article, author=self.user, content='Reply to draft', parent=draft)
+
+        # В ветке выводятся только опубликованные комментарии (сайдбар с последними комментариями не проверяется)
+        response = self.client.get(reverse('articles_detail', args=[article.slug]))
+        threads = response.context['comment_threads']
+        self.assertIn('Root comment', threads)
+        self.assertNotIn('Draft comment', threads)
+        self.assertNotIn('Reply to draft', threads)
+
+        # Новый ответ инвалидирует закешированную ветку
+        Comment.objects.create(article=article, author=self.user, content='New reply', parent=root)
+        response = self.client.get(reverse('comment_threads', args=[article.pk]),
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertIn('New reply', response.json()['html'])
+        self.assertFalse(response.json()['has_next'])
+
+        # Комментарии черновиков и несуществующих статей не отдаются
+        article.status = 'draft'
+        article.save()
+        self.assertEqual(self.client.get(reverse('comment_threads', args=[article.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('comment_threads', args=[article.pk + 1000])).status_code, 404)
+
+    def test_comment_create_validation(self):
+        article = Article.objects.create(title='Comment Article', short_description='Short', full_description='Full',
+                                         author=self.user, thumbnail=self.image, category=self.category)
+        other_article = Article.objects.create(title='Other Article', short_description='Short',
+                                               full_description='Full', author=self.user, thumbnail=self.image,
+                                               category=self.category)
+        foreign = Comment.objects.create(article=other_article, author=self.user, content='Foreign comment')
+        self.client.force_login(self.user)
+        url = reverse('comment_create_view', args=[article.pk])
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+        # Ответ на несуществующий комментарий или комментарий другой статьи - 400
+        for parent in (foreign.pk, foreign.pk + 1000):
+            response = self.client.post(url, {'content': 'Reply', 'parent': parent}, **ajax)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('parent', response.json()['error'])
+
+        # Ветка ограничена Comment.MAX_DEPTH уровнями
+        parent = None
+        for _ in range(Comment.MAX_DEPTH):
+            parent = Comment.objects.create(article=article, author=self.user, content='Deep', parent=parent)
+        self.assertEqual(parent.level, Comment.MAX_DEPTH - 1)
+        response = self.client.post(url, {'content': 'Too deep', 'parent': parent.pk}, **ajax)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, {'content': 'Reply', 'parent': parent.parent_id}, **ajax)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Comment.objects.get(pk=response.json()['id']).level, Comment.MAX_DEPTH - 1)
+
+        response = self.client.post(reverse('comment_create_view', args=[article.pk + 1000]), {'content': 'Lost'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_article_search(self):
+        def create_article(title, full_description):
+            return Article.objects.create(title=title, short_description='Short', full_description=full_description,
+                                          author=self.user, thumbnail=self.image, category=self.category)
+
+        # Совпадение в заголовке (вес A) выше совпадения в тексте (вес B)
+        in_text = create_article('First article', '<p>Recipe of an apple pie</p>')
+        in_title = create_article('Pie for dinner', '<p>Simple recipe</p>')
+        create_article('Other article', '<p>Nothing in common</p>')
+        response = self.client.get(reverse('search'), {'do': 'pie'})
+        self.assertEqual([article.id for article in response.context['articles']], [in_title.id, in_text.id])
+        self.assertContains(response, '<mark>pie</mark>')
+
+        # Разметка из текста статьи не попадает в подсветку неэкранированной
+        create_article('Unsafe article', '<p>&lt;script&gt;alert(1)&lt;/script&gt; unsafe pie '
+                                         '<img src=x onerror=alert(2)//')
+        response = self.client.get(reverse('search'), {'do': 'unsafe'})
+        self.assertEqual(len(response.context['articles']), 1)
+        self.assertNotContains(response, '<script>alert(1)')
+        self.assertNotContains(response, '<img src=x')
+        self.assertContains(response, 'alert(1)&lt;/script&gt; <mark>unsafe</mark> pie &lt;img src=x')
+
+    def test_page_cache(self):
+        # Перед проверкой убедится что сервер Redis включен
+        article = Article.objects.create(
+            title='Test Article',
+            short_description='Test short_description',
+            full_description='Test full_description',
+            author=self.user,
+            thumbnail=self.image,
+            category=self.category,
+            status='published',
+        )
+        url = reverse('articles_detail', args=[article.slug])
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertIn(f'article:{article.pk}', response['Surrogate-Key'])
+
+        # Новый комментарий сбрасывает страницу статьи, но не главную
+        self.client.get(reverse('home'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(article=article, author=self.user, content='Purge comment')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Purge comment')
+        self.assertEqual(self.client.get(reverse('home'))['X-Cache'], 'HIT')
+
+        # Авторизованным пользователям страницы из кеша не отдаются
+        self.client.login(username='testuser', password='testpassword')
+        self.assertFalse(self.client.get(url).has_header('X-Cache'))
+
+        # Страница с коротким сроком жизни не сокращает TTL общего индекса ключа сброса
+        redis = get_redis_connection()
+        index_key = SURROGATE_KEY.format(key='ttl-check')
+        redis.delete(index_key)
+        cache_page(RequestFactory().get('/long/'), HttpResponse('long'), ['ttl-check'], timeout=600)
+        cache_page(RequestFactory().get('/short/'), HttpResponse('short'), ['ttl-check'], timeout=60)
+        self.assertGreater(redis.ttl(index_key), 60)
+        self.assertEqual(redis.scard(index_key), 2)
+        redis.delete(index_key)
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    def test_article_detail_conditional_get(self):
+        article = Article.objects.create(
+            title='Test Article',
+            short_description='Test short_description',
+            full_description='Test full_description',
+            author=self.user,
+            thumbnail=self.image,
+            category=self.category,
+            status='published',
+        )
+        url = reverse('articles_detail', args=[article.slug])
+        # первый просмотр увеличивает счетчик просмотров, входящий в ETag
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        # Ответ 304 без рендеринга: агрегирующий запрос и запись просмотра (повторный просмотр с того же IP)
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Просмотр с нового адреса учитывается и при ответе 304
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(article.views.filter(ip_address='10.0.0.2').exists())
+        self.assertNotEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.client.get(url)
+
+        # Новый комментарий меняет ETag
+        Comment.objects.create(article=article, author=self.user, content='New comment')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+        # Счетчик просмотров меняет ETag статьи и списка, хотя time_update не меняется
+        list_response = self.client.get(reverse('home'))
+        self.client.get(url, REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=list_response['ETag']).status_code, 200)
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    def test_article_list_conditional_get(self):
+        response = self.client.get(reverse('home'))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(reverse('latest_articles_feed'))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('latest_articles_feed'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_article_feeds(self):
+        # Перед проверкой убедится что сервер Redis включен
+        article = Article.objects.create(
+            title='Test Article',
+            short_description='Test short_description',
+            full_description='Test full_description',
+            author=self.user,
+            thumbnail=self.image,
+            category=self.category,
+            status='published',
+        )
+        article.tags.add('feed-tag')
+        urls = [
+            reverse('latest_articles_feed'),
+            reverse('category_articles_feed', args=[self.category.slug]),
+            reverse('tag_articles_feed', args=['feed-tag']),
+            reverse('author_articles_feed', args=[self.user.profile.slug]),
+        ]
+        for url in urls:
+            response = self.client.get(url)
+            self.assertEqual(response['X-Cache'], 'MISS')
+            self.assertContains(response, 'Test Article')
+
+            # Повторный опрос ленты - только чтение из кеша
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        # Публикация статьи сбрасывает ленты
+        with self.captureOnCommitCallbacks(execute=True):
+            Article.objects.create(title='Fresh Article', short_description='Fresh', full_description='Fresh',
+                                   author=self.user, category=self.category, status='published')
+        self.assertContains(self.client.get(urls[0]), 'Fresh Article')
+        self.assertContains(self.client.get(urls[1]), 'Fresh Article')
+        self.assertEqual(self.client.get(urls[2])['X-Cache'], 'HIT')
+
+    def test_sidebar_fragment_cache(self):
+        # Перед проверкой убедится что сервер Redis включен
+        sidebar = Template('{% load blog_tags %}{% sidebar %}')
+        sidebar.render(Context())
+
+        # Прогретый сайдбар отдается из кеша без запросов к БД
+        with self.assertNumQueries(0):
+            sidebar.render(Context())
+
+        # Изменение категорий инвалидирует блок категорий
+        Category.objects.create(title='New Category', slug='new-category', description='New category')
+        self.assertIn('New Category', sidebar.render(Context()))
+
     def test_article_deletion(self):
         # Создаем статью, которую попытаемся удалить
         article = Article.objects.create(
@@ -115,6 +614,12 @@ class SystemViewsTestCase(TestCase):
     Тесты views для приложения System
     """
     def setUp(self):
+        # файлы (превью, аватары) сохраняются во временный MEDIA_ROOT, а не в media проекта
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
         self.user = User.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
         self.profile = self.user.profile
 
@@ -124,6 +629,18 @@ class SystemViewsTestCase(TestCase):
         self.assertContains(response, self.profile.user.username)
         self.assertContains(response, 'Страница пользователя')
 
+    def test_profile_detail_online_status(self):
+        redis = get_redis_connection()
+        follower = User.objects.create_user(username='follower', password='testpassword')
+        follower.profile.following.add(self.profile)
+        redis.zrem(PRESENCE_KEY, self.user.id)
+        redis.zadd(PRESENCE_KEY, {follower.id: time.time()})
+        response = self.client.get(reverse('profile_detail', args=[self.profile.slug]))
+        self.assertEqual([profile.online for profile in response.context['followers']], [True])
+        self.assertFalse(response.context['profile'].online)
+        self.assertContains(response, 'border border-success')
+        redis.zrem(PRESENCE_KEY, follower.id)
+
     def test_profile_update_view(self):
         self.client.force_login(self.user)
         response = self.client.get(reverse('profile_edit'))